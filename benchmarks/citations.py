@@ -0,0 +1,74 @@
+"""Time citation parsing over dense interpretation paragraphs, i.e.
+Supplement I comments which list dozens of paragraphs. Run from the root of
+the repository:
+
+    $ python -m benchmarks.citations --citations 60
+"""
+import argparse
+import timeit
+
+from regparser.citations import (
+    internal_citations, Label, ParagraphCitation, remove_sub_citations)
+
+
+def dense_paragraph(num_citations):
+    """A comment citing many paragraphs, comments and sections"""
+    cited = []
+    for idx in range(num_citations):
+        section, letter = 2 + idx // 26, chr(ord('a') + idx % 26)
+        if idx % 3 == 0:
+            cited.append('comment %d(%s)-%d' % (section, letter, idx % 4 + 1))
+        elif idx % 3 == 1:
+            cited.append('paragraph (%s)(%d)' % (letter, idx % 9 + 1))
+        else:
+            cited.append(u'\xa7 1005.%d(%s)' % (section, letter))
+    return (u'1. Scope. For purposes of this comment, see '
+            + u', '.join(cited[:-1]) + u', and ' + cited[-1] + u'.')
+
+
+def pairwise_remove_sub_citations(citations):
+    """The quadratic approach, for comparison"""
+    return [cit for cit in citations
+            if not any(cit in other for other in citations)]
+
+
+def clustered_citations(num_citations, per_clause=5):
+    """Citations as found in a long list: clauses (which share a full span)
+    of several paragraphs, each also found on its own"""
+    citations = []
+    for clause_start in range(0, num_citations * 10, per_clause * 10):
+        clause_end = clause_start + per_clause * 10
+        for start in range(clause_start, clause_end, 10):
+            citations.append(ParagraphCitation(
+                start, start + 8, Label(), full_start=clause_start,
+                full_end=clause_end, in_clause=True))
+            citations.append(ParagraphCitation(start, start + 8, Label()))
+    return citations
+
+
+def run(label, fn, repeat):
+    seconds = timeit.timeit(fn, number=repeat) / repeat
+    print("%-40s %10.3f ms" % (label, seconds * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--citations', type=int, default=60,
+                        help='Number of citations per paragraph')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    text = dense_paragraph(args.citations)
+    label = Label(part='1005', comment=True)
+    print("%d characters, %d citations found" % (
+        len(text), len(internal_citations(text, label))))
+    run('internal_citations', lambda: internal_citations(text, label),
+        args.repeat)
+
+    citations = clustered_citations(args.citations * 10)
+    assert (remove_sub_citations(citations)
+            == pairwise_remove_sub_citations(citations))
+    run('remove_sub_citations (%d)' % len(citations),
+        lambda: remove_sub_citations(citations), args.repeat)
+    run('pairwise (%d)' % len(citations),
+        lambda: pairwise_remove_sub_citations(citations), args.repeat)
@@ -0,0 +1,96 @@
+"""Time diffing wide trees, i.e. sections with hundreds of children such as
+definitions, appendix tables and Supplement I comments. Run from the root of
+the repository:
+
+    $ python -m benchmarks.diffs --width 500
+"""
+import argparse
+import timeit
+
+from regparser.diff import tree as difftree
+from regparser.tree.struct import FrozenNode
+
+
+def wide_tree(width, version):
+    """A part with one very wide section. Each version modifies, removes and
+    adds some of its paragraphs"""
+    paragraphs = []
+    for idx in range(width):
+        if version and idx % 50 == 7:     # removed
+            continue
+        text = u'(%d) Term %d means something.' % (idx, idx)
+        if version and idx % 10 == 3:     # modified
+            text += u' Revised.'
+        label = ['1005', '2', str(idx)]
+        paragraphs.append(FrozenNode(text, label=label, children=[
+            FrozenNode(u'(%s) Detail.' % sub, label=label + [sub])
+            for sub in ('i', 'ii', 'iii')]))
+    if version:
+        paragraphs.extend(FrozenNode(u'(%d) Added.' % idx,
+                                     label=['1005', '2', str(idx)])
+                          for idx in range(width, width + width // 20))
+    section = FrozenNode(u'', label=['1005', '2'], children=paragraphs)
+    return FrozenNode(u'', label=['1005'], children=[
+        section, FrozenNode(u'Unchanged', label=['1005', '3'])])
+
+
+def nested_changes_between(lhs, rhs):
+    """The nested-loop alignment (with linear membership tests), for
+    comparison"""
+    changes = []
+    if lhs == rhs:
+        return changes
+    changes.extend(difftree._local_changes(lhs, rhs))
+
+    def new_in_rhs(lhs_list, rhs_list):
+        lhs_codes = tuple(n.label_id for n in lhs_list)
+        return [n for n in rhs_list if n.label_id not in lhs_codes]
+
+    removed_children = new_in_rhs(rhs.children, lhs.children)
+    changes.extend(map(difftree._data_for_delete, removed_children))
+    possibly_moved = {}
+    for child in removed_children:
+        for grandchild in child.children:
+            possibly_moved[grandchild.label_id] = grandchild
+    for added in new_in_rhs(lhs.children, rhs.children):
+        changes.append(difftree._data_for_add(added))
+        for grandchild in added.children:
+            if grandchild.label_id in possibly_moved:
+                changes.extend(nested_changes_between(
+                    possibly_moved[grandchild.label_id], grandchild))
+                del possibly_moved[grandchild.label_id]
+            else:
+                changes.extend(difftree.struct.walk(
+                    grandchild, difftree._data_for_add))
+    for removed in possibly_moved.values():
+        changes.extend(difftree.struct.walk(removed,
+                                            difftree._data_for_delete))
+    for lhs_child in lhs.children:
+        for rhs_child in rhs.children:
+            if lhs_child.label_id == rhs_child.label_id:
+                changes.extend(nested_changes_between(lhs_child, rhs_child))
+    return changes
+
+
+def run(label, fn, repeat):
+    seconds = timeit.timeit(fn, number=repeat) / repeat
+    print("%-40s %10.3f ms" % (label, seconds * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--width', type=int, default=500,
+                        help='Number of paragraphs in the wide section')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    lhs, rhs = wide_tree(args.width, 0), wide_tree(args.width, 1)
+    changes = difftree.changes_between(lhs, rhs)
+    assert changes == nested_changes_between(lhs, rhs)
+    print("%d and %d paragraphs, %d changes" % (
+        len(lhs.children[0].children), len(rhs.children[0].children),
+        len(changes)))
+    run('changes_between', lambda: difftree.changes_between(lhs, rhs),
+        args.repeat)
+    run('nested loops', lambda: nested_changes_between(lhs, rhs),
+        args.repeat)
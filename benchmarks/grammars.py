@@ -0,0 +1,122 @@
+# vim: set encoding=utf-8
+"""Time our pyparsing grammars with pyparsing's getTokensEndLoc (which
+keep_pos used to call), as they are now, and with packrat parsing,
+checking that each produces the same matches. Run from the root of the
+repository:
+
+    $ python -m benchmarks.grammars --corpus paragraphs.txt
+
+The corpus is a text file of paragraphs separated by blank lines; a small
+sample of typical paragraphs is used if none is provided.
+"""
+import argparse
+import codecs
+import timeit
+
+import pyparsing
+
+from regparser import grammar
+from regparser.grammar import utils
+
+
+GRAMMARS = (
+    ('amdpar', 'token_patterns'),
+    ('delays', 'tokenizer'),
+    ('external_citations', 'regtext_external_citation'),
+    ('interpretation_headers', 'parser'),
+    ('terms', 'scope_term_type_parser'),
+    ('terms', 'smart_quotes'),
+    ('unified', 'any_depth_p'),
+    ('unified', 'marker_comment'),
+    ('unified', 'multiple_comments'),
+    ('unified', 'multiple_non_comments'),
+)
+
+SAMPLE = [
+    u'1. In § 1005.2, revise paragraphs (a)(1) and (b)(2)(ii) and add '
+    u'paragraph (c) to read as follows:',
+    u'3. In Supplement I to part 1005, under Section 1005.7, paragraph '
+    u'7(b)(1), paragraphs 1 and 2 are revised and paragraph 3 is removed.',
+    u'(b) Definitions. For purposes of this subpart, the term “remittance '
+    u'transfer provider” means any person that provides remittance '
+    u'transfers for a consumer in the normal course of its business.',
+    u'For purposes of §§ 1005.30 through 1005.36, the term “business day” '
+    u'means any day on which the offices of a provider are open.',
+    u'1. Scope. See comments 2(a)-1, 3(b)(1)-2 and 7(c)-3, and paragraphs '
+    u'(a)(1), (a)(2)(i) through (iii) and (b) of this section. See also '
+    u'§ 1005.33(c)(2) and comment 33(c)-1 of official interpretations.',
+    u'Section 1005.10—Preauthorized Transfers',
+    u'10(b) Written Authorization for Preauthorized Transfers From '
+    u'Consumer’s Account',
+    u'The effective date of the final rule published at 77 FR 50244 '
+    u'(August 20, 2012) is delayed until February 7, 2013.',
+    u'Pursuant to 15 U.S.C. 1693o-1 and 12 CFR 1005.3, and as provided by '
+    u'Public Law 111-203, the Electronic Fund Transfer Act applies.',
+    u'(ii) A financial institution may, in accordance with paragraph '
+    u'(b)(1)(i) of this section, disclose the amount (<E T="03">1</E>).',
+]
+
+
+def normalize(value):
+    """Matches may contain WrappedResults and tokens, which don't compare by
+    value"""
+    if isinstance(value, utils.WrappedResult):
+        return (value.pos, normalize(value.tokens))
+    if isinstance(value, pyparsing.ParseResults):
+        return [normalize(v) for v in value]
+    if hasattr(value, '__dict__'):
+        return (value.__class__.__name__,
+                sorted((k, normalize(v)) for k, v in vars(value).items()))
+    return repr(value)
+
+
+def scan(gram, corpus):
+    return [[(start, end, normalize(tokens))
+             for tokens, start, end in gram.scanString(text)]
+            for text in corpus]
+
+
+def run_modes(gram, corpus, repeat):
+    """Returns the seconds taken and matches in each mode"""
+    results = []
+    original_end_loc = utils.tokens_end_loc
+    for mode in ('getTokensEndLoc', 'current', 'packrat'):
+        if mode == 'getTokensEndLoc':
+            utils.tokens_end_loc = pyparsing.getTokensEndLoc
+        elif mode == 'packrat':
+            grammar.enable_packrat(100000)
+        try:
+            matches = scan(gram, corpus)
+            seconds = timeit.timeit(lambda: scan(gram, corpus),
+                                    number=repeat) / repeat
+        finally:
+            utils.tokens_end_loc = original_end_loc
+            grammar.disable_packrat()
+        results.append((seconds, matches))
+    return results
+
+
+def load_corpus(path):
+    with codecs.open(path, encoding='utf-8') as f:
+        return [p.strip() for p in f.read().split('\n\n') if p.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--corpus', help='File of paragraphs to parse')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else SAMPLE
+    print("%d paragraphs" % len(corpus))
+    print("%-45s %10s %10s %10s" % ('', 'old (ms)', 'now (ms)', 'packrat'))
+    grammar.disable_packrat()   # regardless of settings
+    for module_name, attr in GRAMMARS:
+        gram = getattr(grammar.lazy(module_name), attr)
+        modes = run_modes(gram, corpus, args.repeat)
+        (old, old_matches), (now, now_matches) = modes[:2]
+        packrat, packrat_matches = modes[2]
+        print("%-45s %10.1f %10.1f %10.1f%s%s" % (
+            module_name + '.' + attr, old * 1000, now * 1000, packrat * 1000,
+            '' if now_matches == old_matches else ' CHANGED',
+            '' if packrat_matches == old_matches else ' PACKRAT CHANGED'))
@@ -0,0 +1,88 @@
+"""Time how long our entry points take to start, i.e. to import their
+modules, each in a fresh interpreter. Run from the root of the repository:
+
+    $ python -m benchmarks.imports --repeat 5
+
+Scripts are timed with --help, so they exit as soon as their arguments are
+parsed; that's all deferring their imports helps. A real query needs most of
+the parser, so we also time the imports each script's query performs (its
+own imports, plus the modules the builder loads lazily along the way). The
+query itself, which fetches notices from the Federal Register, isn't timed.
+Also lists which heavy dependencies each import drags in.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import timeit
+
+
+MODULES = ('regparser.builder', 'regparser.api_writer',
+           'regparser.federalregister', 'regparser.notice.build',
+           'regparser.layer.terms')
+SCRIPTS = ('build_from.py', 'watch_node.py', 'notice_order.py')
+HEAVY = ('git', 'lxml', 'pyparsing', 'requests', 'inflection', 'constraint')
+#   The imports performed by a real run of each script
+QUERIES = (
+    ('watch_node.py query', '''
+from regparser import builder
+from regparser.notice.changes import node_to_dict, pretty_change
+from regparser.tree.struct import find
+builder.Builder(12, '1005', '2012-12345')
+builder.reg_text.build_tree
+builder.federalregister.fetch_notice_json
+builder.notice_build.build_notices'''),
+    ('notice_order.py query', '''
+from regparser.builder import (
+    notices_for_cfr_part, federalregister, notice_build)
+federalregister.fetch_notice_json
+notice_build.build_notices'''),
+)
+
+IMPORT_MODULE = """
+import json, sys, time
+start = time.time()
+{0}
+print(json.dumps([time.time() - start, len(sys.modules),
+                  sorted(set(name.split('.')[0] for name, module
+                                 in sys.modules.items() if module))]))
+"""
+
+
+def time_imports(code):
+    """Seconds to run the (importing) code, number of modules loaded,
+    top-level packages"""
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_MODULE.format(code)])
+    return json.loads(output)
+
+
+def time_command(*argv):
+    """Seconds to start the interpreter, run the command and exit"""
+    with open(os.devnull, 'w') as devnull:
+        return timeit.timeit(lambda: subprocess.check_call(
+            (sys.executable,) + argv, stdout=devnull), number=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print("%-30s %10s %8s  %s" % ('', 'best (ms)', 'modules', 'heavy'))
+    imports = [(module_name, 'import ' + module_name)
+               for module_name in MODULES] + list(QUERIES)
+    for name, code in imports:
+        runs = [time_imports(code) for _ in range(args.repeat)]
+        seconds = min(seconds for seconds, _, _ in runs)
+        _, num_modules, packages = runs[0]
+        print("%-30s %10.1f %8d  %s" % (
+            name, seconds * 1000, num_modules,
+            ', '.join(p for p in HEAVY if p in packages)))
+    seconds = min(time_command('-c', 'pass') for _ in range(args.repeat))
+    print("%-30s %10.1f" % ('(interpreter startup)', seconds * 1000))
+    for script in SCRIPTS:
+        seconds = min(time_command(script, '--help')
+                      for _ in range(args.repeat))
+        print("%-30s %10.1f" % (script + ' --help', seconds * 1000))
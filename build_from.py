@@ -4,24 +4,21 @@ import argparse
 import logging
 import hashlib
 import codecs
-
+from itertools import izip
 import sys
+
+from regparser.builder import (
+    LayerCacheAggregator, tree_and_builder, checkpointer_for, Builder,
+    NoticeRegistry, dependencies_digest)
+from regparser import layer_store
+from regparser.tree.struct import FrozenNodePool
+from regparser.utils import LazyModule
+
 reload(sys)
 sys.setdefaultencoding('UTF8')
 
-try:
-    import requests_cache
-    requests_cache.install_cache('fr_cache')
-except ImportError:
-    # If the cache library isn't present, do nothing -- we'll just make full
-    # HTTP requests rather than looking it up from the cache
-    pass
-
-from regparser.builder import (
-    LayerCacheAggregator, tree_and_builder, Checkpointer, NullCheckpointer,
-    Builder)
-from regparser.diff.tree import changes_between
-from regparser.tree.struct import FrozenNode
+#   Only needed when generating diffs
+scheduler = LazyModule('regparser.diff.scheduler')
 
 logger = logging.getLogger('build_from')
 logger.setLevel(logging.INFO)
@@ -38,20 +35,38 @@ def parse_regulation(args):
     #   First, the regulation tree
 
     reg_tree, builder = tree_and_builder(args.filename, args.title,
-                                         args.checkpoint_dir, args.doc_number)
+                                         args.checkpoint_dir, args.doc_number,
+                                         workers=args.workers)
 
     builder.write_notices()
 
     #   Always do at least the first reg
     logger.info("Version", builder.doc_number)
     builder.write_regulation(reg_tree)
-    layer_cache = LayerCacheAggregator()
+    layer_cache = LayerCacheAggregator(layer_store.store())
 
     builder.gen_and_write_layers(reg_tree, act_title_and_section, layer_cache)
     layer_cache.replace_using(reg_tree)
 
     if args.generate_diffs:
         generate_diffs(reg_tree, act_title_and_section, builder, layer_cache)
+    else:
+        log_layer_cache_stats(layer_cache)
+
+
+def log_layer_cache_stats(layer_cache):
+    for layer_name, (hits, store_hits, misses) in sorted(
+            layer_cache.stats().items()):
+        logger.info("Layer cache %s: %d hits, %d persisted hits, %d misses",
+                    layer_name, hits, store_hits, misses)
+
+
+def log_frozen_node_stats(freezer):
+    logger.info("Frozen nodes: %(nodes)d live (%(chars)d characters), "
+                "%(hits)d reused, %(misses)d created",
+                FrozenNodePool.current().stats())
+    logger.info("Frozen nodes: %d carried over from the previous version, "
+                "%d frozen anew", freezer.reused, freezer.created)
 
 
 def generate_diffs(reg_tree, act_title_and_section, builder, layer_cache):
@@ -59,47 +74,58 @@ def generate_diffs(reg_tree, act_title_and_section, builder, layer_cache):
         separate function to assist with profiling so it's easier to determine
         which parts of the parser take the most time """
     doc_number, checkpointer = builder.doc_number, builder.checkpointer
-    all_versions = {doc_number: FrozenNode.from_node(reg_tree)}
+    freezer = builder.freezer
+    all_versions = [(doc_number, freezer.freeze(reg_tree))]
 
     for last_notice, old, new_tree, notices in builder.revision_generator(
             reg_tree):
         version = last_notice['document_number']
         logger.info("Version %s", version)
-        all_versions[version] = FrozenNode.from_node(new_tree)
+        all_versions.append((version, freezer.freeze(new_tree)))
         builder.doc_number = version
         builder.write_regulation(new_tree)
-        layer_cache.invalidate_by_notice(last_notice)
         builder.gen_and_write_layers(new_tree, act_title_and_section,
                                      layer_cache, notices)
         layer_cache.replace_using(new_tree)
         del last_notice, old, new_tree, notices     # free some memory
 
+    log_layer_cache_stats(layer_cache)
+    log_frozen_node_stats(freezer)
     label_id = reg_tree.label_id()
-    writer = builder.writer
-    del reg_tree, layer_cache, builder  # free some memory
+    writer, workers = builder.writer, builder.workers
+    del reg_tree, layer_cache, builder, freezer     # free some memory
 
     # now build diffs - include "empty" diffs comparing a version to itself
-    for lhs_version, lhs_tree in all_versions.iteritems():
-        for rhs_version, rhs_tree in all_versions.iteritems():
-            changes = checkpointer.checkpoint(
-                "-".join(["diff", lhs_version, rhs_version]),
-                lambda: dict(changes_between(lhs_tree, rhs_tree)))
-            writer.diff(
-                label_id, lhs_version, rhs_version
-            ).write(changes)
+    pairs = scheduler.all_pairs(version for version, _ in all_versions)
+    tags = ["-".join(["diff", lhs_version, rhs_version])
+            for lhs_version, rhs_version in pairs]
+    by_tag = dict(zip(tags, pairs))
+    #   diffs depend only on the content of the two trees (and the diffing
+    #   code, including e.g. diff.text)
+    trees = dict(all_versions)
+    inputs = [(trees[lhs_version].hash, trees[rhs_version].hash,
+               dependencies_digest(scheduler))
+              for lhs_version, rhs_version in pairs]
+    #   each diff is recorded under the version on its right-hand side
+    results = checkpointer.checkpoint_many(
+        tags, lambda to_compute: scheduler.diffs(
+            all_versions, [by_tag[tag] for tag in to_compute], workers),
+        inputs, [rhs_version for _, rhs_version in pairs])
+    for (lhs_version, rhs_version), changes in izip(pairs, results):
+        writer.diff(
+            label_id, lhs_version, rhs_version
+        ).write(changes)
 
 
 def build_by_notice(filename, title, act_title, act_section,
-                    notice_doc_numbers, doc_number=None, checkpoint=None):
+                    notice_doc_numbers, doc_number=None, checkpoint=None,
+                    workers=1):
 
     with codecs.open(filename, 'r', 'utf-8') as f:
         reg = f.read()
         file_digest = hashlib.sha256(reg.encode('utf-8')).hexdigest()
 
-    if checkpoint:
-        checkpointer = Checkpointer(checkpoint)
-    else:
-        checkpointer = NullCheckpointer()
+    checkpointer = checkpointer_for(checkpoint)
 
     # build the initial tree
     reg_tree = checkpointer.checkpoint(
@@ -107,9 +133,11 @@ def build_by_notice(filename, title, act_title, act_section,
         lambda: Builder.reg_tree(reg))
 
     title_part = reg_tree.label_id()
+    notice_registry = NoticeRegistry()
 
     if doc_number is None:
-        doc_number = Builder.determine_doc_number(reg, title, title_part)
+        doc_number = Builder.determine_doc_number(reg, title, title_part,
+                                                  notice_registry)
 
     checkpointer.suffix = ":".join(
         ["", title_part, str(args.title), doc_number])
@@ -118,7 +146,9 @@ def build_by_notice(filename, title, act_title, act_section,
     builder = Builder(cfr_title=title,
                       cfr_part=title_part,
                       doc_number=doc_number,
-                      checkpointer=checkpointer)
+                      checkpointer=checkpointer,
+                      workers=workers,
+                      notice_registry=notice_registry)
 
     builder.fetch_notices_json()
 
@@ -126,7 +156,7 @@ def build_by_notice(filename, title, act_title, act_section,
         builder.build_notice_from_doc_number(notice)
 
     builder.write_regulation(reg_tree)
-    layer_cache = LayerCacheAggregator()
+    layer_cache = LayerCacheAggregator(layer_store.store())
 
     act_title_and_section = [act_title, act_section]
 
@@ -135,39 +165,44 @@ def build_by_notice(filename, title, act_title, act_section,
 
     if args.generate_diffs:
         generate_diffs(reg_tree, act_title_and_section, builder, layer_cache)
+    else:
+        log_layer_cache_stats(layer_cache)
 
 
 def generate_xml(filename, title, act_title, act_section, notice_doc_numbers,
-                 doc_number=None, checkpoint=None):
+                 doc_number=None, checkpoint=None, workers=1):
 
     act_title_and_section = [act_title, act_section]
     #   First, the regulation tree
 
     reg_tree, builder = tree_and_builder(filename, title,
-                                         checkpoint, writer_type='XML')
-    layer_cache = LayerCacheAggregator()
+                                         checkpoint, writer_type='XML',
+                                         workers=workers)
+    layer_cache = LayerCacheAggregator(layer_store.store())
     layers = builder.generate_layers(reg_tree, act_title_and_section,
                                      layer_cache)
 
     # Always do at least the first reg
     logger.info("Version", builder.doc_number)
     builder.write_regulation(reg_tree, layers=layers)
-    all_versions = {doc_number: FrozenNode.from_node(reg_tree)}
+    freezer = builder.freezer
+    all_versions = {doc_number: freezer.freeze(reg_tree)}
 
     for last_notice, old, new_tree, notices in builder.revision_generator(
             reg_tree):
         version = last_notice['document_number']
         logger.info("Version %s", version)
-        all_versions[version] = FrozenNode.from_node(new_tree)
+        all_versions[version] = freezer.freeze(new_tree)
         builder.doc_number = version
         layers = builder.generate_layers(new_tree, act_title_and_section,
                                          layer_cache, notices)
         builder.write_regulation(new_tree, layers=layers)
         builder.write_notice(version, old_tree=old, reg_tree=new_tree,
                              layers=layers)
-        layer_cache.invalidate_by_notice(last_notice)
         layer_cache.replace_using(new_tree)
         del last_notice, old, new_tree, notices     # free some memory
+    log_layer_cache_stats(layer_cache)
+    log_frozen_node_stats(freezer)
 
 
 if __name__ == "__main__":
@@ -192,6 +227,11 @@ if __name__ == "__main__":
               'the regulation has no electronic final rules on '
               'federalregister.gov, i.e. has not changed since before ~2000)'))
 
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help=('Number of processes to use when building notices, layers '
+              'and diffs (default: 1, i.e. no parallelism)'))
+
     parser.add_argument('--last-notice', type=str,
                         help='the last notice to be used')
     parser.add_argument('--operation', action='store')
@@ -199,16 +239,19 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    if args.operation == 'build_by_notice':
-        build_by_notice(args.filename, args.title, args.act_title,
-                        args.act_section, args.notices_to_apply,
-                        args.last_notice, args.checkpoint_dir)
+    #   Frozen nodes aren't shared with other builds in the same process
+    with FrozenNodePool():
+        if args.operation == 'build_by_notice':
+            build_by_notice(args.filename, args.title, args.act_title,
+                            args.act_section, args.notices_to_apply,
+                            args.last_notice, args.checkpoint_dir,
+                            args.workers)
 
-    elif args.operation == 'generate_xml':
+        elif args.operation == 'generate_xml':
 
-        generate_xml(args.filename, args.title, args.act_title,
-                     args.act_section, args.notices_to_apply,
-                     args.last_notice, args.checkpoint_dir)
+            generate_xml(args.filename, args.title, args.act_title,
+                         args.act_section, args.notices_to_apply,
+                         args.last_notice, args.checkpoint_dir, args.workers)
 
-    else:
-        parse_regulation(args)
+        else:
+            parse_regulation(args)
@@ -0,0 +1,27 @@
+import argparse
+
+from regparser.builder import SQLiteCheckpointer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Remove old checkpoints from a checkpoint database")
+    parser.add_argument('db_path',
+                        help='SQLite checkpoint database (e.g. cp.sqlite)')
+    parser.add_argument('--max-age', type=float,
+                        help='Remove checkpoints unused for this many days')
+    parser.add_argument('--max-size', type=float,
+                        help=('Remove the least recently used checkpoints '
+                              'until the database is at most this many MB'))
+    parser.add_argument('--cfr-part',
+                        help='Only consider checkpoints for this CFR part')
+    args = parser.parse_args()
+
+    checkpointer = SQLiteCheckpointer(args.db_path)
+    max_age, max_size = None, None
+    if args.max_age is not None:
+        max_age = args.max_age * 24 * 60 * 60
+    if args.max_size is not None:
+        max_size = int(args.max_size * 1024 * 1024)
+    count, size = checkpointer.gc(max_age, max_size, args.cfr_part)
+    print("Removed %d checkpoints (%.1f MB)" % (count, size / 1024. / 1024))
@@ -1,16 +1,6 @@
 # @todo - this should be combined with build_from.py
 import argparse
 
-from regparser.builder import notices_for_cfr_part
-
-try:
-    import requests_cache
-    requests_cache.install_cache('fr_cache')
-except ImportError:
-    # If the cache library isn't present, do nothing -- we'll just make full
-    # HTTP requests rather than looking it up from the cache
-    pass
-
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Notice Orderer")
@@ -22,6 +12,9 @@ if __name__ == "__main__":
                               'regulation (default: false)'))
     args = parser.parse_args()
 
+    #   Imported only once the arguments are known to be valid
+    from regparser.builder import notices_for_cfr_part
+
     notices_by_date = notices_for_cfr_part(args.cfr_title, args.cfr_part)
     for date in sorted(notices_by_date.keys()):
         print(date)
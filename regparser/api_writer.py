@@ -5,25 +5,25 @@ import os.path
 import shutil
 import re
 
-from git import Repo
-from git.exc import InvalidGitRepositoryError
-
 from lxml.etree import Element, SubElement
 from lxml.etree import tostring, fromstring, strip_tags
 from lxml.etree import XMLSyntaxError
 
-import requests
-
 from regparser.tree.struct import Node, NodeEncoder, find
 from regparser.notice.encoder import AmendmentEncoder
 
-from utils import interpolate_string
+from utils import interpolate_string, LazyModule
 
 import settings
 import logging
 
 logger = logging.getLogger()
 
+#   GitPython and requests are slow to import and are only needed by the GIT
+#   and API writers, respectively
+git = LazyModule('git')
+requests = LazyModule('requests')
+
 
 class AmendmentNodeEncoder(AmendmentEncoder, NodeEncoder):
     pass
@@ -113,9 +113,9 @@ class GitWriteContent:
                 os.makedirs(dir_path)
 
             try:
-                repo = Repo(dir_path)
-            except InvalidGitRepositoryError:
-                repo = Repo.init(dir_path)
+                repo = git.Repo(dir_path)
+            except git.InvalidGitRepositoryError:
+                repo = git.Repo.init(dir_path)
                 repo.index.commit("Initial commit for " + path_parts[-2])
 
             # Write all files (and delete any old ones)
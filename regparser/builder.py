@@ -1,29 +1,68 @@
 import codecs
 import copy
+import datetime
 import hashlib
+import importlib
+import inspect
+import json
+import multiprocessing
 import os
-import pickle
+import cPickle as pickle
 import re
 import logging
+import sqlite3
+import sys
+import time
+import types
+import zlib
+import bz2
 
 from lxml import etree
 
-from regparser import api_writer, content
-from regparser.federalregister import fetch_notice_json, fetch_notices
+import settings
+
+from regparser import content
 from regparser.history.notices import (
     applicable as applicable_notices, group_by_eff_date)
 from regparser.history.delays import modify_effective_dates
-from regparser.layer import (
-    external_citations, formatting, graphics, key_terms, internal_citations,
-    interpretations, meta, paragraph_markers, section_by_section,
-    table_of_contents, terms)
-from regparser.notice.compiler import compile_regulation
-from regparser.notice.build import build_notice
 from regparser.tree import struct
 # from regparser.tree.build import build_whole_regtree
-from regparser.tree.xml_parser import reg_text
-from regparser.diff.tree import changes_between
-from regparser.tree.struct import FrozenNode
+from regparser.tree.struct import Freezer
+from regparser.utils import LazyModule
+
+#   Only imported when needed, so e.g. listing notices doesn't pay for
+#   GitPython, the layers or the XML parsers
+api_writer = LazyModule('regparser.api_writer')
+compiler = LazyModule('regparser.notice.compiler')
+diff_tree = LazyModule('regparser.diff.tree')
+federalregister = LazyModule('regparser.federalregister')
+notice_build = LazyModule('regparser.notice.build')
+reg_text = LazyModule('regparser.tree.xml_parser.reg_text')
+
+
+#   Layer identifiers and the classes (within regparser.layer) which generate
+#   them. Each is independent of the others, so they may be built in any
+#   order
+LAYERS = (
+    ('external-citations', 'external_citations.ExternalCitationParser'),
+    ('meta', 'meta.Meta'),
+    ('analyses', 'section_by_section.SectionBySection'),
+    ('internal-citations', 'internal_citations.InternalCitationParser'),
+    ('toc', 'table_of_contents.TableOfContentsLayer'),
+    ('interpretations', 'interpretations.Interpretations'),
+    ('terms', 'terms.Terms'),
+    ('paragraph-markers', 'paragraph_markers.ParagraphMarkers'),
+    ('keyterms', 'key_terms.KeyTerms'),
+    ('formatting', 'formatting.Formatting'),
+    ('graphics', 'graphics.Graphics'))
+
+
+def load_layer_class(path):
+    """Import (if needed) the layer class at this path within
+    regparser.layer, e.g. 'terms.Terms'"""
+    module_name, class_name = path.rsplit('.', 1)
+    module = importlib.import_module('regparser.layer.' + module_name)
+    return getattr(module, class_name)
 
 
 class Builder(object):
@@ -31,34 +70,43 @@ class Builder(object):
     layers, etc. It is largely glue code"""
 
     def __init__(self, cfr_title, cfr_part, doc_number, checkpointer=None,
-                 writer_type=None):
+                 writer_type=None, workers=1, notice_registry=None):
         self.cfr_title = cfr_title
         self.cfr_part = cfr_part
         self.doc_number = doc_number
         self.checkpointer = checkpointer or NullCheckpointer()
         self.writer = api_writer.Client(writer_type=writer_type)
+        #   Number of processes to use for CPU-bound stages; 1 means serial
+        self.workers = workers
+        self.notice_registry = notice_registry or NoticeRegistry()
         self.notices_json = []
         self.notices = []
         self.notice_doc_numbers = []
+        #   Successive versions share most of their nodes, as do their
+        #   FrozenNodes
+        self.freezer = Freezer()
         self.eff_notices = []
 
     def fetch_notices_json(self):
-        self.notices_json = fetch_notice_json(self.cfr_title, self.cfr_part,
-                                              only_final=True)
+        self.notices_json = self.notice_registry.notice_json(
+            self.cfr_title, self.cfr_part)
         self.notice_doc_numbers = [notice_json['document_number']
                                    for notice_json in self.notices_json]
 
     def build_single_notice(self, notice_json, checkpoint=True):
         logging.info('building notice {0} from {1}'.format(
             notice_json['document_number'], notice_json['full_text_xml_url']))
+
+        def build():
+            return self.notice_registry.notices(
+                self.cfr_title, self.cfr_part, notice_json)
         if checkpoint:
             notice = self.checkpointer.checkpoint(
-                'notice-' + notice_json['document_number'],
-                lambda: build_notice(self.cfr_title, self.cfr_part,
-                                     notice_json)
-            )
+                'notice-' + notice_json['document_number'], build,
+                inputs=notice_inputs(notice_json),
+                version=notice_json['document_number'])
         else:
-            notice = build_notice(self.cfr_title, self.cfr_part, notice_json)
+            notice = build()
 
         return notice
 
@@ -72,18 +120,28 @@ class Builder(object):
             return notice
 
     def build_notices(self, checkpoint=True):
-        for result in self.notices_json:
-            notice = self.build_single_notice(result, checkpoint)
+        tags = ['notice-' + notice_json['document_number']
+                for notice_json in self.notices_json]
+        by_tag = dict(zip(tags, self.notices_json))
+
+        def build(to_build):
+            return self.notice_registry.build_notices(
+                self.cfr_title, self.cfr_part,
+                [by_tag[tag] for tag in to_build], self.workers)
+        if checkpoint:
+            results = self.checkpointer.checkpoint_many(
+                tags, build, [notice_inputs(notice_json)
+                              for notice_json in self.notices_json],
+                [notice_json['document_number']
+                 for notice_json in self.notices_json])
+        else:
+            results = build(tags)
+
+        for notice in results:
             self.notices.extend(notice)
         modify_effective_dates(self.notices)
         #   Only care about final
-        self.notices = [n for n in self.notices if 'effective_on' in n]
         self.eff_notices = group_by_eff_date(self.notices)
-
-        self.eff_notices = self.checkpointer.checkpoint(
-            "effective-notices",
-            lambda: notices_for_cfr_part(self.cfr_title, self.cfr_part)
-        )
         self.notices = []
         for notice_group in self.eff_notices.values():
             self.notices.extend(notice_group)
@@ -91,7 +149,8 @@ class Builder(object):
     def write_notices(self):
         for notice in self.notices:
             #  No need to carry this around
-            del notice['meta']
+            notice = dict((key, value) for key, value in notice.items()
+                          if key != 'meta')
             self.writer.notice(
                 self.cfr_part, notice['document_number']).write(notice)
 
@@ -109,9 +168,9 @@ class Builder(object):
         if old_tree is not None and reg_tree is not None:
             # FrozenNode and Node are not API-compatible. This is
             # troublesome.
-            changes = dict(changes_between(
-                FrozenNode.from_node(old_tree),
-                FrozenNode.from_node(reg_tree)))
+            changes = dict(diff_tree.changes_between(
+                self.freezer.freeze(old_tree),
+                self.freezer.freeze(reg_tree)))
 
         # Write the notice
         writer = self.writer.notice(self.cfr_part,
@@ -128,30 +187,70 @@ class Builder(object):
                                layers=layers).write(reg_tree)
 
     def generate_layers(self, reg_tree, act_info, cache, notices=None):
-        layers = {}
+        """Build all of the layers for this version of the regulation. Layers
+        are checkpointed individually; those which need to be (re)computed
+        are built in parallel if more than one worker is configured"""
         if notices is None:
             notices = applicable_notices(self.notices, self.doc_number)
-        for ident, layer_class in (
-                ('external-citations',
-                    external_citations.ExternalCitationParser),
-                ('meta', meta.Meta),
-                ('analyses', section_by_section.SectionBySection),
-                ('internal-citations',
-                    internal_citations.InternalCitationParser),
-                ('toc', table_of_contents.TableOfContentsLayer),
-                ('interpretations', interpretations.Interpretations),
-                ('terms', terms.Terms),
-                ('paragraph-markers', paragraph_markers.ParagraphMarkers),
-                ('keyterms', key_terms.KeyTerms),
-                ('formatting', formatting.Formatting),
-                ('graphics', graphics.Graphics)):
-            layer = self.checkpointer.checkpoint(
-                ident + "-" + self.doc_number,
-                lambda: layer_class(
+        layers = [(ident, load_layer_class(path)) for ident, path in LAYERS]
+        by_tag = dict((ident + "-" + self.doc_number, (ident, cls))
+                      for ident, cls in layers)
+        tags = [ident + "-" + self.doc_number for ident, _ in layers]
+        #   The tree and notices are large; digest them once, not per layer
+        tree_digest, notices_digest = input_digest(reg_tree), input_digest(
+            notices)
+        inputs = [(tree_digest, self.cfr_title, notices_digest, act_info,
+                   dependencies_digest(sys.modules[cls.__module__]))
+                  for _, cls in layers]
+
+        def compute(missing_tags):
+            return self.build_layers([by_tag[tag] for tag in missing_tags],
+                                     reg_tree, act_info, cache, notices)
+
+        results = list(self.checkpointer.checkpoint_many(
+            tags, compute, inputs, [self.doc_number] * len(tags)))
+        return dict((by_tag[tag][0], layer)
+                    for tag, layer in zip(tags, results))
+
+    def build_layers(self, to_build, reg_tree, act_info, cache, notices):
+        """Given a list of (ident, layer_class) pairs, build each layer,
+        returning the results in the same order. With multiple workers, each
+        layer is built in its own process. Each is sent only the cached
+        elements for this tree's nodes and sends back only the elements it
+        added, which the cache aggregator adopts."""
+        if self.workers <= 1 or len(to_build) <= 1:
+            layers = []
+            for ident, layer_class in to_build:
+                layer_cache = cache.cache_for(ident)
+                layers.append(layer_class(
                     reg_tree, self.cfr_title, self.doc_number, notices,
-                    act_info).build(cache.cache_for(ident)))
-            layers[ident] = layer
-
+                    act_info).build(layer_cache))
+                layer_cache.flush()
+            return layers
+
+        tree_pickle = pickle.dumps(reg_tree, pickle.HIGHEST_PROTOCOL)
+        nodes = []
+        struct.walk(reg_tree, nodes.append)
+        #   Layers don't look at a notice's changes, which may contain
+        #   (unpicklable) XML elements
+        notices = [dict((key, value) for key, value in notice.items()
+                        if key != 'changes')
+                   for notice in notices]
+        jobs = [(layer_class, tree_pickle, self.cfr_title, self.doc_number,
+                 notices, act_info, cache.cache_for_worker(ident, nodes))
+                for ident, layer_class in to_build]
+
+        pool = multiprocessing.Pool(min(self.workers, len(jobs)))
+        try:
+            results = pool.map(_build_layer, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+        layers = []
+        for (ident, _), (layer, layer_cache) in zip(to_build, results):
+            cache.adopt(ident, layer_cache)
+            layers.append(layer)
         return layers
 
     def write_layers(self, layers):
@@ -171,7 +270,10 @@ class Builder(object):
             old_tree = reg_tree
             reg_tree = self.checkpointer.checkpoint(
                 "compiled-" + version,
-                lambda: compile_regulation(old_tree, merged_changes))
+                lambda: compiler.compile_regulation(old_tree, merged_changes),
+                inputs=(old_tree, merged_changes,
+                        dependencies_digest(compiler)),
+                version=version)
             notices = applicable_notices(self.notices, version)
             first_notice = None
             for notice in notices:
@@ -212,81 +314,135 @@ class Builder(object):
             # return build_whole_regtree(reg_str)
 
     @staticmethod
-    def determine_doc_number(reg_str, title, title_part):
+    def determine_doc_number(reg_str, title, title_part,
+                             notice_registry=None):
         """Instead of requiring the user provide a doc number, we can find it
         within the xml file"""
         # @todo: remove the double-conversion
         reg_xml = etree.fromstring(reg_str)
         doc_number = _fr_doc_to_doc_number(reg_xml)
         if not doc_number:
-            doc_number = _fdsys_to_doc_number(reg_xml, title, title_part)
+            doc_number = _fdsys_to_doc_number(
+                reg_xml, title, title_part,
+                notice_registry or NoticeRegistry())
         return doc_number
 
 
 class LayerCacheAggregator(object):
     """A lot of the reg tree remains the same between versions; we don't
-    want to recompute layers every time. This object keeps track of what
-    labels are seen/valid."""
-    def __init__(self):
-        self._known_labels = set()
+    want to recompute layers every time. Layer elements are cached by the
+    content of the node they describe (see struct.content_hash), so any
+    node which is unchanged -- even if it's been moved, e.g. to a new
+    subpart -- reuses its cached elements. If a layer_store.LayerStore is
+    provided, elements are also persisted across runs."""
+    def __init__(self, store=None):
+        self.store = store
         self._caches = {}
 
-    def invalidate(self, labels):
-        """Given a list of labels, clear out any known labels that would be
-        affected. For subpart changes, we just wipe out the whole cache. If
-        removing an interpretation, make the logic easier by removing
-        related regtext as well."""
-        if any('Subpart' in label for label in labels):
-            self._known_labels = set()
-        else:
-            stripped = []
-            for label in labels:
-                if struct.Node.INTERP_MARK in label:
-                    idx = label.find(struct.Node.INTERP_MARK) - 1
-                    stripped.append(label[:idx])
-                else:
-                    stripped.append(label)
-            self._known_labels = set(
-                known for known in self._known_labels
-                if not any(known.startswith(l) for l in stripped))
-
-    def invalidate_by_notice(self, notice):
-        """Using the notice structure, invalidate based on the 'changes'
-        field"""
-        self.invalidate([key for key in notice.get('changes', {})])
-        patches = content.RegPatches().get(notice['document_number'], {})
-        self.invalidate(patches.keys())
-
-    def is_known(self, label):
-        return label in self._known_labels
-
     def replace_using(self, tree):
-        """Clear out the known labels; replace them using the provided node
-        tree."""
-        self._known_labels = set()
-
-        def per_node(node):
-            self._known_labels.add(node.label_id())
-        struct.walk(tree, per_node)
+        """Forget elements for content which is no longer in the tree, so
+        the caches don't grow without bound as versions are built"""
+        nodes = []
+        struct.walk(tree, nodes.append)
+        for cache in self._caches.values():
+            cache.retain(set(cache.key(node) for node in nodes))
 
     def cache_for(self, layer_name):
         """Get a LayerCache object for a given layer name. Not all layers
-        have caches, as caches are currently only used for layers that
-        depend on the node's text"""
+        have caches, as caches are only valid for layers that depend on
+        just the node's own content. Formatting also depends on the node's
+        XML (for tables)"""
         if layer_name in ('external-citations', 'internal-citations',
-                          'interpretations', 'paragraph-markers', 'keyterms',
-                          'formatting', 'graphics'):
+                          'paragraph-markers', 'keyterms', 'formatting',
+                          'graphics'):
             if layer_name not in self._caches:
-                self._caches[layer_name] = LayerCache(self)
+                self._caches[layer_name] = LayerCache(
+                    layer_name, include_xml=(layer_name == 'formatting'),
+                    store=self.store)
             return self._caches[layer_name]
         else:
             return EmptyCache()
 
-
-def notices_for_cfr_part(title, part):
+    def stats(self):
+        """Maps each layer name to a (hits, persisted hits, misses) triple"""
+        return dict((layer_name, (cache.hits, cache.store_hits, cache.misses))
+                    for layer_name, cache in self._caches.items())
+
+    def cache_for_worker(self, layer_name, nodes):
+        """A copy of the layer's cache with only the elements for these
+        nodes, to send to a worker process. See adopt"""
+        layer_cache = self.cache_for(layer_name)
+        if isinstance(layer_cache, LayerCache):
+            layer_cache = layer_cache.subset(nodes)
+        return layer_cache
+
+    def adopt(self, layer_name, layer_cache):
+        """Merge in the elements of a cache populated elsewhere, i.e. the
+        copy returned by a worker process"""
+        if layer_name in self._caches:
+            self._caches[layer_name].merge(layer_cache)
+
+    def __getstate__(self):
+        """Layer caches are sent to worker processes one at a time; don't
+        drag the other layers' caches along"""
+        state = dict(self.__dict__)
+        state['_caches'] = {}
+        return state
+
+
+class NoticeRegistry(object):
+    """Building a notice requires fetching and parsing its XML, so we do so
+    only once per run. The registry holds on to the final-rule JSON for each
+    CFR part and the notices built from it, keyed by document number.
+    Callers receive (shallow) copies of the notices, so they may add,
+    replace or remove their keys"""
+    def __init__(self):
+        self._json = {}
+        self._notices = {}
+
+    def notice_json(self, cfr_title, cfr_part):
+        """Federal Register JSON for all final rules affecting this part,
+        oldest first"""
+        key = (cfr_title, cfr_part)
+        if key not in self._json:
+            self._json[key] = federalregister.fetch_notice_json(
+                cfr_title, cfr_part, only_final=True)
+        return self._json[key]
+
+    def notices(self, cfr_title, cfr_part, notice_json):
+        """The notice(s) built from this bit of JSON. There may be more than
+        one if the notice is split by effective date"""
+        return self.build_notices(cfr_title, cfr_part, [notice_json])[0]
+
+    def build_notices(self, cfr_title, cfr_part, notice_jsons, workers=1):
+        """As `notices`, but for a list of JSON results. Any notices which
+        haven't been built yet are built concurrently"""
+        keys = [(cfr_title, cfr_part, notice_json['document_number'])
+                for notice_json in notice_jsons]
+        missing = [(key, notice_json)
+                   for key, notice_json in zip(keys, notice_jsons)
+                   if key not in self._notices]
+        built = notice_build.build_notices(
+            cfr_title, cfr_part, [notice_json for _, notice_json in missing],
+            workers)
+        for (key, _), notices in zip(missing, built):
+            self._notices[key] = notices
+        return [[dict(notice) for notice in self._notices[key]]
+                for key in keys]
+
+    def all_notices(self, cfr_title, cfr_part):
+        """All final notices for this part"""
+        notices = []
+        for notice_json in self.notice_json(cfr_title, cfr_part):
+            notices.extend(self.notices(cfr_title, cfr_part, notice_json))
+        return notices
+
+
+def notices_for_cfr_part(title, part, notice_registry=None):
     """Retrieves all final notices for a title-part pair, orders them, and
     returns them as a dict[effective_date_str] -> list(notices)"""
-    notices = fetch_notices(title, part, only_final=True)
+    notice_registry = notice_registry or NoticeRegistry()
+    notices = notice_registry.all_notices(title, part)
     modify_effective_dates(notices)
     return group_by_eff_date(notices)
 
@@ -300,33 +456,124 @@ def _fr_doc_to_doc_number(xml):
             return frdoc_pieces[2]
 
 
-def _fdsys_to_doc_number(xml, title, title_part):
+def _fdsys_to_doc_number(xml, title, title_part, notice_registry):
     """Pull out a document number from an FDSYS document, i.e. an annual
     edition of a reg"""
     original_date_els = xml.xpath('//FDSYS/ORIGINALDATE')
     if len(original_date_els) > 0:
         date = original_date_els[0].text
-        #   Grab oldest document number from Federal register API
-        notices = fetch_notice_json(title, title_part, only_final=True,
-                                    max_effective_date=date)
-        if notices:
-            return notices[0]['document_number']
+        #   Grab oldest document number which was effective by then
+        for notice_json in notice_registry.notice_json(title, title_part):
+            effective_on = notice_json.get('effective_on')
+            if effective_on and effective_on <= date:
+                return notice_json['document_number']
 
 
 class LayerCache(object):
-    """Keeps a cache of a single layer. Used in combination with a
-    LayerCacheAggregator to determine when something needs to be recomputed."""
-    def __init__(self, parent):
-        self.parent = parent
+    """Keeps a cache of a single layer, keyed by the content of each node.
+    Misses are looked up in the (persistent) store, if present, before being
+    computed. Both are only valid for a single layer context (see
+    Layer.cache_context); cached elements are dropped when it changes"""
+    def __init__(self, layer_name=None, include_xml=False, store=None):
+        self.layer_name = layer_name
+        self.include_xml = include_xml
+        self.store = store
+        self.hits, self.store_hits, self.misses = 0, 0, 0
         self._cache = {}
+        self._layer, self._store_prefix = None, None
+        #   The context prefix and keys of elements we started with; see
+        #   subset
+        self._known = (None, set())
+
+    def key(self, node):
+        return struct.content_hash(node, self.include_xml)
 
     def fetch_or_process(self, layer, node):
         """Retrieve the value of a layer if known. Otherwise, compute the
         value and cache the result"""
-        label = node.label_id()
-        if not self.parent.is_known(label):
-            self._cache[label] = layer.process(node)
-        return self._cache.get(label)
+        prefix, key = self._prefix(layer), self.key(node)
+        if key in self._cache:
+            self.hits += 1
+            return self._cache[key]
+
+        found, value = False, None
+        if self.store is not None:
+            store_key = prefix + key
+            found, value = self.store.get(store_key)
+        if found:
+            self.store_hits += 1
+        else:
+            self.misses += 1
+            value = layer.process(node)
+            if self.store is not None:
+                self.store.put(store_key, value)
+        self._cache[key] = value
+        return value
+
+    def _prefix(self, layer):
+        """Elements also depend on the layer's code and anything else it
+        considers relevant (see Layer.cache_context). Persisted elements are
+        keyed by this prefix; those in memory are forgotten when it changes,
+        e.g. when a new version's layer knows of different labels"""
+        if layer is not self._layer:
+            self._layer = layer
+            prefix = input_digest(
+                self.layer_name, dependencies_digest(
+                    sys.modules[layer.__class__.__module__]),
+                layer.cache_context())
+            if prefix != self._store_prefix:
+                self._cache = {}
+            self._store_prefix = prefix
+        return self._store_prefix
+
+    def subset(self, nodes):
+        """A copy of this cache with only the elements for these nodes and
+        no hits or misses. Marks those elements as already known, so
+        `added` excludes them"""
+        keys = set(self.key(node) for node in nodes)
+        subset = copy.copy(self)
+        subset._cache = dict((key, self._cache[key]) for key in keys
+                             if key in self._cache)
+        subset._known = (self._store_prefix, set(subset._cache))
+        subset.hits, subset.store_hits, subset.misses = 0, 0, 0
+        return subset
+
+    def drop_known(self):
+        """Keep only the elements added since this subset was made (all of
+        them, if the context has changed since), so that's all we send
+        back"""
+        prefix, known = self._known
+        if prefix == self._store_prefix:
+            self._cache = dict((key, value)
+                               for key, value in self._cache.items()
+                               if key not in known)
+        self._known = (None, set())
+
+    def merge(self, other):
+        """Add the elements and statistics of a copy of this cache (see
+        subset) which has been used elsewhere"""
+        if other._store_prefix != self._store_prefix:
+            self._cache, self._layer = {}, None
+            self._store_prefix = other._store_prefix
+        self._cache.update(other._cache)
+        self.hits += other.hits
+        self.store_hits += other.store_hits
+        self.misses += other.misses
+
+    def flush(self):
+        if self.store is not None:
+            self.store.flush()
+
+    def retain(self, keys):
+        """Remove all entries except those for the provided keys"""
+        self._cache = dict((key, value) for key, value in self._cache.items()
+                           if key in keys)
+
+    def __getstate__(self):
+        """Don't send the layer (and its tree) between processes"""
+        state = dict(self.__dict__)
+        state['_layer'] = None
+        return state
 
 
 class EmptyCache(object):
@@ -336,94 +583,371 @@ class EmptyCache(object):
     def fetch_or_process(self, layer, node):
         return layer.process(node)
 
-
-def _serialize_xml_fields(node):
-    if node.source_xml is not None:
-        node.source_xml = etree.tostring(node.source_xml)
-
-
-def _deserialize_xml_fields(node):
-    if node.source_xml:
-        node.source_xml = etree.fromstring(node.source_xml)
+    def flush(self):
+        pass
+
+    def drop_known(self):
+        pass
+
+
+def _build_layer(args):
+    """Build a single layer in a worker process. Returns the layer and the
+    cache's new elements so the parent process can keep them"""
+    layer_class, tree_pickle, cfr_title, version, notices, act_info, cache \
+        = args
+    tree = pickle.loads(tree_pickle)
+    layer = layer_class(tree, cfr_title, version, notices, act_info).build(
+        cache)
+    cache.flush()
+    cache.drop_known()
+    return layer, cache
+
+
+class _DigestEncoder(json.JSONEncoder):
+    """Converts the inputs of a pipeline step into JSON so that they can be
+    hashed. Unlike struct.NodeEncoder, every field of a Node is included"""
+    def default(self, obj):
+        if isinstance(obj, struct.FrozenNode):
+            return obj.hash
+        elif isinstance(obj, struct.Node):
+            fields = dict(obj.__dict__)
+            if struct.LAZY_XML_FIELD in fields:
+                fields['source_xml'] = fields.pop(struct.LAZY_XML_FIELD)
+            return fields
+        elif isinstance(obj, etree._Element):
+            return etree.tostring(obj)
+        elif isinstance(obj, (set, frozenset)):
+            return sorted(obj)
+        elif isinstance(obj, datetime.date):
+            return obj.isoformat()
+        return repr(obj)
+
+
+def input_digest(*inputs):
+    """A SHA-256 (hex) digest of the (JSON-able, Node, XML, etc.) inputs"""
+    encoded = json.dumps(inputs, sort_keys=True, cls=_DigestEncoder)
+    return hashlib.sha256(encoded).hexdigest()
+
+
+_code_digests, _dependencies_digests = {}, {}
+
+
+def code_digest(module):
+    """A digest of a module's source code. Including this in a checkpoint's
+    inputs means the checkpoint is invalidated when that code changes. The
+    module may be a LazyModule"""
+    if module.__name__ not in _code_digests:
+        #   Accessing __name__ imports a LazyModule
+        module = sys.modules[module.__name__]
+        with open(inspect.getsourcefile(module), 'rb') as f:
+            _code_digests[module.__name__] = hashlib.sha256(
+                f.read()).hexdigest()
+    return _code_digests[module.__name__]
+
+
+def dependencies_digest(module):
+    """As code_digest, but also includes the source of every regparser
+    module this module (transitively) uses. Modules which are imported
+    lazily (see LazyModule) are imported here, so the digest doesn't depend
+    on what happens to have been used so far. The module may be a
+    LazyModule"""
+    if module.__name__ not in _dependencies_digests:
+        seen, to_visit = set(), [module.__name__]
+        while to_visit:
+            name = to_visit.pop()
+            if name in seen:
+                continue
+            if name not in sys.modules:
+                try:
+                    importlib.import_module(name)
+                except ImportError:
+                    continue
+            seen.add(name)
+            for value in vars(sys.modules[name]).values():
+                if isinstance(value, types.ModuleType):
+                    dependency = value.__name__
+                elif isinstance(value, LazyModule):
+                    dependency = value._module_name
+                else:
+                    dependency = getattr(value, '__module__', None)
+                if isinstance(dependency, basestring) and \
+                        dependency.startswith('regparser'):
+                    to_visit.append(dependency)
+        _dependencies_digests[module.__name__] = input_digest(
+            *[code_digest(sys.modules[module_name])
+              for module_name in sorted(seen)])
+    return _dependencies_digests[module.__name__]
+
+
+def notice_inputs(notice_json):
+    """Everything which determines how a notice is built: the Federal
+    Register's metadata, any local (modified) copies of its XML and the
+    code which parses it (including e.g. notice.changes and the grammars)"""
+    url = notice_json.get('full_text_xml_url')
+    local_files = []
+    if url:
+        for path in sorted(notice_build._check_local_version_list(url)):
+            with open(path, 'rb') as f:
+                local_files.append((os.path.basename(path),
+                                    hashlib.sha256(f.read()).hexdigest()))
+    return (notice_json, local_files, dependencies_digest(notice_build))
+
+
+#   Optional compression for checkpoints, keyed by the name used in
+#   settings.CHECKPOINT_COMPRESSION. Each is recognized by the first bytes of
+#   its output (pickles start with a different byte)
+CHECKPOINT_CODECS = {
+    'zlib': ('\x78', zlib.compress, zlib.decompress),
+    'bz2': ('BZh', bz2.compress, bz2.decompress)}
 
 
 class Checkpointer(object):
     """Save checkpoints during the build pipeline. Generally, a caller will
-    specify, a unique tag (a string) and a fallback function (for how to
-    compute it when there is no checkpoint). Calling checkpoint increment the
-    counter field, which is prefixed to the filename to limit the risk of
-    re-ordering collisions."""
+    specify a tag (a string), the inputs to that step and a fallback
+    function (for how to compute it when there is no checkpoint).
+    Checkpoints are content-addressed: the filename includes a hash of the
+    tag and inputs, so changing a single input (e.g. one notice) only
+    invalidates the steps which depend on it. Each checkpoint is stored in
+    its own file; see SQLiteCheckpointer for an alternative."""
     def __init__(self, file_path):
-        self.counter = 0
         self.file_path = file_path
         self.suffix = ""
-        self.ignore_checkpoints = False
+        self.compression = settings.CHECKPOINT_COMPRESSION
         if not os.path.isdir(file_path):
             os.makedirs(file_path)
 
-    def _filename(self, tag):
-        """Combine the counter and tag name to create a filename"""
-        name = str(self.counter).zfill(6) + ":"
-        name += re.sub(r"\s", "", tag.lower())
-        name += self.suffix + ".p"
-        return os.path.join(self.file_path, name)
-
-    def _serialize(self, tag, obj):
-        """Performs class-specific conversions before writing to a file"""
-        if isinstance(obj, struct.Node):
-            obj = copy.deepcopy(obj)
-            struct.walk(obj, _serialize_xml_fields)
-
-        with open(self._filename(tag), 'wb') as to_write:
-            pickle.dump(obj, to_write)
-
-    def _deserialize(self, tag):
-        """Attempts to read the object from disk. Performs class-specific
-        conversions when deserializing"""
-        name = self._filename(tag)
-        if os.path.exists(name):
-            with open(name, 'rb') as to_read:
-                try:
-                    obj = pickle.load(to_read)
-                except Exception:   # something bad happened during unpickling
-                    obj = None
-
-            if isinstance(obj, struct.Node):
-                struct.walk(obj, _deserialize_xml_fields)
-            return obj
-
-    def _reset(self):
-        """Used for testing"""
-        self.counter = 0
-        self.ignore_checkpoints = False
-
-    def checkpoint(self, tag, fn, force=False):
-        """Primary interface for storing an object"""
-        self.counter += 1
-        existing = self._deserialize(tag)
-        if not force and existing is not None and not self.ignore_checkpoints:
+    def _key(self, tag, inputs=()):
+        """Combine the tag name and a digest of the inputs"""
+        name = re.sub(r"\s", "", tag.lower()) + self.suffix
+        return name + "-" + input_digest(name, inputs) + ".p"
+
+    def _filename(self, tag, inputs=()):
+        return os.path.join(self.file_path, self._key(tag, inputs))
+
+    def _exists(self, filename):
+        return os.path.exists(filename)
+
+    def _read(self, filename):
+        if os.path.exists(filename):
+            with open(filename, 'rb') as to_read:
+                return to_read.read()
+
+    def _write(self, filename, data, tag, seconds, version):
+        with open(filename, 'wb') as to_write:
+            to_write.write(data)
+
+    def _serialize(self, filename, obj, tag=None, seconds=None,
+                   version=None):
+        """Pickle the object (Nodes take care of their own XML),
+        compressing it if configured to. `seconds` is how long the object
+        took to compute and `version` the regulation version it belongs to,
+        if any"""
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        if self.compression:
+            _, compress, _ = CHECKPOINT_CODECS[self.compression]
+            data = compress(data)
+        self._write(filename, data, tag, seconds, version)
+
+    def _deserialize(self, filename):
+        """Attempts to read the object from storage. Compression is detected
+        from the data, so changing the setting doesn't invalidate existing
+        checkpoints"""
+        data = self._read(filename)
+        if data is not None:
+            try:
+                for magic, _, decompress in CHECKPOINT_CODECS.values():
+                    if data.startswith(magic):
+                        data = decompress(data)
+                        break
+                return pickle.loads(data)
+            except Exception:   # something bad happened during unpickling
+                return None
+
+    def checkpoint(self, tag, fn, force=False, inputs=(), version=None):
+        """Primary interface for storing an object. `version` is the
+        regulation version the object belongs to; it's only recorded as
+        metadata (see SQLiteCheckpointer)"""
+        filename = self._filename(tag, inputs)
+        existing = None if force else self._deserialize(filename)
+        if existing is not None:
             return existing
         else:
+            start = time.time()
             result = fn()
-            self._serialize(tag, result)
-            self.ignore_checkpoints = True
+            self._serialize(filename, result, tag, time.time() - start,
+                            version)
             return result
 
+    def checkpoint_many(self, tags, fn, inputs=None, versions=None):
+        """Checkpoint a sequence of independent steps which may be computed
+        together (e.g. in parallel). `inputs` and `versions`, if present,
+        list each step's inputs and version. Only missing steps are
+        computed; `fn` receives the list of their tags and must return an
+        iterable of their values in the same order. This is a generator, so
+        values are loaded, saved and emitted as they become available"""
+        tags = list(tags)
+        if inputs is None:
+            inputs = [()] * len(tags)
+        if versions is None:
+            versions = [None] * len(tags)
+        filenames = [self._filename(tag, step_inputs)
+                     for tag, step_inputs in zip(tags, inputs)]
+        present = [self._exists(filename) for filename in filenames]
+        missing = [tag for tag, exists in zip(tags, present) if not exists]
+        computed = iter(fn(missing) if missing else [])
+
+        for tag, filename, exists, version in zip(tags, filenames, present,
+                                                  versions):
+            start = time.time()
+            if not exists:
+                value = next(computed)
+            else:
+                value = self._deserialize(filename)
+                if value is None:   # unreadable; compute it on its own
+                    start = time.time()
+                    value = next(iter(fn([tag])))
+                else:
+                    yield value
+                    continue
+            self._serialize(filename, value, tag, time.time() - start,
+                            version)
+            yield value
+
+
+class SQLiteCheckpointer(Checkpointer):
+    """Stores checkpoints in a single SQLite database rather than a file
+    per checkpoint, along with some metadata (the CFR part and version being
+    built, size, time to compute, when it was last used). The database is
+    in WAL mode, so multiple builds (processes) can share it safely. See
+    `gc` for removing old checkpoints."""
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            key TEXT PRIMARY KEY,
+            tag TEXT,
+            cfr_part TEXT,
+            version TEXT,
+            input_hash TEXT,
+            data BLOB,
+            size INTEGER,
+            seconds REAL,
+            created REAL,
+            accessed REAL)"""
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db_path = db_path
+        self.suffix = ""
+        self.compression = settings.CHECKPOINT_COMPRESSION
+        self._connection, self._pid = None, None
+
+    @property
+    def db(self):
+        """Connections can't be shared across processes, so we open one per
+        process"""
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_path, timeout=60)
+            self._connection.text_factory = str
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(self.SCHEMA)
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def _filename(self, tag, inputs=()):
+        return self._key(tag, inputs)
+
+    def _exists(self, key):
+        return self.db.execute("SELECT 1 FROM checkpoints WHERE key = ?",
+                               (key,)).fetchone() is not None
+
+    def _read(self, key):
+        row = self.db.execute("SELECT data FROM checkpoints WHERE key = ?",
+                              (key,)).fetchone()
+        if row:
+            with self.db:
+                self.db.execute(
+                    "UPDATE checkpoints SET accessed = ? WHERE key = ?",
+                    (time.time(), key))
+            return str(row[0])
+
+    def _write(self, key, data, tag, seconds, version):
+        #   The suffix is ":cfr_part:cfr_title:version", the latter being the
+        #   initial version, which is used if none was provided
+        suffix = self.suffix.split(":") + ["", "", "", ""]
+        if version is None:
+            version = suffix[3]
+        input_hash = key[:-len(".p")].rsplit("-", 1)[-1]
+        now = time.time()
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, tag, suffix[1], version, input_hash,
+                 sqlite3.Binary(data), len(data), seconds, now, now))
+
+    def gc(self, max_age=None, max_size=None, cfr_part=None):
+        """Remove checkpoints which haven't been used in `max_age` seconds,
+        then the least recently used checkpoints until the total is no more
+        than `max_size` bytes. Optionally limited to a single CFR part.
+        Returns the number of checkpoints and bytes removed"""
+        condition, params = "", ()
+        if cfr_part:
+            condition, params = " AND cfr_part = ?", (cfr_part,)
+
+        to_remove = []
+        if max_age is not None:
+            to_remove.extend(self.db.execute(
+                "SELECT key, size FROM checkpoints WHERE accessed < ?"
+                + condition, (time.time() - max_age,) + params))
+        if max_size is not None:
+            removing = set(key for key, _ in to_remove)
+            rows = self.db.execute(
+                "SELECT key, size FROM checkpoints WHERE 1" + condition
+                + " ORDER BY accessed DESC", params)
+            total = 0
+            for key, size in rows:
+                if key not in removing:
+                    total += size
+                    if total > max_size:
+                        to_remove.append((key, size))
+
+        with self.db:
+            self.db.executemany("DELETE FROM checkpoints WHERE key = ?",
+                                [(key,) for key, _ in to_remove])
+        if to_remove:
+            self.db.execute("VACUUM")
+        return len(to_remove), sum(size for _, size in to_remove)
+
 
 class NullCheckpointer(object):
-    def checkpoint(self, tag, fn, force=False):
+    def checkpoint(self, tag, fn, force=False, inputs=(), version=None):
         return fn()
 
+    def checkpoint_many(self, tags, fn, inputs=None, versions=None):
+        return fn(tags)
+
+
+def checkpointer_for(path):
+    """Checkpoints are stored in a SQLite database if the path ends with
+    .db or .sqlite, or in a directory otherwise. No path means no
+    checkpoints"""
+    if not path:
+        return NullCheckpointer()
+    elif path.endswith(('.db', '.sqlite')):
+        return SQLiteCheckpointer(path)
+    else:
+        return Checkpointer(path)
+
 
 def tree_and_builder(filename, title, checkpoint_path=None,
-                     writer_type=None, doc_number=None):
+                     writer_type=None, doc_number=None, workers=1):
     """Reads the regulation file and parses it. Returns the resulting tree as
     well as a Builder object for further manipulation. Looks up the doc_number
     if it's not provided"""
-    if checkpoint_path is None:
-        checkpointer = NullCheckpointer()
-    else:
-        checkpointer = Checkpointer(checkpoint_path)
+    checkpointer = checkpointer_for(checkpoint_path)
+    notice_registry = NoticeRegistry()
 
     reg_text = ''
     with codecs.open(filename, 'r', 'utf-8') as f:
@@ -436,7 +960,8 @@ def tree_and_builder(filename, title, checkpoint_path=None,
     if doc_number is None:
         doc_number = checkpointer.checkpoint(
             "doc-number-" + file_digest,
-            lambda: Builder.determine_doc_number(reg_text, title, title_part))
+            lambda: Builder.determine_doc_number(reg_text, title, title_part,
+                                                 notice_registry))
     if not doc_number:
         raise ValueError("Could not determine document number")
 
@@ -446,7 +971,9 @@ def tree_and_builder(filename, title, checkpoint_path=None,
                       cfr_part=title_part,
                       doc_number=doc_number,
                       checkpointer=checkpointer,
-                      writer_type=writer_type)
+                      writer_type=writer_type,
+                      workers=workers,
+                      notice_registry=notice_registry)
     builder.fetch_notices_json()
     builder.build_notices()
 
@@ -1,9 +1,16 @@
+# vim: set encoding=utf-8
+from collections import OrderedDict
 from itertools import chain
+import re
 
-from regparser.grammar import unified as grammar
+from regparser.grammar import lazy
+from regparser.intervals import IntervalSet
 from regparser.tree.struct import Node
 
 
+grammar = lazy('unified')
+
+
 class Label(object):
     #   @TODO: subparts
     app_sect_schema = ('part', 'appendix', 'appendix_section', 'p1', 'p2',
@@ -134,6 +141,44 @@ class ParagraphCitation(object):
             repr(self.start), repr(self.end), repr(self.label))
 
 
+#   A grammar can only match text which contains a match of its regex. The
+#   regexes are far cheaper to run, letting us skip most grammars (often all
+#   of them) for any given text
+_COMMENT_RE = re.compile(r'comment|official|supplement', re.IGNORECASE)
+_PARAGRAPH_RE = re.compile(r'paragraph', re.IGNORECASE)
+_SECTION_RE = re.compile(u'§|[Ss]ection')
+_SECTIONS_RE = re.compile(u'§§|[Ss]ections')
+_PARAGRAPH_OR_SECTION_RE = re.compile(u'paragraph|§|section', re.IGNORECASE)
+_APPENDIX_RE = re.compile(r'appendix', re.IGNORECASE)
+_APPENDICES_RE = re.compile(r'appendices', re.IGNORECASE)
+_APPENDIX_SECTION_RE = re.compile(r'[A-Z0-9]\s*-\s*[0-9]')
+_THE_APPENDIX_RE = re.compile(r'of\s+the\s+appendix\s+to\s+this\s+part')
+_SECTION_PARAGRAPH_RE = re.compile(r'[0-9]\s*\(')
+_PART_SECTION_RE = re.compile(r'[0-9]\s*\.\s*[0-9]')
+_CFR_RE = re.compile(r'[0-9]\s*CFR')
+PREFILTERS = {
+    'marker_comment': _COMMENT_RE,
+    'multiple_non_comments': _PARAGRAPH_OR_SECTION_RE,
+    'multiple_appendix_section': _APPENDIX_SECTION_RE,
+    'multiple_comments': _COMMENT_RE,
+    'multiple_appendices': _APPENDICES_RE,
+    'multiple_period_sections': _SECTIONS_RE,
+    'marker_appendix': _APPENDIX_RE,
+    'appendix_with_section': _APPENDIX_SECTION_RE,
+    'section_of_appendix_to_this_part': _THE_APPENDIX_RE,
+    'marker_paragraph': _PARAGRAPH_RE,
+    'mps_paragraph': _SECTION_RE,
+    'm_section_paragraph': _PARAGRAPH_RE,
+    'section_paragraph': _SECTION_PARAGRAPH_RE,
+    'part_section_paragraph': _PART_SECTION_RE,
+    'multiple_section_paragraphs': _SECTION_PARAGRAPH_RE,
+    'appendix_with_part': _APPENDIX_RE,
+    'appendix_par_of_part': _PARAGRAPH_RE,
+    'internal_cfr_p': _CFR_RE,
+    'multiple_cfr_p': _CFR_RE,
+}
+
+
 def match_to_label(match, initial_label, comment=False):
     """Return the citation and offsets for this match"""
     if comment:
@@ -160,6 +205,17 @@ def internal_citations(text, initial_label=None,
     if not initial_label:
         initial_label = Label()
     citations = []
+    present = {}
+
+    def scan(grammar_name):
+        """scanString with the named grammar, unless its prefilter shows it
+        can't match"""
+        regex = PREFILTERS[grammar_name]
+        if regex not in present:
+            present[regex] = bool(regex.search(text))
+        if present[regex]:
+            return getattr(grammar, grammar_name).scanString(text)
+        return []
 
     def multiple_citations(matches, comment):
         """i.e. head :: tail"""
@@ -186,32 +242,27 @@ def internal_citations(text, initial_label=None,
                                            comment=comment),
                 full_start=full_start))
 
-    single_citations(grammar.marker_comment.scanString(text), True)
-
-    multiple_citations(grammar.multiple_non_comments.scanString(text), False)
-    multiple_citations(grammar.multiple_appendix_section.scanString(text),
-                       False)
-    multiple_citations(grammar.multiple_comments.scanString(text), True)
-    multiple_citations(grammar.multiple_appendices.scanString(text), False)
-    multiple_citations(grammar.multiple_period_sections.scanString(text),
-                       False)
-
-    single_citations(grammar.marker_appendix.scanString(text), False)
-    single_citations(grammar.appendix_with_section.scanString(text), False)
-    single_citations(grammar.section_of_appendix_to_this_part.scanString(text),
-                     False)
-    single_citations(grammar.marker_paragraph.scanString(text), False)
-    single_citations(grammar.mps_paragraph.scanString(text), False)
-    single_citations(grammar.m_section_paragraph.scanString(text), False)
+    single_citations(scan('marker_comment'), True)
+
+    multiple_citations(scan('multiple_non_comments'), False)
+    multiple_citations(scan('multiple_appendix_section'), False)
+    multiple_citations(scan('multiple_comments'), True)
+    multiple_citations(scan('multiple_appendices'), False)
+    multiple_citations(scan('multiple_period_sections'), False)
+
+    single_citations(scan('marker_appendix'), False)
+    single_citations(scan('appendix_with_section'), False)
+    single_citations(scan('section_of_appendix_to_this_part'), False)
+    single_citations(scan('marker_paragraph'), False)
+    single_citations(scan('mps_paragraph'), False)
+    single_citations(scan('m_section_paragraph'), False)
     if not require_marker:
-        single_citations(grammar.section_paragraph.scanString(text), False)
-        single_citations(grammar.part_section_paragraph.scanString(text),
-                         False)
-        multiple_citations(
-            grammar.multiple_section_paragraphs.scanString(text), False)
-
-    for gram in (grammar.appendix_with_part, grammar.appendix_par_of_part):
-        for match, start, end in gram.scanString(text):
+        single_citations(scan('section_paragraph'), False)
+        single_citations(scan('part_section_paragraph'), False)
+        multiple_citations(scan('multiple_section_paragraphs'), False)
+
+    for grammar_name in ('appendix_with_part', 'appendix_par_of_part'):
+        for match, start, end in scan(grammar_name):
             full_start = start
             if match.marker is not '':
                 start = match.marker.pos[1]
@@ -230,7 +281,7 @@ def internal_citations(text, initial_label=None,
                     full_start=full_start))
 
     # Internal citations can sometimes be in the form XX CFR YY.ZZ
-    for match, start, end in grammar.internal_cfr_p.scanString(text):
+    for match, start, end in scan('internal_cfr_p'):
         # Check if this is a reference to the CFR title and part we are parsing
         if match.cfr_title == title and match[1] == initial_label.to_list()[0]:
             full_start = start
@@ -244,7 +295,7 @@ def internal_citations(text, initial_label=None,
             continue
 
     # And sometimes there are several of them
-    for match, start, end in grammar.multiple_cfr_p.scanString(text):
+    for match, start, end in scan('multiple_cfr_p'):
         label = initial_label
         if match.head.cfr_title == title:
             for submatch in chain([match.head], match.tail):
@@ -260,19 +311,52 @@ def internal_citations(text, initial_label=None,
         else:
             continue
 
-    # Remove any sub-citations
-    final_citations = []
-    for cit in citations:
-        if not any(cit in other for other in citations):
-            final_citations.append(cit)
+    return remove_sub_citations(citations)
+
+
+def remove_sub_citations(citations):
+    """Remove any citations which are properly included in another (i.e.
+    `cit in other`). Rather than compare each pair, we sweep through the
+    distinct spans, widest first among those starting at the same place;
+    a span is included in another iff some earlier span ends at or after
+    it."""
+    spans = sorted(set((c.full_start, c.full_end) for c in citations),
+                   key=lambda span: (span[0], -span[1]))
+    included, max_end = set(), None
+    for start, end in spans:
+        if max_end is not None and max_end >= end:
+            included.add((start, end))
+        else:
+            max_end = end
+    return [cit for cit in citations
+            if (cit.full_start, cit.full_end) not in included]
+
 
-    return final_citations
+#   Most recently used spans, keyed by text
+_citation_spans = OrderedDict()
+CITATION_SPANS_CACHE_SIZE = 1000
+
+
+def citation_spans(text):
+    """IntervalSet of the (start, end) of each citation in this text.
+    Memoized, as the same text is checked for overlaps with several kinds of
+    markers; the result is shared, so don't modify it"""
+    if text in _citation_spans:
+        spans = _citation_spans.pop(text)
+    else:
+        spans = IntervalSet((c.start, c.end)
+                            for c in internal_citations(text))
+    _citation_spans[text] = spans
+    if len(_citation_spans) > CITATION_SPANS_CACHE_SIZE:
+        _citation_spans.popitem(last=False)
+    return spans
 
 
 def remove_citation_overlaps(text, possible_markers):
     """Given a list of markers, remove any that overlap with citations"""
+    possible_markers = list(possible_markers)
+    if not possible_markers:
+        return []
+    citations = citation_spans(text)
     return [(m, start, end) for m, start, end in possible_markers
-            if not any((e.start <= start and e.end >= start)
-                       or (e.start <= end and e.end >= end)
-                       or (start <= e.start and end >= e.end)
-                       for e in internal_citations(text))]
+            if not citations.overlaps(start, end)]
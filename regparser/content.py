@@ -36,6 +36,12 @@ class ImageOverrides(object):
                 return source[key]
         return default
 
+    def sources(self):
+        """All of the loaded overrides, in priority order"""
+        loaded = [_try_to_load(source, 'overrides')
+                  for source in settings.OVERRIDES_SOURCES]
+        return [source for source in loaded if source]
+
 
 class RegPatches(object):
     def get(self, key, default=None):
@@ -94,6 +94,42 @@ REGPATCHES_SOURCES = [
 LOCAL_XML_PATHS = []
 
 
+# Responses from the Federal Register and GPO are cached on disk in this
+# directory. Set to None to disable caching
+HTTP_CACHE_DIR = 'fr_cache'
+
+# Number of seconds a cached response is considered fresh, by resource
+# type. None means "forever". Stale responses are revalidated with the
+# server (via ETag/Last-Modified) when possible
+HTTP_CACHE_TTLS = {
+    'articles': 24 * 60 * 60,
+    'notice-xml': None,
+    'annual-edition': 30 * 24 * 60 * 60,
+    'thumbnail': 7 * 24 * 60 * 60,
+}
+
+# Never make network requests; only use the HTTP cache. Requests which
+# aren't in the cache will fail
+HTTP_CACHE_OFFLINE = False
+
+# Compress checkpoints: None, 'zlib' (fast) or 'bz2' (smaller)
+CHECKPOINT_COMPRESSION = None
+
+# Layer elements can be persisted across runs in this SQLite database; None
+# disables the persistent cache. Once larger than LAYER_CACHE_MAX_SIZE
+# (bytes), the least recently used elements are evicted
+LAYER_CACHE_PATH = None
+LAYER_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+# Enable pyparsing's packrat parsing with a cache of this many entries; None
+# disables it. Check the output and timing with benchmarks.grammars first
+GRAMMAR_PACKRAT_CACHE_SIZE = None
+
+# How FrozenNodes (used when diffing versions) are hashed: 'sha256' or
+# 'fast' (Python's built-in hash, which isn't stable across platforms)
+FROZEN_NODE_HASH = 'sha256'
+
+
 # Sometimes appendices provide examples or model forms that include
 # labels that we would otherwise recognize as structural to the appendix
 # text itself. This specifies those labels to ignore by regulation
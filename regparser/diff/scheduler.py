@@ -0,0 +1,60 @@
+"""Computing diffs between every pair of versions of a regulation is the
+most expensive part of a build. These functions spread that work over
+multiple processes."""
+import multiprocessing
+
+from regparser.diff.tree import DeltaComposer
+
+
+#   Each worker process receives the composer (and hence all of the
+#   versions) once, when it starts, rather than with every pair
+_composer = None
+
+
+def _init_worker(composer):
+    global _composer
+    _composer = composer
+
+
+def _diff(pair):
+    return _composer.changes_between(*pair)
+
+
+def all_pairs(version_ids):
+    """Every (lhs, rhs) combination of version ids, including "empty" pairs
+    which compare a version to itself"""
+    version_ids = list(version_ids)
+    return [(lhs, rhs) for lhs in version_ids for rhs in version_ids]
+
+
+def diffs(versions, pairs, workers=1):
+    """Given a list of (version id, FrozenNode) pairs, in chronological
+    order, and a list of (lhs, rhs) version id pairs, generate the changes
+    (as a dict) for each pair, in the same order. Only adjacent versions are
+    diffed directly; other pairs are derived from those deltas (see
+    DeltaComposer). Pairs whose trees are identical are resolved without any
+    work; the rest are fanned out to `workers` processes. This is a
+    generator, so results are emitted as they complete."""
+    composer = DeltaComposer(versions)
+    trees = composer.trees
+    trivial = [trees[lhs].hash == trees[rhs].hash for lhs, rhs in pairs]
+    to_compute = [pair for pair, same in zip(pairs, trivial) if not same]
+
+    if workers <= 1 or len(to_compute) <= 1:
+        pool = None
+        results = (composer.changes_between(lhs, rhs)
+                   for lhs, rhs in to_compute)
+    else:
+        pool = multiprocessing.Pool(workers, _init_worker, (composer,))
+        results = pool.imap(_diff, to_compute)
+
+    try:
+        for same in trivial:
+            if same:
+                yield {}
+            else:
+                yield next(results)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -1,6 +1,7 @@
 import difflib
 import re
 
+from regparser.intervals import IntervalSet
 from regparser.layer.graphics import Graphics
 
 
@@ -12,10 +13,10 @@ EQUAL = 'equal'
 
 def deconstruct_text(text):
     """ Split the text into a list of words, but avoid graphics markers """
-    excludes = [(m.start(), m.end()) for m in Graphics.gid.finditer(text)]
+    excludes = IntervalSet((m.start(), m.end())
+                           for m in Graphics.gid.finditer(text))
     spaces = [(m.start(), m.end()) for m in re.finditer(r'\s+', text)]
-    spaces = [(s[0], s[1]) for s in spaces
-              if not any(e[0] <= s[0] and e[1] >= s[1] for e in excludes)]
+    spaces = [s for s in spaces if not excludes.covers(*s)]
 
     last_space, words = 0, []
     for s in spaces:
@@ -25,15 +25,13 @@ def _local_changes(lhs, rhs):
         return [(lhs.label_id, node_changes)]
 
 
-def _new_in_rhs(lhs_list, rhs_list):
-    """Compare the lhs and rhs lists to see if the rhs contains elements not
-    in the lhs"""
-    added = []
-    lhs_codes = tuple(map(lambda n: n.label_id, lhs_list))
-    for node in rhs_list:
-        if node.label_id not in lhs_codes:
-            added.append(node)
-    return added
+def _by_label(nodes):
+    """Map each label_id to the nodes (usually just one) with that label, in
+    order"""
+    by_label = {}
+    for node in nodes:
+        by_label.setdefault(node.label_id, []).append(node)
+    return by_label
 
 
 def _data_for_add(node):
@@ -63,8 +61,12 @@ def changes_between(lhs, rhs):
 
     changes.extend(_local_changes(lhs, rhs))
 
-    # Removed children. Note params reversed
-    removed_children = _new_in_rhs(rhs.children, lhs.children)
+    lhs_by_label = _by_label(lhs.children)
+    rhs_by_label = _by_label(rhs.children)
+
+    # Removed children
+    removed_children = [child for child in lhs.children
+                        if child.label_id not in rhs_by_label]
     changes.extend(map(_data_for_delete, removed_children))
     # grandchildren which appear to be deleted, but may just have been moved
     possibly_moved = {}
@@ -73,7 +75,9 @@ def changes_between(lhs, rhs):
             possibly_moved[grandchild.label_id] = grandchild
 
     # New children. Determine if they are added or moved
-    for added in _new_in_rhs(lhs.children, rhs.children):
+    for added in rhs.children:
+        if added.label_id in lhs_by_label:
+            continue
         changes.append(_data_for_add(added))
         for grandchild in added.children:
             if grandchild.label_id in possibly_moved:   # it *was* moved
@@ -87,9 +91,88 @@ def changes_between(lhs, rhs):
     for removed in possibly_moved.values():
         changes.extend(struct.walk(removed, _data_for_delete))
 
-    # Recurse on modified children. Again, this does *not* track reordering
+    # Recurse on modified children, pairing them by label (every pair, if a
+    # label is repeated). Again, this does *not* track reordering
     for lhs_child in lhs.children:
-        for rhs_child in rhs.children:
-            if lhs_child.label_id == rhs_child.label_id:
+        for rhs_child in rhs_by_label.get(lhs_child.label_id, ()):
+            # FrozenNodes are interned, so unchanged subtrees are usually
+            # the same object; otherwise, equality compares hashes first
+            if not (lhs_child is rhs_child or lhs_child == rhs_child):
                 changes.extend(changes_between(lhs_child, rhs_child))
     return changes
+
+
+def _index(root):
+    """Map each label_id in the tree to its node and its parent's label_id.
+    Returns None if a label appears more than once"""
+    index, stack = {}, [(root, None)]
+    while stack:
+        node, parent_label = stack.pop()
+        if node.label_id in index:
+            return None
+        index[node.label_id] = (node, parent_label)
+        stack.extend((child, node.label_id) for child in node.children)
+    return index
+
+
+def _reparented(lhs_index, rhs_index, labels=None):
+    """Do any of these labels (default: all) appear in both trees, but with
+    different parents?"""
+    if labels is None:
+        labels = lhs_index.iterkeys()
+    for label in labels:
+        if (label in lhs_index and label in rhs_index
+                and lhs_index[label][1] != rhs_index[label][1]):
+            return True
+    return False
+
+
+class DeltaComposer(object):
+    """Rather than diffing every pair of versions from scratch, diff only
+    adjacent versions and derive the rest. Any label which differs between
+    two versions must have been changed by one of the intervening deltas, so
+    we need only inspect those labels in the two trees. When no node has
+    moved to a new parent, changes_between reduces to exactly these
+    per-label comparisons; otherwise, we fall back to it."""
+    def __init__(self, versions):
+        """versions is a list of (version_id, FrozenNode) pairs. Any order
+        will produce correct results, but chronological order keeps the
+        deltas small"""
+        self.trees = dict(versions)
+        self._position = dict((version_id, idx)
+                              for idx, (version_id, _) in enumerate(versions))
+        self._indexes = [_index(tree) for _, tree in versions]
+        self._deltas, self._moves = [], []
+        for idx in range(len(versions) - 1):
+            lhs, rhs = versions[idx][1], versions[idx + 1][1]
+            lhs_index, rhs_index = self._indexes[idx:idx + 2]
+            self._deltas.append(set(
+                label for label, _ in changes_between(lhs, rhs)))
+            self._moves.append(lhs_index is None or rhs_index is None
+                               or _reparented(lhs_index, rhs_index))
+
+    def changes_between(self, lhs_id, rhs_id):
+        """Same output as dict(changes_between(lhs, rhs)) for the trees
+        associated with these version ids"""
+        lhs, rhs = self.trees[lhs_id], self.trees[rhs_id]
+        if lhs == rhs:
+            return {}
+        lhs_pos, rhs_pos = self._position[lhs_id], self._position[rhs_id]
+        start, end = min(lhs_pos, rhs_pos), max(lhs_pos, rhs_pos)
+        lhs_index, rhs_index = self._indexes[lhs_pos], self._indexes[rhs_pos]
+        labels = set().union(*self._deltas[start:end])
+
+        if (any(self._moves[start:end])
+                or _reparented(lhs_index, rhs_index, labels)):
+            return dict(changes_between(lhs, rhs))
+
+        changes = {}
+        for label in labels:
+            if label in lhs_index and label in rhs_index:
+                changes.update(_local_changes(lhs_index[label][0],
+                                              rhs_index[label][0]))
+            elif label in rhs_index:
+                changes.update([_data_for_add(rhs_index[label][0])])
+            elif label in lhs_index:
+                changes.update([_data_for_delete(lhs_index[label][0])])
+        return changes
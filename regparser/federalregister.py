@@ -1,35 +1,109 @@
+import logging
+import time
+
 import requests
 
+from regparser import http_cache
 from regparser.notice.build import build_notice
 
 FR_BASE = "https://www.federalregister.gov"
 API_BASE = FR_BASE + "/api/v1/"
 
+NOTICE_FIELDS = [
+    "abstract", "action", "agency_names", "cfr_references", "citation",
+    "comments_close_on", "dates", "document_number", "effective_on",
+    "end_page", "full_text_xml_url", "html_url", "publication_date",
+    "regulation_id_numbers", "start_page", "type", "volume"]
+
+
+class FederalRegisterClient(object):
+    """Wraps the Federal Register's API. All requests go through an
+    http_cache.HTTPCache (sharing its connection pool) and are retried (with
+    exponential backoff) if they fail for transient reasons. Search results
+    are paged through transparently and memoized for the life of the
+    client."""
+    def __init__(self, api_base=API_BASE, per_page=1000, retries=3,
+                 backoff=1.0, http=None):
+        self.api_base = api_base
+        self.per_page = per_page
+        self.retries = retries
+        self.backoff = backoff
+        self.http = http or http_cache.cache()
+        self._results = {}
+
+    def get(self, url, **kwargs):
+        """GET the url, retrying on connection errors and server-side (5xx)
+        errors"""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                logging.warning("retrying %s in %s seconds", url, delay)
+                time.sleep(delay)
+            try:
+                response = self.http.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code < 500 or attempt == self.retries:
+                    return response
+
+    def iter_notice_json(self, cfr_title, cfr_part, only_final=False,
+                         max_effective_date=None):
+        """Generator of the JSON for all articles associated with this part,
+        oldest first. Handles paging."""
+        key = (cfr_title, cfr_part, only_final, max_effective_date)
+        if key in self._results:
+            for result in self._results[key]:
+                yield result
+            return
+
+        params = {
+            "conditions[cfr][title]": cfr_title,
+            "conditions[cfr][part]": cfr_part,
+            "per_page": self.per_page,
+            "order": "oldest",
+            "fields[]": NOTICE_FIELDS}
+        if only_final:
+            params["conditions[type][]"] = 'RULE'
+        if max_effective_date:
+            params["conditions[effective_date][lte]"] = max_effective_date
+
+        results = []
+        url = self.api_base + "articles"
+        while url:
+            response = self.get(url, resource='articles',
+                                params=params).json()
+            for result in response.get('results', []):
+                results.append(result)
+                yield result
+            #   next_page_url already includes the query parameters
+            url, params = response.get('next_page_url'), None
+        self._results[key] = results
+
+    def notice_json(self, cfr_title, cfr_part, only_final=False,
+                    max_effective_date=None):
+        """As iter_notice_json, but returns a list"""
+        return list(self.iter_notice_json(cfr_title, cfr_part, only_final,
+                                          max_effective_date))
+
+
+_client = None
+
+
+def client():
+    """The FederalRegisterClient shared by everything in this process"""
+    global _client
+    if _client is None:
+        _client = FederalRegisterClient()
+    return _client
+
 
 def fetch_notice_json(cfr_title, cfr_part, only_final=False,
                       max_effective_date=None):
-    """Search through all articles associated with this part. Right now,
-    limited to 1000; could use paging to fix this in the future."""
-    params = {
-        "conditions[cfr][title]": cfr_title,
-        "conditions[cfr][part]": cfr_part,
-        "per_page": 1000,
-        "order": "oldest",
-        "fields[]": [
-            "abstract", "action", "agency_names", "cfr_references", "citation",
-            "comments_close_on", "dates", "document_number", "effective_on",
-            "end_page", "full_text_xml_url", "html_url", "publication_date",
-            "regulation_id_numbers", "start_page", "type", "volume"]}
-    if only_final:
-        params["conditions[type][]"] = 'RULE'
-    if max_effective_date:
-        params["conditions[effective_date][lte]"] = max_effective_date
-
-    response = requests.get(API_BASE + "articles", params=params).json()
-    if 'results' in response:
-        return response['results']
-    else:
-        return []
+    """Search through all articles associated with this part"""
+    return client().notice_json(cfr_title, cfr_part, only_final,
+                                max_effective_date)
 
 
 def fetch_notices(cfr_title, cfr_part, only_final=False):
@@ -0,0 +1,56 @@
+"""Grammar modules (atomic, unified, amdpar, terms, etc.) build their
+pyparsing grammars when imported. Code which uses them should go through
+`lazy`, which defers that work until a grammar is first used, so importing
+e.g. regparser.builder doesn't pay for grammars it won't need.
+
+This is also where pyparsing's packrat parsing (memoizing the result of
+matching each expression at each location) is configured. It is disabled by
+default (see GRAMMAR_PACKRAT_CACHE_SIZE): with our grammars and pyparsing
+1.5.7 the bookkeeping outweighs the savings, and some amdpar parse actions
+depend on being re-run when backtracking. Use benchmarks.grammars to check
+both before enabling it."""
+from pyparsing import ParserElement
+
+from regparser.utils import LazyModule
+import settings
+
+
+class BoundedCache(dict):
+    """Packrat cache which is cleared once it holds `max_size` entries.
+    pyparsing only clears its cache at the start of each parse/scan, which
+    is unbounded for long texts"""
+    def __init__(self, max_size):
+        super(BoundedCache, self).__init__()
+        self.max_size = max_size
+
+    def __setitem__(self, key, value):
+        if len(self) >= self.max_size:
+            self.clear()
+        super(BoundedCache, self).__setitem__(key, value)
+
+
+def enable_packrat(cache_size):
+    """Packrat parsing is global to pyparsing, affecting all grammars"""
+    ParserElement._exprArgCache = BoundedCache(cache_size)
+    ParserElement.enablePackrat()
+
+
+def disable_packrat():
+    ParserElement._parse = ParserElement._parseNoCache
+    ParserElement._packratEnabled = False
+    ParserElement.resetCache()
+
+
+_registry = {}
+
+
+def lazy(module_name):
+    """The (lazily imported) grammar module with this name, e.g.
+    lazy('unified').marker_comment"""
+    if module_name not in _registry:
+        _registry[module_name] = LazyModule(__name__ + '.' + module_name)
+    return _registry[module_name]
+
+
+if settings.GRAMMAR_PACKRAT_CACHE_SIZE:
+    enable_packrat(settings.GRAMMAR_PACKRAT_CACHE_SIZE)
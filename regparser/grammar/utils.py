@@ -1,11 +1,26 @@
-from pyparsing import alphanums, CaselessLiteral, getTokensEndLoc, Literal
-from pyparsing import Suppress, WordEnd, WordStart
+import sys
+
+from pyparsing import alphanums, CaselessLiteral, Literal
+from pyparsing import ParseFatalException, Suppress, WordEnd, WordStart
+
+
+def tokens_end_loc():
+    """Equivalent to pyparsing.getTokensEndLoc, which is far slower as
+    inspect.stack() looks up the source code of every frame. Finds the
+    location pyparsing is parsing from in the nearest _parseNoCache frame"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name == '_parseNoCache':
+            return frame.f_locals['loc']
+        frame = frame.f_back
+    raise ParseFatalException(
+        "tokens_end_loc may only be called from within a parse action")
 
 
 def keep_pos(source, location, tokens):
     """Wrap the tokens with a class that also keeps track of the match's
     location."""
-    return (WrappedResult(tokens, location, getTokensEndLoc()),)
+    return (WrappedResult(tokens, location, tokens_end_loc()),)
 
 
 class WrappedResult():
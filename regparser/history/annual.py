@@ -2,8 +2,8 @@ import logging
 import re
 
 from lxml import etree
-import requests
 
+from regparser import http_cache
 from regparser.federalregister import fetch_notice_json
 from regparser.history.delays import modify_effective_dates
 from regparser.notice.build import build_notice
@@ -22,7 +22,8 @@ class Volume(object):
         self.title = title
         self.vol_num = vol_num
         self.url = CFR_BULK_URL.format(year=year, title=title, volume=vol_num)
-        self._response = requests.get(self.url, stream=True)
+        self._response = http_cache.cache().get(
+            self.url, resource='annual-edition', stream=True)
         self.exists = self._response.status_code == 200
 
     def should_contain(self, part):
@@ -50,7 +51,7 @@ class Volume(object):
     def find_part_xml(self, part):
         url = CFR_PART_URL.format(year=self.year, title=self.title,
                                   volume=self.vol_num, part=part)
-        response = requests.get(url)
+        response = http_cache.cache().get(url, resource='annual-edition')
         if response.status_code == 200:
             return etree.fromstring(response.content)
 
@@ -1,8 +1,10 @@
 from datetime import date
 from itertools import dropwhile, takewhile
 
-from regparser.grammar.delays import tokenizer as delay_tokenizer
-from regparser.grammar.delays import Delayed, EffectiveDate, Notice
+from regparser.grammar import lazy
+
+
+grammar = lazy('delays')
 
 
 def modify_effective_dates(notices):
@@ -38,17 +40,17 @@ def altered_frs(sent):
     """Tokenize the provided sentence and check if it is a format that
     indicates that some notices have changed. This format is:
     ... "effective date" ... FRNotices ... "delayed" ... (UntilDate)"""
-    tokens = [token[0] for token, _, _ in delay_tokenizer.scanString(sent)]
-    tokens = list(dropwhile(lambda t: not isinstance(t, EffectiveDate),
+    tokens = [token[0] for token, _, _ in grammar.tokenizer.scanString(sent)]
+    tokens = list(dropwhile(lambda t: not isinstance(t, grammar.EffectiveDate),
                   tokens))
     if not tokens:
         return [], None
     #   Remove the "effective date"
     tokens = tokens[1:]
 
-    frs = list(takewhile(lambda t: not isinstance(t, Delayed), tokens))
+    frs = list(takewhile(lambda t: not isinstance(t, grammar.Delayed), tokens))
     tokens = tokens[len(frs):]
-    frs = [t for t in frs if isinstance(t, Notice)]
+    frs = [t for t in frs if isinstance(t, grammar.Notice)]
 
     if not frs or not tokens:
         return [], None
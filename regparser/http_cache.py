@@ -0,0 +1,268 @@
+"""All of the parser's requests to the Federal Register and GPO go through
+an on-disk cache. Response bodies are stored by the SHA-256 of their
+content; a small JSON record for each request points at the body and keeps
+the headers needed to revalidate it (ETag, Last-Modified). How long a
+response is considered fresh depends on the type of resource requested.
+In offline mode, the network is never consulted."""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+import settings
+
+
+class OfflineError(requests.RequestException):
+    """Raised when a request is not in the cache and we may not use the
+    network"""
+    pass
+
+
+class CachedResponse(object):
+    """A small subset of requests.Response, built from the cache"""
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_lines(self):
+        return iter(self.content.splitlines())
+
+
+class StreamedResponse(object):
+    """A streamed response which remembers the lines its caller reads.
+    `lines` were read (and cached) by an earlier caller; past those,
+    `fetch` streams the body's lines from the server. When the caller stops
+    reading, `save` receives the lines read and whether that was all of
+    them"""
+    def __init__(self, url, status_code, headers, lines, fetch, save):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self._lines = lines
+        self._fetch = fetch
+        self._save = save
+
+    def iter_lines(self):
+        read, complete = [], False
+        try:
+            for line in self._lines:
+                read.append(line)
+                yield line
+            for line in itertools.islice(self._fetch(), len(read), None):
+                read.append(line)
+                yield line
+            complete = True
+        finally:
+            if len(read) > len(self._lines) or complete:
+                self._save(read, complete)
+
+
+class HTTPCache(object):
+    """Wraps a requests.Session (and hence a connection pool). If no
+    cache_dir is provided, requests are passed straight through to the
+    session. `ttls` maps resource types to the number of seconds a response
+    is fresh (None meaning forever); once stale, a response is revalidated
+    with the server if possible. Client errors (e.g. a 404 for an annual
+    edition which hasn't been published yet) are only fresh for ERROR_TTL
+    seconds; server errors aren't cached at all."""
+    DEFAULT_TTL = 24 * 60 * 60
+    ERROR_TTL = 60 * 60
+
+    def __init__(self, cache_dir=None, ttls=None, offline=False,
+                 session=None):
+        self.cache_dir = cache_dir
+        self.ttls = ttls or {}
+        self.offline = offline
+        self.session = session or requests.Session()
+        self._lock = threading.Lock()
+
+    def get(self, url, resource=None, **kwargs):
+        return self.request('GET', url, resource, **kwargs)
+
+    def head(self, url, resource=None, **kwargs):
+        return self.request('HEAD', url, resource, **kwargs)
+
+    def request(self, method, url, resource=None, params=None, **kwargs):
+        """Fetch the url, consulting the cache first. `resource` is the
+        type of resource requested (e.g. 'notice-xml'), which determines
+        how long the response is fresh"""
+        if not self.cache_dir:
+            return self.session.request(method, url, params=params, **kwargs)
+        elif kwargs.get('stream'):
+            return self._stream(method, url, resource, params, **kwargs)
+
+        key = self._key(method, url, params)
+        record = self._read_record(key)
+        if record and record.get('streamed'):
+            record = None   # only holds the lines a streamed caller read
+        if record and (self.offline or self._fresh(record, resource)):
+            return self._response(record)
+        elif self.offline:
+            raise OfflineError("Not cached: {} {}".format(method, url))
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if record and record['headers'].get('etag'):
+            headers['If-None-Match'] = record['headers']['etag']
+        if record and record['headers'].get('last-modified'):
+            headers['If-Modified-Since'] = record['headers']['last-modified']
+
+        try:
+            response = self.session.request(
+                method, url, params=params, headers=headers, **kwargs)
+        except requests.RequestException:
+            if record:
+                logging.warning("Using stale cache for %s", url)
+                return self._response(record)
+            raise
+
+        if record and response.status_code == requests.codes.not_modified:
+            record['fetched_at'] = time.time()
+            self._write_record(key, record)
+            return self._response(record)
+        elif response.status_code >= 500:   # don't cache server errors
+            return response
+        else:
+            record = self._record(response, response.content, resource)
+            self._write_record(key, record)
+            return self._response(record)
+
+    def _stream(self, method, url, resource, params, **kwargs):
+        """Streamed requests are for large bodies of which the caller may
+        only read the start (e.g. to see which parts an annual volume
+        contains). We cache the lines that were read; should a later caller
+        read past those, the request is streamed again. Error responses are
+        cached whole"""
+        key = self._key(method, url, params)
+        record = self._read_record(key)
+        if record and (self.offline or self._fresh(record, resource)):
+            if self.offline or not record.get('partial'):
+                return self._response(record)
+
+            def fetch():
+                return self.session.request(
+                    method, url, params=params, **kwargs).iter_lines()
+            lines = self._response(record).content.splitlines()
+            return self._streamed(key, record, lines, fetch)
+        elif self.offline:
+            raise OfflineError("Not cached: {} {}".format(method, url))
+
+        response = self.session.request(method, url, params=params,
+                                        **kwargs)
+        if response.status_code >= 500:     # don't cache server errors
+            return response
+        elif response.status_code >= 400:
+            record = self._record(response, response.content, resource)
+            self._write_record(key, record)
+            return self._response(record)
+        else:
+            record = self._record(response, '', resource)
+            return self._streamed(key, record, [], response.iter_lines)
+
+    def _streamed(self, key, record, lines, fetch):
+        """A StreamedResponse which caches the lines read under `key`"""
+        def save(read, complete):
+            content = ''.join(line + '\n' for line in read)
+            record.update(digest=self._write_body(content), streamed=True,
+                          partial=not complete)
+            self._write_record(key, record)
+        return StreamedResponse(record['url'], record['status_code'],
+                                record['headers'], lines, fetch, save)
+
+    def _record(self, response, content, resource):
+        """The cache record for a response, storing `content` as its
+        body"""
+        return {
+            'url': response.url,
+            'status_code': response.status_code,
+            'headers': dict(
+                (name, response.headers[name])
+                for name in ('etag', 'last-modified', 'content-type')
+                if name in response.headers),
+            'digest': self._write_body(content),
+            'resource': resource,
+            'fetched_at': time.time()}
+
+    def _fresh(self, record, resource):
+        if record['status_code'] >= 400:
+            ttl = self.ERROR_TTL
+        else:
+            ttl = self.ttls.get(resource, self.DEFAULT_TTL)
+        return ttl is None or time.time() - record['fetched_at'] < ttl
+
+    @staticmethod
+    def _key(method, url, params):
+        """Requests are identified by their method, url and parameters"""
+        params = sorted((params or {}).items())
+        return hashlib.sha256(json.dumps([method, url, params])).hexdigest()
+
+    def _path(self, kind, digest):
+        return os.path.join(self.cache_dir, kind, digest[:2], digest)
+
+    def _write(self, path, content):
+        """Write atomically, so concurrent readers/writers don't see partial
+        files"""
+        directory = os.path.dirname(path)
+        with self._lock:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        handle, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'wb') as f:
+            f.write(content)
+        os.rename(tmp_path, path)
+
+    def _write_body(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._path('objects', digest)
+        if not os.path.exists(path):
+            self._write(path, content)
+        return digest
+
+    def _read_record(self, key):
+        """The cached record for this request, provided its body is also
+        present"""
+        path = self._path('requests', key)
+        if os.path.exists(path):
+            with open(path) as f:
+                try:
+                    record = json.load(f)
+                except ValueError:
+                    return None
+            if os.path.exists(self._path('objects', record['digest'])):
+                return record
+
+    def _write_record(self, key, record):
+        self._write(self._path('requests', key), json.dumps(record))
+
+    def _response(self, record):
+        with open(self._path('objects', record['digest']), 'rb') as f:
+            content = f.read()
+        return CachedResponse(record['url'], record['status_code'],
+                              record['headers'], content)
+
+
+_cache = None
+
+
+def cache():
+    """The HTTPCache shared by everything in this process, configured via
+    settings"""
+    global _cache
+    if _cache is None:
+        _cache = HTTPCache(settings.HTTP_CACHE_DIR, settings.HTTP_CACHE_TTLS,
+                           settings.HTTP_CACHE_OFFLINE)
+    return _cache
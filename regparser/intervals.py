@@ -0,0 +1,61 @@
+"""Many parts of the parser need to know whether a span of text overlaps
+spans found earlier (citations, defined terms, graphics markers, etc.). An
+IntervalSet answers those questions in logarithmic time rather than by
+scanning every span."""
+from bisect import bisect_right
+
+
+class IntervalSet(object):
+    """A collection of closed (start, end) intervals, which may overlap.
+    Intervals are kept sorted by start along with the running maximum of
+    their ends, so all queries reduce to whether some interval starts at or
+    before one point and ends at or after another."""
+    def __init__(self, intervals=()):
+        intervals = sorted(tuple(interval) for interval in intervals)
+        self._starts = [start for start, _ in intervals]
+        self._ends = [end for _, end in intervals]
+        self._max_ends = []
+        for end in self._ends:
+            if self._max_ends and self._max_ends[-1] > end:
+                end = self._max_ends[-1]
+            self._max_ends.append(end)
+
+    def add(self, start, end):
+        idx = bisect_right(self._starts, start)
+        self._starts.insert(idx, start)
+        self._ends.insert(idx, end)
+        if idx and self._max_ends[idx - 1] > end:
+            max_end = self._max_ends[idx - 1]
+        else:
+            max_end = end
+        self._max_ends.insert(idx, max_end)
+        #   Later running maximums may need to grow
+        for later in range(idx + 1, len(self._max_ends)):
+            if self._max_ends[later] >= max_end:
+                break
+            self._max_ends[later] = max_end
+
+    def _any(self, start_at_most, end_at_least):
+        idx = bisect_right(self._starts, start_at_most)
+        return bool(idx) and self._max_ends[idx - 1] >= end_at_least
+
+    def contains(self, point):
+        """Does any interval include this point?"""
+        return self._any(point, point)
+
+    def overlaps(self, start, end):
+        """Does any interval share at least one point with [start, end]?"""
+        return self._any(end, start)
+
+    def covers(self, start, end):
+        """Is [start, end] entirely within a single interval?"""
+        return self._any(start, end)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        return iter(zip(self._starts, self._ends))
+
+    def __repr__(self):
+        return 'IntervalSet(%r)' % list(self)
@@ -1,10 +1,13 @@
 # vim: set encoding=utf-8
 from collections import defaultdict
-from regparser.grammar import external_citations as grammar
+from regparser.grammar import lazy
 
 from layer import Layer
 
 
+grammar = lazy('external_citations')
+
+
 class ExternalCitationParser(Layer):
     # The different types of citations
     CODE_OF_FEDERAL_REGULATIONS = 'CFR'
@@ -4,7 +4,7 @@ import logging
 
 import requests
 
-from regparser import content
+from regparser import content, http_cache
 from regparser.layer.layer import Layer
 import settings
 
@@ -16,17 +16,23 @@ class Graphics(Layer):
         thumb_url = re.sub(r'(.(png|gif|jpg))$', '.thumb' + '\\1', url)
 
         try:
-            response = requests.head(thumb_url)
+            response = http_cache.cache().head(thumb_url,
+                                               resource='thumbnail')
         except:
             logging.warning("Error fetching %s" % thumb_url)
             return
 
         if response.status_code == requests.codes.not_implemented:
-            response = requests.get(thumb_url)
+            response = http_cache.cache().get(thumb_url,
+                                              resource='thumbnail')
 
         if response.status_code == requests.codes.ok:
             return thumb_url
 
+    def cache_context(self):
+        return Layer.cache_context(self) + (
+            settings.DEFAULT_IMAGE_URL, content.ImageOverrides().sources())
+
     def process(self, node):
         """If this node has a marker for an image in it, note where to get
         that image."""
@@ -19,6 +19,10 @@ class InternalCitationParser(Layer):
             self.known_citations.add(tuple(node.label))
         walk(self.tree, per_node)
 
+    def cache_context(self):
+        """Citations to labels which aren't in the tree are removed"""
+        return Layer.cache_context(self) + (sorted(self.known_citations),)
+
     def process(self, node):
         citations_list = self.parse(node.text,
                                     label=Label.from_node(node),
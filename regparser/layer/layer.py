@@ -16,6 +16,12 @@ class Layer():
         """ Take the whole tree and do any pre-processing """
         pass
 
+    def cache_context(self):
+        """Anything other than the node itself which affects `process`.
+        Persisted layer elements are keyed by this (see
+        builder.LayerCache)"""
+        return (self.cfr_title, self.act_citation)
+
     def process(self, node):
         """ Construct the element of the layer relevant to processing the given
         node, so it returns (pargraph_id, layer_content) or None if there is no
@@ -1,7 +1,8 @@
 # vim: set fileencoding=utf-8
-from collections import defaultdict
+from collections import defaultdict, Mapping
 from itertools import chain
 import re
+import string
 
 import inflection
 try:
@@ -12,13 +13,17 @@ except ValueError:
 
 
 from regparser.citations import internal_citations, Label
-from regparser.grammar import terms as grammar
+from regparser.grammar import lazy
+from regparser.intervals import IntervalSet
 from regparser.layer.layer import Layer
 from regparser.tree import struct
 from regparser.tree.priority_stack import PriorityStack
 import settings
 
 
+grammar = lazy('terms')
+
+
 class Ref(object):
     def __init__(self, term, label, position):
         self.term = term
@@ -46,6 +51,149 @@ class ParentStack(PriorityStack):
         self.pop()
 
 
+class ScopedTerms(Mapping):
+    """Read-only view of the definitions within each scope. Definitions
+    are added via Terms.add_definitions, which also indexes them"""
+    def __init__(self, by_scope):
+        self._by_scope = by_scope
+
+    def __getitem__(self, scope):
+        if scope not in self._by_scope:
+            raise KeyError(scope)
+        return tuple(self._by_scope[scope])
+
+    def __iter__(self):
+        return iter(self._by_scope)
+
+    def __len__(self):
+        return len(self._by_scope)
+
+
+class ScopeTrie(object):
+    """Definitions indexed by their scope (a label prefix). Each node of the
+    trie knows which terms apply to labels beginning with its prefix,
+    inheriting its parent's terms (more specific definitions win). These are
+    computed lazily and shared between nodes, so they must not be
+    modified."""
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.children = {}
+        self.refs = []
+        self._terms = None
+        #   Compiled TermMatcher for self.terms, set by the Terms layer
+        self.matcher = None
+
+    def add(self, scope, refs):
+        node = self
+        for segment in scope:
+            if segment not in node.children:
+                node.children[segment] = ScopeTrie(node)
+            node = node.children[segment]
+        node.refs.extend(refs)
+        node.invalidate()
+
+    def invalidate(self):
+        """Descendants' terms are only computed after their ancestors', so
+        we can stop at the first node without any"""
+        if self._terms is not None:
+            self._terms, self.matcher = None, None
+            for child in self.children.values():
+                child.invalidate()
+
+    def find(self, label):
+        """The deepest node whose scope is a prefix of the label"""
+        node = self
+        for segment in label:
+            if segment not in node.children:
+                break
+            node = node.children[segment]
+        return node
+
+    @property
+    def terms(self):
+        """Map from term to Ref"""
+        if self._terms is None:
+            inherited = self.parent.terms if self.parent else {}
+            if self.refs:
+                self._terms = dict(inherited)
+                for ref in self.refs:
+                    self._terms[ref.term] = ref     # overwrites
+            else:
+                self._terms = inherited
+        return self._terms
+
+
+class TermMatcher(object):
+    """An Aho-Corasick automaton which finds all occurrences of many terms
+    in a single pass over the text. Occurrences are equivalent to
+    re.finditer(r'\bterm\b', text) for each term, i.e. they must sit on
+    (ASCII) word boundaries and don't overlap other occurrences of the
+    same term."""
+    WORD_CHARS = frozenset(unicode(string.ascii_letters + string.digits
+                                   + '_'))
+
+    def __init__(self, terms):
+        self.terms = sorted(set(terms))
+        #   Each state has a dict of transitions, a failure link and the
+        #   indexes of all of the terms which end at that state
+        self._goto, self._fail, self._out = [{}], [0], [[]]
+        for idx, term in enumerate(self.terms):
+            state = 0
+            for char in term:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._out[state].append(idx)
+        self._add_failure_links()
+
+    def _add_failure_links(self):
+        """Breadth-first, so that a state's failure link (a shorter state)
+        is complete before the state itself is processed"""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = (self._out[child]
+                                    + self._out[self._fail[child]])
+
+    def _is_boundary(self, text, pos):
+        before = pos > 0 and text[pos - 1] in self.WORD_CHARS
+        after = pos < len(text) and text[pos] in self.WORD_CHARS
+        return before != after
+
+    def find(self, text):
+        """Returns a dict mapping terms to their (start, end) offsets in
+        the text, in order"""
+        offsets = defaultdict(list)
+        last_end = [-1] * len(self.terms)
+        lengths = [len(term) for term in self.terms]
+
+        def emit(state, end):
+            for idx in self._out[state]:
+                start = end - lengths[idx]
+                if (start >= last_end[idx]
+                        and self._is_boundary(text, start)
+                        and self._is_boundary(text, end)):
+                    offsets[self.terms[idx]].append((start, end))
+                    last_end[idx] = end
+
+        state = 0
+        emit(state, 0)
+        for pos, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            emit(state, pos + 1)
+        return offsets
+
+
 class Terms(Layer):
     #   Regexes used in determining scope
     part_re, subpart_re = re.compile(r"\bpart\b"), re.compile(r"\bsubpart\b")
@@ -59,9 +207,15 @@ class Terms(Layer):
         Layer.__init__(self, *args, **kwargs)
         self.layer['referenced'] = {}
         #   scope -> List[(term, definition_ref)]
-        self.scoped_terms = defaultdict(list)
+        self._scoped_terms = defaultdict(list)
+        self.scoped_terms = ScopedTerms(self._scoped_terms)
+        #   Index of scoped_terms, for finding those applicable to a label
+        self.scope_trie = ScopeTrie()
         #   subpart -> list[section]
         self.subpart_map = defaultdict(list)
+        #   Memoized, as the same sets of terms apply to many nodes
+        self._matchers = {}
+        self._plurals = {}
 
     def add_subparts(self):
         """Document the relationship between sections and subparts"""
@@ -127,7 +281,7 @@ class Terms(Layer):
 
     def pre_process(self):
         """Step through every node in the tree, finding definitions. Add
-        these definition to self.scoped_terms. Also keep track of which
+        these definition via add_definitions. Also keep track of which
         subpart we are in. Finally, document all defined terms. """
         self.add_subparts()
         stack = ParentStack()
@@ -148,14 +302,14 @@ class Terms(Layer):
                 included, excluded = self.node_definitions(node, stack)
                 if included:
                     for scope in self.determine_scope(stack):
-                        self.scoped_terms[scope].extend(included)
-                self.scoped_terms['EXCLUDED'].extend(excluded)
+                        self.add_definitions(scope, included)
+                self.add_definitions('EXCLUDED', excluded)
 
         struct.walk(self.tree, per_node)
 
         referenced = self.layer['referenced']
-        for scope in self.scoped_terms:
-            for ref in self.scoped_terms[scope]:
+        for scope in self._scoped_terms:
+            for ref in self._scoped_terms[scope]:
                 key = ref.term + ":" + ref.label
                 if (key not in referenced     # New term
                         # Or this term is earlier in the paragraph
@@ -166,16 +320,19 @@ class Terms(Layer):
                         'position': ref.position
                     }
 
+    def add_definitions(self, scope, refs):
+        """Record that these definitions apply within the scope. Excluded
+        definitions (scope 'EXCLUDED') apply nowhere, so aren't indexed"""
+        self._scoped_terms[scope].extend(refs)
+        if scope != 'EXCLUDED':
+            self.scope_trie.add(scope, refs)
+
     def applicable_terms(self, label):
         """Find all terms that might be applicable to nodes with this label.
         Note that we don't have to deal with subparts as subpart_scope simply
-        applies the definition to all sections in a subpart"""
-        applicable_terms = {}
-        for segment_length in range(1, len(label) + 1):
-            scope = tuple(label[:segment_length])
-            for ref in self.scoped_terms.get(scope, []):
-                applicable_terms[ref.term] = ref    # overwrites
-        return applicable_terms
+        applies the definition to all sections in a subpart. The returned
+        dict is shared; don't modify it"""
+        return self.scope_trie.find(label).terms
 
     def is_exclusion(self, term, node):
         """Some definitions are exceptions/exclusions of a previously
@@ -268,11 +425,11 @@ class Terms(Layer):
         it can't be found"""
         # TODO: This cannot under any circumstances return None because it's
         #       being used in an addition upstack.
+        exclusions = IntervalSet(r.position for r in exclusions)
         start = 0
         while start >= 0:
             start = haystack.find(needle, start)
-            if not any(r.position[0] <= start and r.position[1] >= start
-                       for r in exclusions):
+            if not exclusions.contains(start):
                 return start
             start += 1
 
@@ -289,13 +446,19 @@ class Terms(Layer):
     def process(self, node):
         """Determine which (if any) definitions would apply to this node,
         then find if any of those terms appear in this node"""
-        applicable_terms = self.applicable_terms(node.label)
+        scope = self.scope_trie.find(node.label)
 
         layer_el = []
         #   Remove any definitions defined in this paragraph
         term_list = [
-            (term, ref) for term, ref in applicable_terms.iteritems()
+            (term, ref) for term, ref in scope.terms.iteritems()
             if ref.label != node.label_id()]
+        if len(term_list) == len(scope.terms):
+            if scope.matcher is None:
+                scope.matcher = self.matcher_for(scope.terms)
+            matcher = scope.matcher
+        else:
+            matcher = self.matcher_for(term for term, _ in term_list)
 
         exclusions = self.excluded_offsets(node.label_id(), node.text)
         exclusions = self.per_regulation_ignores(
@@ -305,7 +468,8 @@ class Terms(Layer):
         inclusions = self.per_regulation_includes(
             inclusions, node.label, node.text)
 
-        matches = self.calculate_offsets(node.text, term_list, exclusions)
+        matches = self.calculate_offsets(node.text, term_list, exclusions,
+                                         matcher=matcher)
         for term, ref, offsets in matches:
             layer_el.append({
                 "ref": ref.term + ':' + ref.label,
@@ -327,7 +491,7 @@ class Terms(Layer):
         we are defining shouldn't have links appear within the defined
         term.) More will be added in the future"""
         exclusions = []
-        for reflist in self.scoped_terms.values():
+        for reflist in self._scoped_terms.values():
             exclusions.extend(
                 ref.position for ref in reflist if ref.label == label)
         for ignore_term in settings.IGNORE_DEFINITIONS_IN['ALL']:
@@ -359,40 +523,51 @@ class Terms(Layer):
         return inclusions
 
     def calculate_offsets(self, text, applicable_terms, exclusions=[],
-                          inclusions=[]):
+                          inclusions=[], matcher=None):
         """Search for defined terms in this text, with a preference for all
-        larger (i.e. containing) terms."""
+        larger (i.e. containing) terms. `matcher` is the TermMatcher for the
+        applicable terms, if already known."""
 
         # don't modify the original
-        exclusions = list(exclusions)
+        exclusions = IntervalSet(exclusions)
         inclusions = list(inclusions)
 
+        if matcher is None:
+            matcher = self.matcher_for(t[0] for t in applicable_terms)
+
         # add plurals to applicable terms
-        pluralized = [(inflection.pluralize(t[0]), t[1])
-                      for t in applicable_terms]
-        applicable_terms += pluralized
+        pluralized = [(self.pluralize(t[0]), t[1]) for t in applicable_terms]
+        applicable_terms = applicable_terms + pluralized
 
         #   longer terms first
         applicable_terms.sort(key=lambda x: len(x[0]), reverse=True)
 
+        found = matcher.find(text.lower())
         matches = []
         for term, ref in applicable_terms:
-            re_term = ur'\b' + re.escape(term) + ur'\b'
-            offsets = [
-                (m.start(), m.end())
-                for m in re.finditer(re_term, text.lower())]
-            safe_offsets = []
-            for start, end in offsets:
-                #   Start is contained in an existing def
-                if any(start >= e[0] and start <= e[1] for e in exclusions):
-                    continue
-                #   End is contained in an existing def
-                if any(end >= e[0] and end <= e[1] for e in exclusions):
-                    continue
-                safe_offsets.append((start, end))
+            #   Neither start nor end may be contained in an existing def
+            safe_offsets = [
+                (start, end) for start, end in found.get(term, [])
+                if not exclusions.contains(start)
+                and not exclusions.contains(end)]
             if not safe_offsets:
                 continue
 
-            exclusions.extend(safe_offsets)
+            for start, end in safe_offsets:
+                exclusions.add(start, end)
             matches.append((term, ref, safe_offsets))
         return matches
+
+    def pluralize(self, term):
+        if term not in self._plurals:
+            self._plurals[term] = inflection.pluralize(term)
+        return self._plurals[term]
+
+    def matcher_for(self, terms):
+        """A TermMatcher for this set of terms (and their plurals), shared by
+        all nodes to which the same terms apply"""
+        key = frozenset(terms)
+        if key not in self._matchers:
+            self._matchers[key] = TermMatcher(
+                key | set(self.pluralize(term) for term in key))
+        return self._matchers[key]
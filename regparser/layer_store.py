@@ -0,0 +1,116 @@
+"""Layer elements are expensive to compute, but most paragraphs don't change
+from one run of the parser to the next. A LayerStore persists elements in a
+SQLite database, keyed by the layer, its code and context (e.g. settings)
+and the content of the node. Once the database grows beyond its maximum
+size, the least recently used elements are evicted."""
+import cPickle as pickle
+import os
+import sqlite3
+import time
+
+import settings
+
+
+class LayerStore(object):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS elements (
+            key TEXT PRIMARY KEY,
+            data BLOB,
+            size INTEGER,
+            accessed REAL)"""
+    #   Writes are batched, as committing each one is slow
+    BATCH_SIZE = 1000
+
+    def __init__(self, db_path, max_size=None):
+        directory = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db_path = db_path
+        self.max_size = max_size
+        self._connection, self._pid = None, None
+        self._pending, self._accessed = [], []
+
+    @property
+    def db(self):
+        """Connections can't be shared across processes, so we open one per
+        process"""
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_path, timeout=60)
+            self._connection.text_factory = str
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(self.SCHEMA)
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """Returns a pair: whether the key was found and its value"""
+        row = self.db.execute("SELECT data FROM elements WHERE key = ?",
+                              (key,)).fetchone()
+        if row is None:
+            return False, None
+        self._accessed.append(key)
+        return True, pickle.loads(str(row[0]))
+
+    def put(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._pending.append((key, sqlite3.Binary(data), len(data)))
+        if len(self._pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Write any pending elements, then evict if we're too large"""
+        if not self._pending and not self._accessed:
+            return
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO elements VALUES (?, ?, ?, ?)",
+                [pending + (now,) for pending in self._pending])
+            self.db.executemany(
+                "UPDATE elements SET accessed = ? WHERE key = ?",
+                [(now, key) for key in self._accessed])
+        self._pending, self._accessed = [], []
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def evict(self, max_size):
+        """Remove the least recently used elements until the total size is
+        no more than max_size. Returns the number of elements removed"""
+        total = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM elements").fetchone()[0]
+        to_remove = []
+        if total > max_size:
+            for key, size in self.db.execute(
+                    "SELECT key, size FROM elements ORDER BY accessed"):
+                if total <= max_size:
+                    break
+                to_remove.append((key,))
+                total -= size
+        with self.db:
+            self.db.executemany("DELETE FROM elements WHERE key = ?",
+                                to_remove)
+        return len(to_remove)
+
+    def __getstate__(self):
+        """Stores are sent to worker processes, which open their own
+        connections. Writes (and accesses) queued in this process are
+        flushed by this process alone, so copies start with none"""
+        state = dict(self.__dict__)
+        state['_connection'], state['_pid'] = None, None
+        state['_pending'], state['_accessed'] = [], []
+        return state
+
+
+_store = None
+
+
+def store():
+    """The LayerStore shared by everything in this process, configured via
+    settings. None if persistent layer caching is disabled"""
+    global _store
+    if _store is None and settings.LAYER_CACHE_PATH:
+        _store = LayerStore(settings.LAYER_CACHE_PATH,
+                            settings.LAYER_CACHE_MAX_SIZE)
+    return _store
@@ -1,13 +1,15 @@
 from copy import deepcopy
 from collections import defaultdict
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
 from urlparse import urlparse
 
 
 from lxml import etree
-import requests
 
+from regparser import http_cache
 from regparser.notice.address import fetch_addresses
 from regparser.notice.build_appendix import parse_appendix_changes
 from regparser.notice.build_interp import parse_interp_changes
@@ -21,13 +23,106 @@ from regparser.notice.util import spaces_then_remove, swap_emphasis_tags
 from regparser.notice import changes
 from regparser.tree import struct
 from regparser.tree.xml_parser import reg_text
-from regparser.grammar.unified import notice_cfr_p
+from regparser.grammar import lazy
 
 import settings
 
 
+unified = lazy('unified')
+
+
 def build_notice(cfr_title, cfr_part, fr_notice, do_process_xml=True):
     """ Given JSON from the federal register, create our notice structure """
+    notice = _partial_notice(cfr_title, cfr_part, fr_notice)
+
+    if fr_notice['full_text_xml_url'] and do_process_xml:
+        local_notices = _check_local_version_list(
+            fr_notice['full_text_xml_url'])
+
+        if len(local_notices) > 0:
+            logging.warning("using local xml for %s",
+                            fr_notice['full_text_xml_url'])
+            return process_local_notices(local_notices, notice)
+        else:
+            notice_str = _fetch_notice_xml(fr_notice['full_text_xml_url'])
+            return [process_notice(notice, notice_str)]
+    return [notice]
+
+
+def build_notices(cfr_title, cfr_part, fr_notices, workers=1):
+    """Concurrent version of build_notice. Given a list of JSON results
+    from the federal register, return a list of the corresponding notices
+    (each a list, as in build_notice), in the same order. With multiple
+    workers, XML is downloaded by a pool of threads and then parsed by a
+    pool of processes"""
+    if workers <= 1 or len(fr_notices) <= 1:
+        return [build_notice(cfr_title, cfr_part, fr_notice)
+                for fr_notice in fr_notices]
+
+    partials = [_partial_notice(cfr_title, cfr_part, fr_notice)
+                for fr_notice in fr_notices]
+    notice_strs = [[] for _ in fr_notices]
+    to_download = []
+    for idx, fr_notice in enumerate(fr_notices):
+        url = fr_notice['full_text_xml_url']
+        local_notices = _check_local_version_list(url) if url else []
+        if local_notices:
+            logging.warning("using local xml for %s", url)
+            for local_notice_file in local_notices:
+                with open(local_notice_file, 'r') as f:
+                    notice_strs[idx].append(f.read())
+        elif url:
+            to_download.append(idx)
+
+    #   Downloading is I/O bound, so threads are sufficient
+    pool = ThreadPool(min(workers, len(to_download) or 1))
+    try:
+        downloaded = pool.map(
+            _fetch_notice_xml,
+            [fr_notices[idx]['full_text_xml_url'] for idx in to_download])
+    finally:
+        pool.close()
+        pool.join()
+    for idx, notice_str in zip(to_download, downloaded):
+        notice_strs[idx].append(notice_str)
+
+    for partial, strs in zip(partials, notice_strs):
+        if len(strs) > 1:
+            _prepare_split(partial)
+    #   Parsing is CPU bound, so use processes
+    jobs = [(partial, notice_str)
+            for partial, strs in zip(partials, notice_strs)
+            for notice_str in strs]
+    pool = multiprocessing.Pool(min(workers, len(jobs) or 1))
+    try:
+        processed = iter(pool.map(_process_notice_job, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+    notices = []
+    for partial, strs in zip(partials, notice_strs):
+        if strs:
+            notices.append(set_document_numbers(
+                [next(processed) for _ in strs]))
+        else:
+            notices.append([partial])
+    return notices
+
+
+def _process_notice_job(args):
+    """Wrapper around process_notice for use with multiprocessing.Pool"""
+    return process_notice(*args)
+
+
+def _fetch_notice_xml(url):
+    logging.warning("fetching notice %s", url)
+    return http_cache.cache().get(url, resource='notice-xml').content
+
+
+def _partial_notice(cfr_title, cfr_part, fr_notice):
+    """The portion of the notice which can be derived from the federal
+    register's JSON, i.e. without looking at the XML"""
     logging.info('building notice, title {0}, part {1}, notice {2}'.format(
         cfr_title, cfr_part, fr_notice['document_number']))
     cfr_parts = set(str(ref['part']) for ref in fr_notice['cfr_references'])
@@ -66,21 +161,7 @@ def build_notice(cfr_title, cfr_part, fr_notice, do_process_xml=True):
     notice['meta'] = {}
     for key in ('dates', 'end_page', 'start_page', 'type'):
         notice['meta'][key] = fr_notice[key]
-
-    if fr_notice['full_text_xml_url'] and do_process_xml:
-        local_notices = _check_local_version_list(
-            fr_notice['full_text_xml_url'])
-
-        if len(local_notices) > 0:
-            logging.warning("using local xml for %s",
-                            fr_notice['full_text_xml_url'])
-            return process_local_notices(local_notices, notice)
-        else:
-            logging.warning("fetching notice %s",
-                            fr_notice['full_text_xml_url'])
-            notice_str = requests.get(fr_notice['full_text_xml_url']).content
-            return [process_notice(notice, notice_str)]
-    return [notice]
+    return notice
 
 
 def split_doc_num(doc_num, effective_date):
@@ -98,10 +179,7 @@ def process_local_notices(local_notices, partial_notice):
     notices = []
 
     if len(local_notices) > 1:
-        # If the notice is split, pick up the effective date and the
-        # CFR parts from the XML
-        partial_notice['effective_on'] = None
-        partial_notice['cfr_parts'] = None
+        _prepare_split(partial_notice)
 
     for local_notice_file in local_notices:
         with open(local_notice_file, 'r') as f:
@@ -112,6 +190,13 @@ def process_local_notices(local_notices, partial_notice):
     return notices
 
 
+def _prepare_split(partial_notice):
+    """If the notice is split, pick up the effective date and the CFR parts
+    from the XML"""
+    partial_notice['effective_on'] = None
+    partial_notice['cfr_parts'] = None
+
+
 def set_document_numbers(notices):
     """ If we have multiple notices, we need to fix their document
     numbers. """
@@ -395,7 +480,7 @@ def fetch_cfr_parts(notice_xml):
         multiple-effective-date notice that has multiple CFR parts that
         may not be included in each date. """
     cfr_elm = notice_xml.xpath('//CFR')[0]
-    results = notice_cfr_p.parseString(cfr_elm.text)
+    results = unified.notice_cfr_p.parseString(cfr_elm.text)
     return list(results)
 
 
@@ -22,7 +22,7 @@ def node_to_dict(node):
 
     node_dict = {}
     for k, v in node.__dict__.items():
-        if k not in ('children', 'source_xml'):
+        if k not in ('children', 'source_xml', struct.LAZY_XML_FIELD):
             node_dict[k] = v
     return node_dict
 
@@ -3,7 +3,6 @@ module contains code to compile a regulation from a notice's changes. """
 
 from bisect import bisect
 from collections import defaultdict
-import copy
 import itertools
 import logging
 
@@ -140,14 +139,208 @@ def is_interp_placeholder(node):
             and not node.text and not node.title)
 
 
+class TreeIndex(object):
+    """Label and parent lookups for a tree of Nodes, so that we needn't walk
+    the whole tree for each one. The index is only accurate if every change
+    to the tree's structure goes through `set_children` (and to a node's
+    label, through `relabel`). Conflicting changes can leave a node in two
+    places at once; while that's the case, we fall back to searching."""
+
+    def __init__(self, root):
+        self.root = root
+        self._rebuild()
+
+    def _rebuild(self):
+        self._by_label = {}     # label_id -> [node]
+        self._entries = {}      # id(node) -> (label_id, parent)
+        self._stale = False
+        if self.root is not None:
+            self._add(self.root, None)
+
+    def _valid(self):
+        if self._stale:
+            self._rebuild()
+        return not self._stale
+
+    def _add(self, node, parent):
+        if id(node) in self._entries:   # already in the tree elsewhere
+            self._stale = True
+            return
+        label_id = node.label_id()
+        self._by_label.setdefault(label_id, []).append(node)
+        self._entries[id(node)] = (label_id, parent)
+        for child in node.children:
+            self._add(child, node)
+
+    def _unlabel(self, node, label_id):
+        nodes = [n for n in self._by_label.get(label_id, [])
+                 if n is not node]
+        if nodes:
+            self._by_label[label_id] = nodes
+        else:
+            self._by_label.pop(label_id, None)
+
+    def _remove(self, node):
+        label_id, _ = self._entries.pop(id(node))
+        self._unlabel(node, label_id)
+        for child in node.children:
+            self._remove(child)
+
+    def set_children(self, parent, children):
+        """Replace the children of a node, re-indexing any subtrees which
+        were removed from or added to the tree"""
+        if self._stale or id(parent) not in self._entries:
+            parent.children = children
+            return
+        old_ids = set(id(child) for child in parent.children)
+        new_ids = set(id(child) for child in children)
+        for child in parent.children:
+            if id(child) not in new_ids:
+                self._remove(child)
+        parent.children = children
+        for child in children:
+            if id(child) not in old_ids:
+                self._add(child, parent)
+
+    def relabel(self, node, label):
+        """Change a node's label, which may or may not be in the tree"""
+        node.label = label
+        if not self._stale and id(node) in self._entries:
+            old_label_id, parent = self._entries[id(node)]
+            self._unlabel(node, old_label_id)
+            self._by_label.setdefault(node.label_id(), []).append(node)
+            self._entries[id(node)] = (node.label_id(), parent)
+
+    def find(self, label_id, within=None):
+        """As struct.find. Labels should be unique, but if several nodes
+        share this one, fall back to searching (`within`, if provided, or
+        the whole tree) so that we return the first in pre-order"""
+        if not self._valid():
+            return find(within or self.root, label_id)
+        nodes = self._by_label.get(label_id, [])
+        if len(nodes) == 1:
+            return nodes[0]
+        elif nodes:
+            return find(within or self.root, label_id)
+        else:
+            logging.warning('Failed to locate node with label %s', label_id)
+
+    def is_unique(self, label_id):
+        """Is exactly one node in the tree labeled thus? If so, `parent` and
+        `path` may be used"""
+        return self._valid() and len(self._by_label.get(label_id, [])) == 1
+
+    def parent(self, node):
+        """The node's actual parent in the tree (which may differ from what
+        its label implies, e.g. for sections in subparts). None for the root
+        and for nodes which aren't in the tree"""
+        parents = self.parents(node)
+        return parents[0] if parents else None
+
+    def _search(self):
+        """Each node object in the tree, once, in pre-order"""
+        seen, to_visit = set(), [self.root] if self.root is not None else []
+        while to_visit:
+            node = to_visit.pop()
+            if id(node) not in seen:
+                seen.add(id(node))
+                yield node
+                to_visit.extend(reversed(node.children))
+
+    def node_ids(self):
+        """The id of every node in the tree"""
+        if self._valid():
+            return set(self._entries)
+        return set(id(node) for node in self._search())
+
+    def parents(self, node):
+        """As `parent`, but a node which is in several places in the tree
+        has several parents"""
+        if self._valid():
+            parent = self._entries.get(id(node), (None, None))[1]
+            return [parent] if parent is not None else []
+        return [candidate for candidate in self._search()
+                if any(child is node for child in candidate.children)]
+
+    def replace(self, old, new):
+        """Swap a node in the tree for a copy of it, which shares its
+        children. The old node's parents should be safe to modify"""
+        if old is self.root:
+            self.root = new
+        parents = self.parents(old)
+        for parent in parents:
+            parent.children = [new if child is old else child
+                               for child in parent.children]
+        if not self._stale and id(old) in self._entries:
+            parent = parents[0] if parents else None
+            label_id, _ = self._entries.pop(id(old))
+            self._entries[id(new)] = (label_id, parent)
+            self._by_label[label_id] = [new if n is old else n
+                                        for n in self._by_label[label_id]]
+            for child in new.children:
+                self._entries[id(child)] = (self._entries[id(child)][0], new)
+
+    def path(self, node):
+        """Nodes from the root down to (and including) this node"""
+        path = [node]
+        while self.parent(path[-1]) is not None:
+            path.append(self.parent(path[-1]))
+        return list(reversed(path))
+
+
+def _shallow_copy(node):
+    """A new Node with the same fields (sharing children, source_xml, etc.)
+    as this one. Avoids Node.__getstate__, which serializes the XML"""
+    copied = Node.__new__(Node)
+    copied.__dict__.update(node.__dict__)
+    copied.children = list(node.children)
+    return copied
+
+
 class RegulationTree(object):
     """ This encapsulates a regulation tree, and methods to change that tree.
+    Changes to the tree's structure go through the `index`, which keeps
+    label lookups fast.
+
+    The new tree shares all of its nodes with the previous tree until they
+    are modified (see `_own`), so each version only copies the nodes which
+    change and their ancestors.
     """
 
     def __init__(self, previous_tree):
-        self.tree = copy.deepcopy(previous_tree)
+        self.tree = previous_tree
+        self._previous_tree = previous_tree     # keeps its nodes' ids valid
+        self.index = TreeIndex(self.tree)
+        self._shared = self.index.node_ids()
+        self._copies = {}       # id(shared node) -> its copy
         self._kept__by_parent = defaultdict(list)
 
+    def _current(self, node):
+        """References to a shared node from before it was copied should be
+        treated as references to the copy"""
+        return self._copies.get(id(node), node)
+
+    def _own(self, node):
+        """Nodes which are shared with the previous tree must be copied
+        before they are modified. Returns the node which may be modified, in
+        the tree if the original was"""
+        node = self._current(node)
+        if node is None or id(node) not in self._shared:
+            return node
+        copied = _shallow_copy(node)
+        for parent in self.index.parents(node):
+            self._own(parent)
+        self.index.replace(node, copied)
+        self.tree = self.index.root
+        self._copies[id(node)] = copied
+        return copied
+
+    def _set_children(self, parent, children):
+        """Returns the parent, which may have been copied"""
+        parent = self._own(parent)
+        self.index.set_children(parent, children)
+        return parent
+
     def keep(self, labels):
         """The 'KEEP' verb tells us that a node should not be removed
         (generally because it would had we dropped the children of its
@@ -161,19 +354,13 @@ class RegulationTree(object):
     def get_parent(self, node):
         """ Get the parent of a node. Returns None if parent not found. """
         parent_label_id = get_parent_label(node)
-        return find(self.tree, parent_label_id)
+        return self.index.find(parent_label_id)
 
     def add_to_root(self, node):
         """ Add a child to the root of the tree. """
-        self.tree.children.append(node)
-
-        for c in self.tree.children:
-            c.sortable = make_root_sortable(c.label, c.node_type)
-
-        self.tree.children.sort(key=lambda x: x.sortable)
-
-        for c in self.tree.children:
-            del c.sortable
+        children = self.tree.children + [node]
+        children.sort(key=lambda c: make_root_sortable(c.label, c.node_type))
+        self._set_children(self.tree, children)
 
     def add_child(self, children, node, order=None):
         """ Add a child to the children, and sort appropriately. This is used
@@ -219,11 +406,11 @@ class RegulationTree(object):
         else:
             parent = self.get_parent(node)
         other_children = [c for c in parent.children if c.label != node.label]
-        parent.children = other_children
+        self._set_children(parent, other_children)
 
     def delete(self, label_id):
         """ Delete the node with label_id from the tree. """
-        node = find(self.tree, label_id)
+        node = self.index.find(label_id)
         if node is None:
             logging.warning("Attempting to delete %s failed", label_id)
         else:
@@ -235,7 +422,7 @@ class RegulationTree(object):
         represented in the FR XML. We simply use that representation here
         instead of doing something else. """
 
-        existing_node = find(self.tree, label_id)
+        existing_node = self.index.find(label_id)
         if existing_node is None:
             self.add_node(node)
         else:
@@ -243,12 +430,12 @@ class RegulationTree(object):
 
     def move(self, origin, destination):
         """ Move a node from one part in the tree to another. """
-        origin = find(self.tree, origin)
+        origin = self.index.find(origin)
         if origin is not None:
             self.delete_from_parent(origin)
 
-            origin = overwrite_marker(origin, destination[-1])
-            origin.label = destination
+            origin = overwrite_marker(self._own(origin), destination[-1])
+            self.index.relabel(origin, destination)
             self.add_node(origin)
 
     def get_section_parent(self, node):
@@ -279,22 +466,21 @@ class RegulationTree(object):
         if prev_idx:
             # replace existing element in place
             prev_idx = prev_idx[0]
-            parent.children = (parent.children[:prev_idx] + [node] +
+            self._set_children(parent, parent.children[:prev_idx] + [node] +
                                parent.children[prev_idx + 1:])
         else:
             # actually adding a new element
-            parent.children = self.add_child(parent.children, node,
-                                             getattr(parent, 'child_labels',
-                                                     []))
+            self._set_children(parent, self.add_child(
+                parent.children, node, getattr(parent, 'child_labels', [])))
 
         # Finally, we see if this node is the parent of any 'kept' children.
         # If so, add them back
         label_id = node.label_id()
         if label_id in self._kept__by_parent:
             for kept in self._kept__by_parent[label_id]:
-                node.children = self.add_child(node.children, kept,
-                                               getattr(node, 'child_labels',
-                                                       []))
+                node = self._set_children(node, self.add_child(
+                    node.children, self._current(kept),
+                    getattr(node, 'child_labels', [])))
 
     def create_empty_node(self, node_label):
         """ In rare cases, we need to flush out the tree by adding
@@ -310,8 +496,8 @@ class RegulationTree(object):
         parent = self.get_parent(node)
         if not parent:
             parent = self.create_empty_node(get_parent_label(node))
-        parent.children = self.add_child(parent.children, node,
-                                         getattr(parent, 'child_labels', []))
+        self._set_children(parent, self.add_child(
+            parent.children, node, getattr(parent, 'child_labels', [])))
         return node
 
     def contains(self, label):
@@ -322,16 +508,17 @@ class RegulationTree(object):
     def find_node(self, label):
         if isinstance(label, list):
             label = '-'.join(label)
-        return find(self.tree, label)
+        return self.index.find(label)
 
     def add_node(self, node):
         """ Add an entirely new node to the regulation tree. """
-        existing = find(self.tree, node.label_id())
+        existing = self.index.find(node.label_id())
 
         if existing and is_reserved_node(existing):
             logging.warning('Replacing reserved node: %s' % node.label_id())
             return self.replace_node_and_subtree(node)
         elif existing and is_interp_placeholder(existing):
+            existing = self._own(existing)
             existing.title = node.title
             existing.text = node.text
             if hasattr(node, 'tagged_text'):
@@ -366,39 +553,40 @@ class RegulationTree(object):
                 if (parent.children
                         and parent.children[0].node_type == Node.EMPTYPART):
                     parent = parent.children[0]
-                parent.children = self.add_child(
+                self._set_children(parent, self.add_child(
                     parent.children, node, getattr(parent, 'child_labels',
-                                                   []))
+                                                   [])))
 
     def add_section(self, node, subpart_label):
         """ Add a new section to a subpart. """
 
-        existing = find(self.tree, node.label_id())
+        existing = self.index.find(node.label_id())
         if existing and is_reserved_node(existing):
             logging.warning(
                 'Replacing reserved node: {0}'.format(node.label_id()))
             self.replace_node_and_subtree(node)
         else:
-            subpart = find(self.tree, '-'.join(subpart_label))
-            subpart.children = self.add_child(subpart.children, node)
+            subpart = self.index.find('-'.join(subpart_label))
+            self._set_children(
+                subpart, self.add_child(subpart.children, node))
 
     def replace_node_text(self, label, change):
         """ Replace just a node's text. """
 
-        node = find(self.tree, label)
+        node = self._own(self.index.find(label))
         node.text = change['node'].text
 
     def replace_node_title(self, label, change):
         """ Replace just a node's title. """
 
-        node = find(self.tree, label)
+        node = self._own(self.index.find(label))
         if change['node'] is not None and node is not None:
             node.title = change['node'].title
 
     def replace_node_heading(self, label, change):
         """ A node's heading is it's keyterm. We handle this here, but not
         well, I think. """
-        node = find(self.tree, label)
+        node = self._own(self.index.find(label))
         node.text = replace_first_sentence(node.text, change['node'].text)
 
         if (hasattr(node, 'tagged_text')
@@ -428,6 +616,12 @@ class RegulationTree(object):
         determined by simply looking at a node's label. """
 
         subparts = self.get_subparts()
+        if self.index.is_unique(label_id):
+            #   The subpart is the node's ancestor just below the root
+            path = self.index.path(self.index.find(label_id))
+            if len(path) > 1 and any(path[1] is s for s in subparts):
+                return path[1]
+            return None
         subparts_with_label = [s for s in subparts
                                if find(s, label_id) is not None]
 
@@ -438,7 +632,7 @@ class RegulationTree(object):
         """ Move an existing node to another subpart. If the new subpart
         doesn't exist, create it. """
 
-        destination = find(self.tree, '-'.join(subpart_label))
+        destination = self.index.find('-'.join(subpart_label))
 
         if destination is None:
             destination = self.create_new_subpart(subpart_label)
@@ -446,11 +640,16 @@ class RegulationTree(object):
         subpart_with_node = self.get_subpart_for_node(label)
 
         if destination and subpart_with_node:
-            node = find(subpart_with_node, label)
+            #   These may be the same subpart
+            destination = self._own(destination)
+            subpart_with_node = self._own(subpart_with_node)
+            node = self.index.find(label, within=subpart_with_node)
             other_children = [c for c in subpart_with_node.children
                               if c.label_id() != label]
-            subpart_with_node.children = other_children
-            destination.children = self.add_child(destination.children, node)
+            subpart_with_node = self._set_children(subpart_with_node,
+                                                   other_children)
+            self._set_children(
+                destination, self.add_child(destination.children, node))
 
             if not subpart_with_node.children:
                 self.delete('-'.join(subpart_with_node.label))
@@ -551,7 +750,8 @@ def _needs_delay(reg, change):
 
 def compile_regulation(previous_tree, notice_changes):
     """ Given a last full regulation tree, and the set of changes from the
-    next final notice, construct the next full regulation tree. """
+    next final notice, construct the next full regulation tree. The previous
+    tree is left unchanged, though the two share any unchanged nodes. """
     label = previous_tree.label[0]
 
     if (label in notice_changes and len(notice_changes) == 1
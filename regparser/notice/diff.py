@@ -5,12 +5,15 @@ from copy import copy
 
 from lxml import etree
 
-from regparser.grammar import amdpar, tokens
+from regparser.grammar import lazy, tokens
 from regparser.tree.struct import Node
 from regparser.tree.xml_parser.reg_text import build_from_section
 from regparser.tree.xml_parser.tree_utils import get_node_text
 
 
+amdpar = lazy('amdpar')
+
+
 def clear_between(xml_node, start_char, end_char):
     """Gets rid of any content (including xml nodes) between chars"""
     as_str = etree.tostring(xml_node, encoding=unicode)
@@ -3,12 +3,15 @@ import logging
 
 from regparser import utils
 from regparser.citations import internal_citations, Label
-from regparser.grammar import unified
-import regparser.grammar.interpretation_headers as grammar
+from regparser.grammar import lazy
 from regparser.tree.paragraph import ParagraphParser
 from regparser.tree.struct import Node, treeify
 
 
+grammar = lazy('interpretation_headers')
+unified = lazy('unified')
+
+
 #   Can only be preceded by white space or a start of line
 interpParser = ParagraphParser(r"(?<![^\s])%s\.", Node.INTERP)
 
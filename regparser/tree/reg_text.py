@@ -3,7 +3,7 @@ import re
 
 from regparser import utils
 from regparser.citations import internal_citations, Label
-from regparser.grammar.unified import marker_subpart_title
+from regparser.grammar import lazy
 from regparser.search import find_offsets, find_start, segments
 from regparser.tree import struct
 from regparser.tree.appendix.carving import find_appendix_start
@@ -11,6 +11,9 @@ from regparser.tree.paragraph import ParagraphParser
 from regparser.tree.supplement import find_supplement_start
 
 
+unified = lazy('unified')
+
+
 def build_subparts_tree(text, part, subpart_builder):
     """ Build a tree of a subpart, and it's children sections.
     subpart_builder can be a builder that builds a subpart or an
@@ -75,7 +78,7 @@ def build_empty_part(part):
 
 
 def build_subpart(text, part):
-    results = marker_subpart_title.parseString(text)
+    results = unified.marker_subpart_title.parseString(text)
     subpart_letter = results.subpart
     subpart_title = results.subpart_title
     label = [str(part), 'Subpart', subpart_letter]
@@ -1,8 +1,16 @@
-from collections import defaultdict
 from json import JSONEncoder
 
 import logging
 import hashlib
+import weakref
+
+from lxml import etree
+
+import settings
+
+
+#   Where an unpickled Node keeps its (not yet parsed) source_xml
+LAZY_XML_FIELD = '_source_xml_str'
 
 
 class Node(object):
@@ -44,6 +52,24 @@ class Node(object):
     def __cmp__(self, other):
         return cmp(repr(self), repr(other))
 
+    def __getstate__(self):
+        """XML elements can't be pickled, so we pickle source_xml as a
+        string. It's only parsed again if it's accessed (see __getattr__)"""
+        state = dict(self.__dict__)
+        if etree.iselement(state.get('source_xml')):
+            state[LAZY_XML_FIELD] = etree.tostring(state.pop('source_xml'),
+                                                   with_tail=False)
+        return state
+
+    def __getattr__(self, name):
+        """Only called if the attribute isn't present, i.e. when source_xml
+        has not yet been parsed after unpickling"""
+        if name == 'source_xml' and LAZY_XML_FIELD in self.__dict__:
+            self.source_xml = etree.fromstring(
+                self.__dict__.pop(LAZY_XML_FIELD))
+            return self.source_xml
+        raise AttributeError(name)
+
     def label_id(self):
         return '-'.join(self.label)
 
@@ -57,7 +83,8 @@ class NodeEncoder(JSONEncoder):
                 del fields['title']
             if obj.marker is None:
                 del fields['marker']
-            for field in ('tagged_text', 'source_xml', 'child_labels'):
+            for field in ('tagged_text', 'source_xml', 'child_labels',
+                          LAZY_XML_FIELD):
                 if field in fields:
                     del fields[field]
             return fields
@@ -157,9 +184,76 @@ def treeify(nodes):
     return roots
 
 
+def content_hash(node, include_xml=False):
+    """A digest of a node's own content (text, tagged_text, title, label and
+    node type), i.e. not including its children. Works for both Nodes and
+    FrozenNodes. Optionally includes the node's source_xml"""
+    hasher = hashlib.sha256()
+    for field in (node.text, node.tagged_text or '', node.title or '',
+                  '-'.join(node.label), node.node_type):
+        hasher.update(field.encode('utf-8'))
+        hasher.update('\x00')
+    if include_xml:
+        #   Avoid parsing the XML if it hasn't been already (see Node)
+        xml = getattr(node, '__dict__', {}).get(LAZY_XML_FIELD)
+        if xml is None and getattr(node, 'source_xml', None) is not None:
+            xml = etree.tostring(node.source_xml, with_tail=False)
+        hasher.update(xml or '')
+    return hasher.hexdigest()
+
+
+class FrozenNodePool(object):
+    """Interns FrozenNodes, so that only one of each identical node is kept
+    in memory. Nodes are held weakly: once nothing else refers to a node, it
+    leaves the pool. FrozenNode.from_node uses the innermost pool entered as
+    a context manager, e.g. one per regulation being built, or the default
+    pool if there is none."""
+    _active = []
+
+    def __init__(self):
+        self._nodes = weakref.WeakValueDictionary()     # hash -> FrozenNode
+        self.hits, self.misses = 0, 0
+
+    def intern(self, node):
+        """The pooled node equal to this one, adding it if there is none"""
+        existing = self._nodes.get(node.hash)
+        if existing is not None and existing == node:
+            self.hits += 1
+            return existing
+        self.misses += 1
+        if existing is None:
+            self._nodes[node.hash] = node
+        return node
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def stats(self):
+        """Number of live nodes in the pool, how many characters of text
+        they hold and how many lookups found (hits) or added (misses) a
+        node"""
+        nodes = self._nodes.values()
+        return {'nodes': len(nodes), 'hits': self.hits, 'misses': self.misses,
+                'chars': sum(len(node.text) + len(node.tagged_text) +
+                             len(node.title) for node in nodes)}
+
+    def __enter__(self):
+        FrozenNodePool._active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        FrozenNodePool._active.remove(self)
+
+    @classmethod
+    def current(cls):
+        return cls._active[-1] if cls._active else cls.default
+
+
+FrozenNodePool.default = FrozenNodePool()
+
+
 class FrozenNode(object):
     """Immutable interface for nodes. No guarantees about internal state."""
-    _pool = defaultdict(set)    # collection of all FrozenNodes, keyed by hash
 
     def __init__(self, text='', children=(), label=(), title='',
                  node_type=Node.REGTEXT, tagged_text=''):
@@ -170,7 +264,6 @@ class FrozenNode(object):
         self._node_type = node_type
         self._tagged_text = tagged_text or ''
         self._hash = self._generate_hash()
-        FrozenNode._pool[self.hash].add(self)
 
     @property
     def text(self):
@@ -201,7 +294,12 @@ class FrozenNode(object):
         return self._hash
 
     def _generate_hash(self):
-        """Called during instantiation. Digests all fields"""
+        """Called during instantiation. Digests all fields, using SHA-256 or,
+        if so configured (see FROZEN_NODE_HASH), Python's built-in hash"""
+        if settings.FROZEN_NODE_HASH == 'fast':
+            fields = (self.text, self.tagged_text, self.title, self.label_id,
+                      self.node_type) + tuple(c.hash for c in self.children)
+            return '%016x' % (hash(fields) & 0xffffffffffffffff)
         hasher = hashlib.sha256()
         hasher.update(self.text.encode('utf-8'))
         hasher.update(self.tagged_text.encode('utf-8'))
@@ -232,18 +330,25 @@ class FrozenNode(object):
                     [c.hash for c in other.children])
 
     @staticmethod
-    def from_node(node):
+    def from_node(node, pool=None):
         """Convert a struct.Node (or similar) into a struct.FrozenNode. This
-        also checks if this node has already been instantiated. If so, it
-        returns the instantiated version (i.e. only one of each identical node
-        exists in memory)"""
-        children = map(FrozenNode.from_node, node.children)
-        fresh = FrozenNode(text=node.text, children=children, label=node.label,
-                           title=node.title or '', node_type=node.node_type,
+        also checks if this node has already been instantiated (in the
+        provided or current FrozenNodePool). If so, it returns the
+        instantiated version (i.e. only one of each identical node exists in
+        memory)"""
+        if pool is None:
+            pool = FrozenNodePool.current()
+        children = [FrozenNode.from_node(child, pool)
+                    for child in node.children]
+        return FrozenNode._intern(node, children, pool)
+
+    @staticmethod
+    def _intern(node, frozen_children, pool):
+        fresh = FrozenNode(text=node.text, children=frozen_children,
+                           label=node.label, title=node.title or '',
+                           node_type=node.node_type,
                            tagged_text=getattr(node, 'tagged_text', '') or '')
-        for el in FrozenNode._pool[fresh.hash]:
-            if el == fresh:
-                return el   # note we are _not_ returning fresh
+        return pool.intern(fresh)   # note we may _not_ be returning fresh
 
     @property
     def label_id(self):
@@ -251,3 +356,42 @@ class FrozenNode(object):
         if not hasattr(self, '_label_id'):
             self._label_id = '-'.join(self.label)
         return self._label_id
+
+
+class Freezer(object):
+    """Converts successive versions of a regulation into FrozenNodes. Most
+    subtrees don't change between versions, so rather than rebuilding (and
+    rehashing) them, we reuse the previous call's FrozenNodes wherever a
+    node's fields and (frozen) children are the same. Only nodes on the path
+    to a change are frozen anew."""
+    def __init__(self, pool=None):
+        self.pool = pool
+        self._previous = {}
+        self.reused, self.created = 0, 0
+
+    def freeze(self, root):
+        """Equivalent to FrozenNode.from_node(root)"""
+        pool = self.pool
+        if pool is None:
+            pool = FrozenNodePool.current()
+        current = {}
+        frozen = self._freeze(root, pool, current)
+        self._previous = current    # only remember the latest version
+        return frozen
+
+    def _freeze(self, node, pool, current):
+        children = [self._freeze(child, pool, current)
+                    for child in node.children]
+        #   Frozen children are kept alive by `current`, so their ids are
+        #   unique for as long as this key is in use
+        key = (node.text, node.title or '',
+               getattr(node, 'tagged_text', '') or '', node.node_type,
+               tuple(node.label), tuple(id(child) for child in children))
+        frozen = self._previous.get(key) or current.get(key)
+        if frozen is None:
+            frozen = FrozenNode._intern(node, children, pool)
+            self.created += 1
+        else:
+            self.reused += 1
+        current[key] = frozen
+        return frozen
@@ -7,8 +7,7 @@ from lxml import etree
 from pyparsing import LineStart, Optional, Suppress
 
 from regparser.citations import internal_citations
-from regparser.grammar import appendix as grammar
-from regparser.grammar.interpretation_headers import parser as headers
+from regparser.grammar import lazy
 from regparser.grammar.utils import Marker
 from regparser.layer.formatting import table_xml_to_plaintext
 from regparser.layer.key_terms import KeyTerms
@@ -23,6 +22,10 @@ from regparser.tree.xml_parser.interpretations import get_app_title
 from settings import APPENDIX_IGNORE_SUBHEADER_LABEL
 
 
+grammar = lazy('appendix')
+headers = lazy('interpretation_headers')
+
+
 def remove_toc(appendix, letter):
     """The TOC at the top of certain appendices gives us trouble since it
     looks a *lot* like a sequence of headers. Remove it if present"""
@@ -69,7 +72,7 @@ class AppendixProcessor(object):
             if self.appendix_letter:
                 logging.warning("Found two appendix headers: %s and %s",
                                 self.appendix_letter, text)
-            parsed_header = headers.parseString(text)
+            parsed_header = headers.parser.parseString(text)
             self.appendix_letter = parsed_header.appendix
 
         return self.appendix_letter
@@ -1,6 +1,25 @@
+import importlib
 from random import choice
 
 
+class LazyModule(object):
+    """Stands in for a module which is only imported when one of its
+    attributes is first accessed. Heavy modules (those which build grammars
+    or pull in lxml, GitPython, etc.) can be referenced this way so that
+    importing the code which uses them stays cheap"""
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return 'LazyModule(%r)' % self._module_name
+
+
 def roman_nums():
     """Generator for roman numerals."""
     mapping = [
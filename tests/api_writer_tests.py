@@ -12,11 +12,12 @@ try:
 except ImportError:
     import __builtin__ as builtins
 
+from git import Repo
 from mock import patch, mock_open
 import lxml.etree as etree
 
 from regparser.api_writer import (
-    APIWriteContent, Client, FSWriteContent, GitWriteContent, Repo,
+    APIWriteContent, Client, FSWriteContent, GitWriteContent,
     XMLWriteContent)
 from regparser.tree.struct import Node
 from regparser.notice.diff import Amendment, DesignateAmendment
@@ -1,12 +1,22 @@
 import os.path
+import pickle
+import shutil
 import tempfile
+import time
 from unittest import TestCase
 
 from lxml import etree
 from mock import Mock, patch
 
+from regparser import builder
 from regparser.builder import (
-    Builder, Checkpointer, LayerCacheAggregator, NullCheckpointer)
+    Builder, Checkpointer, EmptyCache, LayerCacheAggregator, NoticeRegistry,
+    NullCheckpointer, SQLiteCheckpointer, checkpointer_for,
+    notices_for_cfr_part)
+from regparser.layer.internal_citations import InternalCitationParser
+from regparser.layer.paragraph_markers import ParagraphMarkers
+from regparser.layer_store import LayerStore
+from regparser.tree import struct
 from regparser.tree.struct import Node
 
 
@@ -44,6 +54,35 @@ class BuilderTests(TestCase):
         self.assertTrue(bbbb in notice_lists[1])
         self.assertTrue(cccc in notice_lists[1])
 
+    @patch('regparser.notice.compiler.compile_regulation')
+    @patch.object(Builder, 'changes_in_sequence')
+    @patch.object(Builder, '__init__')
+    def test_checkpoint_dependencies(self, init, changes_in_sequence,
+                                     compile_regulation):
+        """Checkpoints are invalidated when any module the step depends
+        on changes, not just the module which performs it"""
+        init.return_value = None
+        tmpdir = tempfile.mkdtemp()
+        b = Builder()   # Don't need parameters as init's been mocked out
+        b.notices, b.checkpointer = [], Checkpointer(tmpdir)
+        changes_in_sequence.return_value = [('bbbb', {})]
+        compile_regulation.return_value = Node('compiled', label=['1111'])
+        tree = Node(label=['1111'])
+
+        def compile_all():
+            with patch.dict(builder._dependencies_digests, clear=True):
+                return [new_tree for _, _, new_tree, _
+                        in b.revision_generator(tree)]
+
+        compile_all()
+        self.assertEqual('compiled', compile_all()[0].text)
+        self.assertEqual(1, compile_regulation.call_count)
+        with patch.dict(builder._code_digests,
+                        {'regparser.citations': 'changed'}):
+            compile_all()
+        self.assertEqual(2, compile_regulation.call_count)
+        shutil.rmtree(tmpdir)
+
     @patch.object(Builder, '__init__')
     def test_layer_cache(self, init):
         """Integration test for layer caching"""
@@ -53,6 +92,7 @@ class BuilderTests(TestCase):
         b.cfr_title, b.cfr_part, b.doc_number = 15, '111', '111-222'
         b.writer = Mock()
         b.checkpointer = NullCheckpointer()
+        b.workers = 1
         write = b.writer.layer.return_value.write
         tree = Node(label=["1234"], children=[
             Node(label=["1234", "1"], children=[
@@ -67,34 +107,63 @@ class BuilderTests(TestCase):
         tree.children[0].children[1].text = "References paragraph (a)"
         b.gen_and_write_layers(tree, [], cache, [])
         arg = write.call_args_list[9][0][0]
-        self.assertEqual(['1234-1-a'], arg.keys())
+        self.assertEqual(['1234-1-a', '1234-1-b'], sorted(arg.keys()))
+        cache.replace_using(tree)
 
         write.reset_mock()
         tree.children[0].children[0].text = "Contains no references"
         b.gen_and_write_layers(tree, [], cache, [])
         arg = write.call_args_list[9][0][0]
-        self.assertEqual(['1234-1-a'], arg.keys())
+        self.assertEqual(['1234-1-b'], arg.keys())
 
+        #   Moving a node (e.g. into a subpart) doesn't change its content.
+        #   It does change the labels citations may refer to, though
         write.reset_mock()
-        notice = {'document_number': '111-222'}
-        cache.invalidate_by_notice(notice)
-        b.gen_and_write_layers(tree, [], cache, [])
-        arg = write.call_args_list[9][0][0]
-        self.assertEqual(['1234-1-a'], arg.keys())
+        tree = Node(label=["1234"], children=[
+            Node(label=["1234", "Subpart", "A"], children=tree.children)])
+        with patch('regparser.builder.LAYERS', [
+                ('paragraph-markers', 'paragraph_markers.ParagraphMarkers'),
+                ('internal-citations',
+                 'internal_citations.InternalCitationParser')]):
+            with patch.object(ParagraphMarkers, 'process') as markers, \
+                    patch.object(InternalCitationParser, 'process') as cites:
+                b.gen_and_write_layers(tree, [], cache, [])
+        self.assertEqual(['1234-Subpart-A'],
+                         [call[0][0].label_id()
+                          for call in markers.call_args_list])
+        self.assertEqual(5, cites.call_count)
 
-        write.reset_mock()
-        notice['changes'] = {'1234-1-b': 'some change'}
-        cache.invalidate_by_notice(notice)
-        b.gen_and_write_layers(tree, [], cache, [])
-        arg = write.call_args_list[9][0][0]
-        self.assertEqual(['1234-1-a', '1234-1-b'], list(sorted(arg.keys())))
+    @patch.object(Builder, '__init__')
+    def test_generate_layers_workers(self, init):
+        """Building layers in worker processes should give the same results
+        as building them serially. Layer caches should also be retained"""
+        init.return_value = None
+        b = Builder()   # Don't need parameters as init's been mocked out
+        b.cfr_title, b.cfr_part, b.doc_number = 15, '1234', '111-222'
+        b.checkpointer = NullCheckpointer()
+        tree = Node(label=["1234"], children=[
+            Node(label=["1234", "1"], children=[
+                Node("See paragraph (b)", label=["1234", "1", "a"],
+                     source_xml=etree.fromstring("<P>See (b)</P>")),
+                Node("This is b", label=["1234", "1", "b"])])])
+        notices = [{'document_number': '111-222', 'changes': {'a': 'b'},
+                    'effective_on': '2012-12-12'}]
 
-        write.reset_mock()
-        notice['changes'] = {'1234-Subpart-A': 'some change'}
-        cache.invalidate_by_notice(notice)
-        b.gen_and_write_layers(tree, [], cache, [])
-        arg = write.call_args_list[9][0][0]
-        self.assertEqual(['1234-1-b'], list(sorted(arg.keys())))
+        b.workers = 1
+        with patch('regparser.builder.input_digest',
+                   wraps=builder.input_digest) as digest:
+            serial = b.generate_layers(tree, [], LayerCacheAggregator(),
+                                       notices)
+        #   Notices are digested once for all of the layers
+        self.assertEqual(1, [call[0] for call in digest.call_args_list]
+                         .count((notices,)))
+
+        b.workers = 3
+        cache = LayerCacheAggregator()
+        parallel = b.generate_layers(tree, [], cache, notices)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(
+            4, len(cache.cache_for('internal-citations')._cache))
 
     def test_determine_doc_number_fr(self):
         """Verify that a document number can be pulled out of an FR notice"""
@@ -106,13 +175,16 @@ class BuilderTests(TestCase):
         self.assertEqual(
             '2011-31715', Builder.determine_doc_number(xml_str, '00', '00'))
 
-    @patch('regparser.builder.fetch_notice_json')
+    @patch('regparser.federalregister.fetch_notice_json')
     def test_determine_doc_number_annual(self, fetch_notice_json):
         """Verify that a document number can be pulled out of an annual
         edition of the reg"""
         fetch_notice_json.return_value = [
-            {'el': 1, 'document_number': '111-111'},
-            {'el': 2, 'document_number': '222-222'}]
+            {'el': 0, 'document_number': '000-000', 'effective_on': None},
+            {'el': 1, 'document_number': '111-111',
+             'effective_on': '2012-01-01'},
+            {'el': 2, 'document_number': '222-222',
+             'effective_on': '2011-01-01'}]
         xml_str = """<?xml version="1.0"?>
         <?xml-stylesheet type="text/xsl" href="cfr.xsl"?>
         <CFRGRANULE xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
@@ -127,21 +199,160 @@ class BuilderTests(TestCase):
             '111-111', Builder.determine_doc_number(xml_str, '12', '34'))
         args = fetch_notice_json.call_args
         self.assertEqual(('12', '34'), args[0])     # positional args
-        self.assertEqual({'max_effective_date': '2012-01-01',
-                          'only_final': True}, args[1])   # kw args
+        self.assertEqual({'only_final': True}, args[1])   # kw args
+
+        fetch_notice_json.return_value[1]['effective_on'] = '2012-01-02'
+        self.assertEqual(
+            '222-222', Builder.determine_doc_number(xml_str, '12', '34'))
+
+    @patch('regparser.notice.build.build_notices')
+    @patch('regparser.federalregister.fetch_notice_json')
+    def test_build_notices_once(self, fetch_notice_json, build_notices):
+        """Each notice should be fetched and built only once, no matter
+        how many times it's requested"""
+        fetch_notice_json.return_value = [
+            {'document_number': '111-111', 'full_text_xml_url': 'url1'},
+            {'document_number': '222-222', 'full_text_xml_url': 'url2'}]
+        built = []
+
+        def mock_build(title, part, notice_jsons, workers):
+            built.extend(n['document_number'] for n in notice_jsons)
+            return [[{'document_number': n['document_number'],
+                      'effective_on': '2012-01-01',
+                      'publication_date': '2011-01-01',
+                      'meta': {'type': 'Rule', 'dates': ''}}]
+                    for n in notice_jsons]
+        build_notices.side_effect = mock_build
+
+        registry = NoticeRegistry()
+        b = Builder(12, '1234', '111-111', notice_registry=registry)
+        b.fetch_notices_json()
+        b.build_notices()
+        self.assertEqual(['111-111', '222-222'],
+                         sorted(n['document_number'] for n in b.notices))
+        self.assertEqual(['2012-01-01'], b.eff_notices.keys())
+        b.build_notice_from_doc_number('222-222')
+        notices_for_cfr_part(12, '1234', registry)
+        self.assertEqual(1, fetch_notice_json.call_count)
+        self.assertEqual(['111-111', '222-222'], built)
+
+        #   Writing notices doesn't modify those held by the registry
+        b.writer = Mock()
+        b.write_notices()
+        written = b.writer.notice.return_value.write.call_args[0][0]
+        self.assertFalse('meta' in written)
+        for notice in b.build_notice_from_doc_number('222-222'):
+            self.assertTrue('meta' in notice)
+        for notices in notices_for_cfr_part(12, '1234', registry).values():
+            self.assertTrue(all('meta' in notice for notice in notices))
 
 
 class LayerCacheAggregatorTests(TestCase):
-    def test_invalidate(self):
+    def test_replace_using(self):
+        """Only content present in the provided tree is retained"""
         cache = LayerCacheAggregator()
-        cache._known_labels = set(['123', '123-1', '123-1-a',
-                                   '123-1-a-Interp'])
-        cache.invalidate(['123-2'])
-        self.assertEqual(cache._known_labels,
-                         set(['123', '123-1', '123-1-a', '123-1-a-Interp']))
+        layer = Mock()
+        layer.process.side_effect = lambda node: node.text
+        citations = cache.cache_for('internal-citations')
+        nodes = [Node("a", label=['1']), Node("b", label=['2']),
+                 Node("c", label=['3'])]
+        for node in nodes:
+            citations.fetch_or_process(layer, node)
+        self.assertEqual(3, layer.process.call_count)
+        self.assertEqual(
+            "b", citations.fetch_or_process(layer, Node("b", label=['2'])))
+        self.assertEqual(3, layer.process.call_count)
+        self.assertEqual(
+            "b", citations.fetch_or_process(layer, Node("b", label=['4'])))
+        self.assertEqual(4, layer.process.call_count)
+
+        cache.replace_using(Node(label=['1'], children=nodes[1:]))
+        self.assertEqual(set(struct.content_hash(n) for n in nodes[1:]),
+                         set(citations._cache.keys()))
+
+    def test_cache_for_worker(self):
+        """Workers receive only the elements for the nodes they'll see and
+        return only those they add"""
+        cache = LayerCacheAggregator()
+        layer = Mock()
+        layer.cache_context.return_value = (12, None)
+        layer.process.side_effect = lambda node: node.text
+        citations = cache.cache_for('internal-citations')
+        a, b, c, d = [Node(text, label=['1234', text]) for text in 'abcd']
+        for node in (a, b, c):
+            citations.fetch_or_process(layer, node)
+
+        worker = pickle.loads(pickle.dumps(
+            cache.cache_for_worker('internal-citations', [b, d])))
+        self.assertEqual([citations.key(b)], worker._cache.keys())
+        self.assertEqual('b', worker.fetch_or_process(layer, b))
+        self.assertEqual('d', worker.fetch_or_process(layer, d))
+        worker.drop_known()
+        self.assertEqual({citations.key(d): 'd'}, worker._cache)
+
+        cache.adopt('internal-citations', pickle.loads(pickle.dumps(worker)))
+        self.assertEqual(set(citations.key(n) for n in (a, b, c, d)),
+                         set(citations._cache))
+        self.assertEqual((1, 0, 4), cache.stats()['internal-citations'])
+        self.assertTrue(isinstance(cache.cache_for_worker('toc', [a]),
+                                   EmptyCache))
+
+    def test_context(self):
+        """Elements in memory are not reused if the layer's context (e.g.
+        the labels a citation may refer to) differs"""
+        cache = LayerCacheAggregator()
+        citations = cache.cache_for('internal-citations')
+        old_labels, new_labels = Mock(), Mock()
+        old_labels.cache_context.return_value = (12, ['1234-1'])
+        new_labels.cache_context.return_value = (12, ['1234-1', '1234-2'])
+        for layer in (old_labels, old_labels, new_labels, new_labels):
+            layer.process.return_value = layer.cache_context()
+            self.assertEqual(layer.cache_context(), citations.fetch_or_process(
+                layer, Node("See 1234.2", label=['1234', '1'])))
+        self.assertEqual(1, old_labels.process.call_count)
+        self.assertEqual(1, new_labels.process.call_count)
+        self.assertEqual((2, 0, 2), cache.stats()['internal-citations'])
+
+    def test_store(self):
+        """Elements should be persisted across runs, but not reused if the
+        layer's context differs"""
+        tmpdir = tempfile.mkdtemp()
+        store = LayerStore(os.path.join(tmpdir, 'layers.sqlite'))
+        tree = Node(label=["1234", "1"], children=[
+            Node("See paragraph (b)", label=["1234", "1", "a"]),
+            Node("This is b", label=["1234", "1", "b"])])
 
-        cache.invalidate(['123-2', '123-1-Interp'])
-        self.assertEqual(cache._known_labels, set(['123']))
+        def build(cfr_title):
+            cache = LayerCacheAggregator(store)
+            layer = InternalCitationParser(tree, cfr_title)
+            result = layer.build(cache.cache_for('internal-citations'))
+            cache.cache_for('internal-citations').flush()
+            return result, cache.stats()['internal-citations']
+
+        first, stats = build(12)
+        self.assertEqual(['1234-1-a'], first.keys())
+        self.assertEqual((0, 0, 3), stats)
+
+        with patch.object(InternalCitationParser, 'process') as process:
+            second, stats = build(12)
+            self.assertFalse(process.called)
+        self.assertEqual(first, second)
+        self.assertEqual((0, 3, 0), stats)
+
+        _, stats = build(13)
+        self.assertEqual((0, 0, 3), stats)
+        shutil.rmtree(tmpdir)
+
+    def test_formatting_xml(self):
+        """The formatting layer also depends on a node's XML"""
+        cache = LayerCacheAggregator()
+        layer = Mock()
+        layer.process.side_effect = lambda node: node.text
+        formatting = cache.cache_for('formatting')
+        for xml in ("<P>1</P>", "<P>2</P>", "<P>1</P>"):
+            formatting.fetch_or_process(layer, Node(
+                "text", label=['1'], source_xml=etree.fromstring(xml)))
+        self.assertEqual(2, layer.process.call_count)
 
 
 class CheckpointerTests(TestCase):
@@ -150,21 +361,20 @@ class CheckpointerTests(TestCase):
         is occurring outside of local memory by comparing to the original."""
         to_store = {"some": "value", 123: 456}
         cp = Checkpointer(tempfile.mkdtemp())
-        cp.counter = 1
-        cp._serialize("a-tag", to_store)
+        first = cp._filename("a-tag", 1)
+        cp._serialize(first, to_store)
         to_store["some"] = "other"
-        result = cp._deserialize("a-tag")
+        result = cp._deserialize(first)
         self.assertEqual(result, {"some": "value", 123: 456})
         self.assertEqual(to_store, {"some": "other", 123: 456})
 
-        cp.counter = 2
-        cp._serialize("a-tag", to_store)
+        second = cp._filename("a-tag", 2)
+        cp._serialize(second, to_store)
         to_store["some"] = "more"
-        result = cp._deserialize("a-tag")
+        result = cp._deserialize(second)
         self.assertEqual(result, {"some": "other", 123: 456})
         self.assertEqual(to_store, {"some": "more", 123: 456})
-        cp.counter = 1
-        result = cp._deserialize("a-tag")
+        result = cp._deserialize(first)
         self.assertEqual(result, {"some": "value", 123: 456})
 
     def test_tree_serialization(self):
@@ -177,7 +387,6 @@ class CheckpointerTests(TestCase):
 
         cp = Checkpointer(tempfile.mkdtemp())
         cp.checkpoint("a-tag", lambda: tree)    # saving
-        cp._reset()
         loaded = cp.checkpoint("a-tag", None)   # would explode if not loaded
 
         self.assertEqual(repr(tree), repr(loaded))
@@ -185,44 +394,183 @@ class CheckpointerTests(TestCase):
             etree.tostring(tree.children[0].source_xml),
             etree.tostring(loaded.children[0].source_xml))
 
-    def test_dont_load_later_elements(self):
-        """If a checkpoint is executed, we should not load any later
-        checkpoints. This allows a user to delete, say step 5, and effectively
-        rebuild from that checkpoint."""
+    def test_compression(self):
+        """Checkpoints can be compressed; they're readable regardless of the
+        current setting"""
+        tree = Node("top", label=["111"], children=[
+            Node("inner " * 100, label=["111", "1"],
+                 source_xml=etree.fromstring("<tag>Hi</tag>"))])
+        cp = Checkpointer(tempfile.mkdtemp())
+        sizes = {}
+        for compression in (None, 'zlib', 'bz2'):
+            cp.compression = compression
+            cp.checkpoint(str(compression), lambda: tree)
+            sizes[compression] = os.path.getsize(
+                cp._filename(str(compression)))
+
+        self.assertTrue(sizes['zlib'] < sizes[None])
+        self.assertTrue(sizes['bz2'] < sizes[None])
+        for compression in (None, 'zlib', 'bz2'):
+            loaded = cp.checkpoint(str(compression), None)
+            self.assertEqual(repr(tree), repr(loaded))
+            self.assertEqual(
+                "<tag>Hi</tag>",
+                etree.tostring(loaded.children[0].source_xml))
+
+    def test_inputs(self):
+        """Checkpoints are keyed by their inputs; changing one step's inputs
+        should not invalidate the others"""
+        cp = Checkpointer(tempfile.mkdtemp())
+        self.assertEqual(cp.checkpoint("1", lambda: 1, inputs=['a']), 1)
+        self.assertEqual(cp.checkpoint("2", lambda: 2, inputs=['b']), 2)
+        self.assertEqual(cp.checkpoint("3", lambda: 3, inputs=['c']), 3)
+
+        self.assertEqual(cp.checkpoint("1", lambda: -1, inputs=['a']), 1)
+        self.assertEqual(cp.checkpoint("2", lambda: -2, inputs=['B']), -2)
+        self.assertEqual(cp.checkpoint("3", lambda: -3, inputs=['c']), 3)
+        self.assertEqual(cp.checkpoint("2", lambda: -2, inputs=['b']), 2)
+        self.assertEqual(
+            cp.checkpoint("3", lambda: -3, inputs=['c'], force=True), -3)
+
+        tree = Node("text", label=['1111'])
+        cp.checkpoint("4", lambda: 4, inputs=[tree])
+        self.assertEqual(4, cp.checkpoint("4", lambda: -4,
+                                          inputs=[Node("text",
+                                                       label=['1111'])]))
+        tree.text = "changed"
+        self.assertEqual(-4, cp.checkpoint("4", lambda: -4, inputs=[tree]))
+
+    def test_checkpoint_many(self):
+        """Only missing steps should be computed"""
         cp = Checkpointer(tempfile.mkdtemp())
-        self.assertEqual(cp.checkpoint("1", lambda: 1), 1)
-        self.assertEqual(cp.checkpoint("2", lambda: 2), 2)
-        self.assertEqual(cp.checkpoint("3", lambda: 3), 3)
+        computed = []
+
+        def compute(tags):
+            computed.extend(tags)
+            return [int(tag) for tag in tags]
+        self.assertEqual(list(cp.checkpoint_many(["1", "2", "3"], compute)),
+                         [1, 2, 3])
+        self.assertEqual(computed, ["1", "2", "3"])
 
-        cp._reset()
-        self.assertEqual(cp.checkpoint("1", lambda: -1), 1)
-        self.assertEqual(cp.checkpoint("2", lambda: -2, force=True), -2)
-        self.assertEqual(cp.checkpoint("3", lambda: -3), -3)
+        del computed[:]
+        os.remove(cp._filename("2"))
+        self.assertEqual(list(cp.checkpoint_many(["1", "2", "3"], compute)),
+                         [1, 2, 3])
+        self.assertEqual(computed, ["2"])
+
+        del computed[:]
+        self.assertEqual(
+            list(cp.checkpoint_many(["1", "2", "3"], compute,
+                                    [(), ("changed",), ()])),
+            [1, 2, 3])
+        self.assertEqual(computed, ["2"])
 
     def test_exception_reading(self):
         """If a file exists but is not the correct format, we expect
         deserialization to gracefully fail (rather than exploding)"""
         cp = Checkpointer(tempfile.mkdtemp())
         self.assertEqual(1, cp.checkpoint("1", lambda: 1))
-        with open(cp._filename("1"), "w") as written_file:
-            written_file.write("")
-        cp._reset()
+        self.assertEqual(2, cp.checkpoint("2", lambda: 2))
+        for tag in ("1", "2"):
+            with open(cp._filename(tag), "w") as written_file:
+                written_file.write("")
         # pickle will raise an exception, so we will recompute
         self.assertEqual(-1, cp.checkpoint("1", lambda: -1))
+        self.assertEqual([-2], list(cp.checkpoint_many(
+            ["2"], lambda tags: [-int(tag) for tag in tags])))
 
     def test_filename(self):
         """Verify that an appropriate file name is generated in an appropriate
         folder"""
         file_path = tempfile.mkdtemp() + os.path.join('some', 'depth', 'here')
         cp = Checkpointer(file_path)
-        cp.counter = 25
-        filename = cp._filename('A WeIrD TaG')
+        filename = cp._filename('A WeIrD TaG', ['inputs'])
         self.assertTrue(os.path.join('some', 'depth', 'here') in filename)
-        self.assertTrue('25' in filename)
         self.assertTrue('aweirdtag' in filename)
+        self.assertNotEqual(filename, cp._filename('A WeIrD TaG', ['other']))
+        cp.suffix = ':1111'
+        self.assertNotEqual(filename, cp._filename('A WeIrD TaG', ['inputs']))
 
     def test_dirs_created(self):
         """If the full path does not exist, it is created"""
         file_path = tempfile.mkdtemp() + os.path.join('some', 'depth', 'here')
         Checkpointer(file_path)
         self.assertTrue(os.path.isdir(file_path))
+
+
+class SQLiteCheckpointerTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'checkpoints.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_checkpoint(self):
+        """Values should be stored in the database, along with metadata"""
+        cp = SQLiteCheckpointer(self.db_path)
+        cp.suffix = ":1111:12:2012-1234"
+        tree = Node("text", label=["1111"], children=[
+            Node("child", label=["1111", "1"],
+                 source_xml=etree.fromstring("<P>child</P>"))])
+        cp.checkpoint("a-tag", lambda: tree, inputs=[1])
+        self.assertEqual([1, 2], list(cp.checkpoint_many(
+            ["1", "2"], lambda tags: map(int, tags),
+            versions=["2012-1234", "2013-5678"])))
+
+        cp = SQLiteCheckpointer(self.db_path)   # e.g. a different process
+        cp.suffix = ":1111:12:2012-1234"
+        loaded = cp.checkpoint("a-tag", None, inputs=[1])
+        self.assertEqual(repr(tree), repr(loaded))
+        self.assertEqual("<P>child</P>",
+                         etree.tostring(loaded.children[0].source_xml))
+        self.assertEqual(-1, cp.checkpoint("a-tag", lambda: -1, inputs=[2],
+                                           version="2014-9999"))
+        self.assertEqual([1, 2], list(cp.checkpoint_many(["1", "2"], None)))
+
+        rows = cp.db.execute("SELECT tag, cfr_part, version, size "
+                             "FROM checkpoints ORDER BY tag, version"
+                             ).fetchall()
+        self.assertEqual(['1', '2', 'a-tag', 'a-tag'],
+                         [row[0] for row in rows])
+        self.assertEqual(set(['1111']), set(row[1] for row in rows))
+        #   Defaults to the initial version (from the suffix)
+        self.assertEqual(['2012-1234', '2013-5678', '2012-1234', '2014-9999'],
+                         [row[2] for row in rows])
+        self.assertTrue(all(row[3] > 0 for row in rows))
+
+    def test_gc(self):
+        """Old and least recently used checkpoints should be removed"""
+        cp = SQLiteCheckpointer(self.db_path)
+        for tag in "abcd":
+            cp.suffix = ":" + ("1111" if tag < "c" else "2222")
+            cp.checkpoint(tag, lambda: "x" * 1000)
+        now = time.time()
+        with cp.db:
+            for tag, age in zip("abcd", (50, 40, 30, 20)):
+                cp.db.execute("UPDATE checkpoints SET accessed = ? "
+                              "WHERE tag = ?", (now - age, tag))
+
+        def remaining():
+            return [row[0] for row in cp.db.execute(
+                "SELECT tag FROM checkpoints ORDER BY tag")]
+
+        self.assertEqual((0, 0), cp.gc(max_age=100))
+        count, _ = cp.gc(max_age=35, cfr_part='2222')
+        self.assertEqual(0, count)
+        count, _ = cp.gc(max_age=45)
+        self.assertEqual(1, count)
+        self.assertEqual(['b', 'c', 'd'], remaining())
+
+        size = cp.db.execute("SELECT size FROM checkpoints").fetchone()[0]
+        count, removed = cp.gc(max_size=2 * size)
+        self.assertEqual((1, size), (count, removed))
+        self.assertEqual(['c', 'd'], remaining())
+
+    def test_checkpointer_for(self):
+        """The type of checkpointer depends on the path"""
+        self.assertTrue(isinstance(checkpointer_for(None), NullCheckpointer))
+        self.assertTrue(isinstance(checkpointer_for(self.db_path),
+                                   SQLiteCheckpointer))
+        directory = checkpointer_for(os.path.join(self.tmpdir, 'cp'))
+        self.assertEqual(Checkpointer, type(directory))
@@ -1,6 +1,9 @@
 # vim: set encoding=utf-8
 from unittest import TestCase
 
+from mock import patch
+
+from regparser import citations
 from regparser.citations import internal_citations, Label
 from regparser.tree.struct import Node
 
@@ -310,6 +313,52 @@ class CitationsTest(TestCase):
         citations = internal_citations(text, Label(part='100', section='4'))
         self.assertEqual(0, len(citations))
 
+    def test_remove_sub_citations(self):
+        def cit(full_start, full_end):
+            return citations.ParagraphCitation(
+                full_start, full_end, Label(), full_start=full_start,
+                full_end=full_end)
+        cits = [cit(0, 10), cit(2, 5), cit(0, 10), cit(0, 4), cit(8, 12),
+                cit(20, 22), cit(20, 25), cit(30, 30)]
+        self.assertEqual(
+            [cits[0], cits[2], cits[4], cits[6], cits[7]],
+            citations.remove_sub_citations(cits))
+
+    @patch('regparser.citations.grammar')
+    def test_internal_citations_prefilter(self, grammar):
+        """Grammars which can't match the text aren't run"""
+        internal_citations('Nothing to see here')
+        self.assertEqual([], grammar.mock_calls)
+
+        internal_citations(u'See § 1005.7')
+        self.assertTrue(grammar.mps_paragraph.scanString.called)
+        self.assertFalse(grammar.marker_comment.scanString.called)
+        self.assertFalse(grammar.internal_cfr_p.scanString.called)
+
+    def test_internal_citations_prefilter_names(self):
+        """Every prefilter refers to a grammar"""
+        for grammar_name in citations.PREFILTERS:
+            self.assertTrue(hasattr(citations.grammar, grammar_name))
+
+    def test_remove_citation_overlaps(self):
+        text = 'See paragraph (a)(1). (b) Then more'
+        markers = [('a', 15, 16), ('1', 18, 19), ('b', 23, 24)]
+        self.assertEqual([('b', 23, 24)],
+                         citations.remove_citation_overlaps(text, markers))
+
+    @patch('regparser.citations.internal_citations')
+    def test_citation_spans_memoized(self, internal_citations):
+        """Citations are only parsed once per text"""
+        internal_citations.return_value = []
+        text = 'Some text which has never been seen before'
+        citations.remove_citation_overlaps(text, [('a', 0, 1)])
+        citations.remove_citation_overlaps(text, [('b', 2, 3)])
+        citations.remove_citation_overlaps(text + '!', [('b', 2, 3)])
+        self.assertEqual(2, internal_citations.call_count)
+        #   ... and not at all when there are no markers to check
+        citations.remove_citation_overlaps('Other text', [])
+        self.assertEqual(2, internal_citations.call_count)
+
 
 class CitationsLabelTest(TestCase):
     def test_using_default_schema(self):
@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+from regparser.diff import scheduler
+from regparser.diff.tree import changes_between
+from regparser.tree.struct import FrozenNode
+
+
+class DiffSchedulerTests(TestCase):
+    def setUp(self):
+        self.versions = [
+            ('v1', FrozenNode(label=['1111'], children=[
+                FrozenNode('First', label=['1111', '1'])])),
+            ('v2', FrozenNode(label=['1111'], children=[
+                FrozenNode('First, modified', label=['1111', '1'])])),
+            ('v3', FrozenNode(label=['1111'], children=[
+                FrozenNode('First', label=['1111', '1']),
+                FrozenNode('Second', label=['1111', '2'])]))]
+        self.trees = dict(self.versions)
+
+    def test_all_pairs(self):
+        pairs = scheduler.all_pairs(['a', 'b'])
+        self.assertEqual(pairs, [('a', 'a'), ('a', 'b'), ('b', 'a'),
+                                 ('b', 'b')])
+
+    def test_diffs_serial(self):
+        pairs = scheduler.all_pairs(sorted(self.trees))
+        results = list(scheduler.diffs(self.versions, pairs))
+        self.assertEqual(len(results), 9)
+        for (lhs, rhs), changes in zip(pairs, results):
+            self.assertEqual(changes, dict(changes_between(
+                self.trees[lhs], self.trees[rhs])))
+            if lhs == rhs:
+                self.assertEqual(changes, {})
+
+    def test_diffs_parallel(self):
+        """Using worker processes should not change the results (or their
+        order)"""
+        pairs = scheduler.all_pairs(sorted(self.trees))
+        self.assertEqual(
+            list(scheduler.diffs(self.versions, pairs)),
+            list(scheduler.diffs(self.versions, pairs, workers=3)))
+
+    def test_diffs_identical_trees(self):
+        """Identical trees should not be diffed at all"""
+        self.versions.append(('v4', FrozenNode(label=['1111'], children=[
+            FrozenNode('First', label=['1111', '1'])])))
+        results = scheduler.diffs(self.versions, [('v1', 'v4'), ('v4', 'v1')],
+                                  workers=2)
+        self.assertEqual(list(results), [{}, {}])
@@ -57,3 +57,87 @@ class DiffTreeTest(TestCase):
         self.assertEqual(
             result['1111'],
             {'title': [('delete', 0, 10)], 'op': 'modified'})
+
+    def test_children_by_label(self):
+        """Children are paired by label regardless of position; repeated
+        labels are compared pairwise"""
+        lhs = FrozenNode(label=['1111'], children=[
+            FrozenNode('a', label=['1111', 'a']),
+            FrozenNode('b', label=['1111', 'b']),
+            FrozenNode('c', label=['1111', 'c']),
+            FrozenNode('d', label=['1111', 'd'])])
+        rhs = FrozenNode(label=['1111'], children=[
+            FrozenNode('e', label=['1111', 'e']),
+            FrozenNode('b', label=['1111', 'b']),
+            FrozenNode('A', label=['1111', 'a']),
+            FrozenNode('d', label=['1111', 'd']),
+            FrozenNode('D', label=['1111', 'd'])])
+        changes = difftree.changes_between(lhs, rhs)
+        self.assertEqual(
+            [('1111-c', 'deleted'), ('1111-e', 'added'),
+             ('1111-a', 'modified'), ('1111-d', 'modified')],
+            [(label, change['op']) for label, change in changes])
+        self.assertEqual([[('delete', 0, 1), ('insert', 0, 'D')]],
+                         changes[-1][1]['text'])
+
+
+class DeltaComposerTest(TestCase):
+    def assert_matches_changes_between(self, versions):
+        composer = difftree.DeltaComposer(versions)
+        for lhs_id, lhs in versions:
+            for rhs_id, rhs in versions:
+                self.assertEqual(
+                    composer.changes_between(lhs_id, rhs_id),
+                    dict(difftree.changes_between(lhs, rhs)))
+
+    def test_changes_between(self):
+        """Modifications, additions and deletions, composed over several
+        versions"""
+        def tree(a_text, b_title, c_children):
+            return FrozenNode(label=['1111'], children=[
+                FrozenNode(a_text, label=['1111', '1'], children=[
+                    FrozenNode('Para a', label=['1111', '1', 'a'])]),
+                FrozenNode('Sect 2', label=['1111', '2'], title=b_title,
+                           children=c_children),
+            ])
+        kids = [FrozenNode('Para a', label=['1111', '2', 'a'], children=[
+            FrozenNode('Para 1', label=['1111', '2', 'a', '1'])])]
+        versions = [('v1', tree('Sect 1', '', [])),
+                    ('v2', tree('Sect 1, modified', '', [])),
+                    ('v3', tree('Sect 1, modified', 'Titled', kids)),
+                    ('v4', tree('Sect 1', 'Titled', [])),
+                    ('v5', tree('Sect 1', 'Titled again', kids[:1]))]
+        self.assert_matches_changes_between(versions)
+        composer = difftree.DeltaComposer(versions)
+        self.assertEqual(
+            sorted(composer.changes_between('v1', 'v3').keys()),
+            ['1111-1', '1111-2', '1111-2-a', '1111-2-a-1'])
+
+    def test_changes_between_moves(self):
+        """Nodes which are moved to new parents (e.g. when adding subparts)
+        should be handled as in changes_between"""
+        def tree(*subparts):
+            return FrozenNode(label=['1111'], children=[
+                FrozenNode(label=['1111', 'Subpart'] + list(letter),
+                           node_type='subpart',
+                           children=[FrozenNode(text, label=['1111', sect])
+                                     for sect, text in sections])
+                for letter, sections in subparts])
+        versions = [
+            ('v1', tree(('', [('1', 'One'), ('2', 'Two')]))),
+            ('v2', tree(('A', [('1', 'One')]), ('B', [('2', 'Two')]))),
+            ('v3', tree(('A', [('1', 'One!')]), ('B', [('2', 'Two')]))),
+            ('v4', tree(('A', [('1', 'One!'), ('2', 'Two')]), ('B', []))),
+            ('v5', tree(('A', [('1', 'One!')]), ('B', [('2', 'Two')]))),
+        ]
+        self.assert_matches_changes_between(versions)
+
+    def test_changes_between_order(self):
+        """Versions needn't be in chronological order to get the right
+        answer"""
+        versions = [
+            ('v%d' % idx, FrozenNode(label=['1111'], children=[
+                FrozenNode(str(idx), label=['1111', str(i)])
+                for i in range(idx)]))
+            for idx in (3, 1, 4, 2)]
+        self.assert_matches_changes_between(versions)
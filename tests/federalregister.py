@@ -1,24 +1,102 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
 from unittest import TestCase
+from urlparse import parse_qs, urlparse
 
 from mock import patch
 
 from regparser import federalregister
+from regparser.http_cache import HTTPCache
 
 
-class FederalRegisterTest(TestCase):
+class StandInHandler(BaseHTTPRequestHandler):
+    """Mimics the Federal Register's article search. Each page contains two
+    results; the server's `failures` counter indicates how many requests
+    should fail before responding"""
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.server.failures:
+            self.server.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
 
-    @patch('regparser.federalregister.requests')
-    @patch('regparser.federalregister.build_notice')
-    def test_fetch_notices(self, build_note, requests):
-        requests.get.return_value.json.return_value = {
-            "results": [{"some": "thing"}, {"another": "thing"}]}
+        query = parse_qs(urlparse(self.path).query)
+        page = int(query.get('page', ['1'])[0])
+        results = self.server.results[(page - 1) * 2:page * 2]
+        body = {'count': len(self.server.results), 'results': results}
+        if page * 2 < len(self.server.results):
+            body['next_page_url'] = 'http://%s:%d/articles?page=%d' % (
+                self.server.server_address + (page + 1,))
 
-        build_note.return_value = ['NOTICE!']
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body))
+
+    def log_message(self, *args):
+        pass
+
+
+class FederalRegisterClientTest(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.results = [{'document_number': str(i)}
+                               for i in range(5)]
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        self.client = federalregister.FederalRegisterClient(
+            'http://%s:%d/' % self.server.server_address, backoff=0,
+            http=HTTPCache())
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
 
-        notices = federalregister.fetch_notices(23, 1222)
+    def test_paging(self):
+        """All pages of results should be returned"""
+        results = self.client.notice_json(12, 1026, only_final=True)
+        self.assertEqual(['0', '1', '2', '3', '4'],
+                         [r['document_number'] for r in results])
+        self.assertEqual(3, len(self.server.requests))
 
-        params = requests.get.call_args[1]['params']
-        self.assertTrue(23 in params.values())
-        self.assertTrue(1222 in params.values())
+        query = parse_qs(urlparse(self.server.requests[0]).query)
+        self.assertEqual(['12'], query['conditions[cfr][title]'])
+        self.assertEqual(['1026'], query['conditions[cfr][part]'])
+        self.assertEqual(['RULE'], query['conditions[type][]'])
 
-        self.assertEqual(['NOTICE!', 'NOTICE!'], notices)
+    def test_memoized(self):
+        """Repeated searches should not hit the server"""
+        first = self.client.notice_json(12, 1026)
+        self.assertEqual(first, self.client.notice_json(12, 1026))
+        self.assertEqual(3, len(self.server.requests))
+
+        self.client.notice_json(12, 1026, only_final=True)
+        self.assertEqual(6, len(self.server.requests))
+
+    def test_retries(self):
+        """Server errors should be retried"""
+        self.server.failures = 2
+        results = self.client.notice_json(12, 1026)
+        self.assertEqual(5, len(results))
+        self.assertEqual(5, len(self.server.requests))
+
+        self.server.failures = 4
+        response = self.client.get(
+            'http://%s:%d/articles' % self.server.server_address)
+        self.assertEqual(503, response.status_code)
+
+    @patch('regparser.federalregister.build_notice')
+    def test_fetch_notices(self, build_note):
+        build_note.return_value = ['NOTICE!']
+        with patch.object(federalregister, '_client', self.client):
+            notices = federalregister.fetch_notices(23, 1222)
+        self.assertEqual(['NOTICE!'] * 5, notices)
+        query = parse_qs(urlparse(self.server.requests[0]).query)
+        self.assertEqual(['23'], query['conditions[cfr][title]'])
+        self.assertEqual(['1222'], query['conditions[cfr][part]'])
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from pyparsing import ParserElement, Word, nums
+
+from regparser import grammar
+from regparser.grammar import unified
+from regparser.grammar.utils import keep_pos
+
+
+class GrammarRegistryTests(TestCase):
+    def tearDown(self):
+        grammar.disable_packrat()
+
+    def test_lazy(self):
+        lazy = grammar.lazy('unified')
+        self.assertTrue(lazy is grammar.lazy('unified'))
+        self.assertTrue(lazy.marker_comment is unified.marker_comment)
+        self.assertRaises(AttributeError, getattr, lazy, 'not_a_grammar')
+
+    def test_bounded_cache(self):
+        cache = grammar.BoundedCache(3)
+        for i in range(3):
+            cache[i] = i
+        self.assertEqual(3, len(cache))
+        cache[3] = 3
+        self.assertEqual({3: 3}, cache)
+
+    def test_packrat(self):
+        """Results are the same with or without packrat parsing"""
+        text = 'See comments 2(a)-1 and 3(b)-2 and paragraph (c)(1)'
+        expected = [(start, end) for _, start, end in
+                    unified.multiple_comments.scanString(text)]
+        grammar.enable_packrat(10)
+        self.assertTrue(ParserElement._packratEnabled)
+        self.assertTrue(isinstance(ParserElement._exprArgCache,
+                                   grammar.BoundedCache))
+        self.assertEqual(expected, [
+            (start, end)
+            for _, start, end in unified.multiple_comments.scanString(text)])
+        self.assertTrue(len(ParserElement._exprArgCache) <= 10)
+
+        grammar.disable_packrat()
+        self.assertFalse(ParserElement._packratEnabled)
+
+
+class GrammarUtilsTests(TestCase):
+    def test_keep_pos(self):
+        number = Word(nums).setParseAction(keep_pos).setResultsName('num')
+        results = [(match.num.pos, start, end)
+                   for match, start, end in number.scanString('ab 123 c 45')]
+        self.assertEqual([((3, 6), 3, 6), ((9, 11), 9, 11)], results)
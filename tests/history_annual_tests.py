@@ -7,11 +7,12 @@ from regparser.history import annual
 
 
 class HistoryAnnualVolumeTests(TestCase):
-    @patch('regparser.history.annual.requests')
-    def test_init(self, requests):
+    @patch('regparser.history.annual.http_cache')
+    def test_init(self, http_cache):
+        http = http_cache.cache.return_value
         response = Response()
         response.status_code = 200
-        requests.get.return_value = response
+        http.get.return_value = response
         volume = annual.Volume(1010, 12, 4)
         self.assertEqual(True, volume.exists)
 
@@ -19,12 +20,13 @@ class HistoryAnnualVolumeTests(TestCase):
         volume = annual.Volume(1010, 12, 4)
         self.assertEqual(False, volume.exists)
 
-        self.assertTrue('1010' in requests.get.call_args[0][0])
-        self.assertTrue('12' in requests.get.call_args[0][0])
-        self.assertTrue('4' in requests.get.call_args[0][0])
+        self.assertTrue('1010' in http.get.call_args[0][0])
+        self.assertTrue('12' in http.get.call_args[0][0])
+        self.assertTrue('4' in http.get.call_args[0][0])
 
-    @patch('regparser.history.annual.requests')
-    def test_should_contain1(self, requests):
+    @patch('regparser.history.annual.http_cache')
+    def test_should_contain1(self, http_cache):
+        http = http_cache.cache.return_value
         response = Response()
         response.status_code = 200
         response._content = """
@@ -33,7 +35,7 @@ class HistoryAnnualVolumeTests(TestCase):
             <PARTS>Part 111 to 222</PARTS>
         </CFRDOC>"""
         response._content_consumed = True
-        requests.get.return_value = response
+        http.get.return_value = response
 
         volume = annual.Volume(2001, 12, 2)
         self.assertFalse(volume.should_contain(1))
@@ -58,8 +60,9 @@ class HistoryAnnualVolumeTests(TestCase):
         self.assertTrue(volume.should_contain(600))
         self.assertTrue(volume.should_contain(999999))
 
-    @patch('regparser.history.annual.requests')
-    def test_should_contain2(self, requests):
+    @patch('regparser.history.annual.http_cache')
+    def test_should_contain2(self, http_cache):
+        http = http_cache.cache.return_value
         pt111 = """
                     <PART>
                         <EAR>Pt. 111</EAR>
@@ -75,7 +78,7 @@ class HistoryAnnualVolumeTests(TestCase):
                     </PART>
                 """
 
-        def side_effect(url, stream=False):
+        def side_effect(url, resource=None, stream=False):
             response = Response()
             response.status_code = 200
             response._content_consumed = True
@@ -94,7 +97,7 @@ class HistoryAnnualVolumeTests(TestCase):
             else:
                 response.status_code = 404
             return response
-        requests.get.side_effect = side_effect
+        http.get.side_effect = side_effect
 
         volume = annual.Volume(2001, 12, 2)
 
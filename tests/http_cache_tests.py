@@ -0,0 +1,190 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from mock import patch
+
+from regparser import http_cache
+from regparser.history import annual
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves the server's `body` with an ETag, honoring If-None-Match. The
+    server's `status` determines the response code"""
+    def do_GET(self):
+        self.server.requests.append(
+            (self.path, self.headers.getheader('If-None-Match')))
+        if self.server.status != 200:
+            self.send_response(self.server.status)
+            self.end_headers()
+        elif self.headers.getheader('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', self.server.etag)
+            self.send_header('Content-Length', str(len(self.server.body)))
+            self.end_headers()
+            self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPCacheTests(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.requests = []
+        self.server.status = 200
+        self.server.etag = '"v1"'
+        self.server.body = '{"some": "content"}'
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://%s:%d/some/path' % self.server.server_address
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def test_no_cache_dir(self):
+        """Without a cache directory, every request hits the server"""
+        http = http_cache.HTTPCache()
+        http.get(self.url)
+        response = http.get(self.url)
+        self.assertEqual({'some': 'content'}, response.json())
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_cached(self):
+        """Fresh responses are served from disk, including in a new cache
+        object (i.e. a new run)"""
+        http = http_cache.HTTPCache(self.cache_dir)
+        self.assertEqual(self.server.body, http.get(self.url).content)
+        response = http_cache.HTTPCache(self.cache_dir).get(self.url)
+        self.assertEqual(self.server.body, response.content)
+        self.assertEqual({'some': 'content'}, response.json())
+        self.assertEqual(1, len(self.server.requests))
+
+        #   different parameters are a different request
+        http.get(self.url, params={'page': 2})
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual('/some/path?page=2', self.server.requests[-1][0])
+
+    def test_content_addressed(self):
+        """Identical bodies are only stored once"""
+        http = http_cache.HTTPCache(self.cache_dir)
+        http.get(self.url)
+        http.get(self.url, params={'a': 'b'})
+        objects = [name for _, _, names in
+                   os.walk(os.path.join(self.cache_dir, 'objects'))
+                   for name in names]
+        self.assertEqual(1, len(objects))
+
+    def test_ttl(self):
+        """Stale responses are revalidated via their ETag"""
+        http = http_cache.HTTPCache(self.cache_dir,
+                                    {'stale': 0, 'forever': None})
+        http.get(self.url, resource='forever')
+        http.get(self.url, resource='forever')
+        self.assertEqual([('/some/path', None)], self.server.requests)
+
+        response = http.get(self.url, resource='stale')
+        self.assertEqual(self.server.body, response.content)
+        self.assertEqual(('/some/path', '"v1"'), self.server.requests[-1])
+
+        self.server.etag = '"v2"'
+        self.server.body = 'new content'
+        self.assertEqual('new content',
+                         http.get(self.url, resource='stale').content)
+        self.assertEqual('new content',
+                         http.get(self.url, resource='forever').content)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_offline(self):
+        """In offline mode, the server is never contacted, even for stale
+        responses"""
+        http_cache.HTTPCache(self.cache_dir).get(self.url)
+        http = http_cache.HTTPCache(self.cache_dir, {'stale': 0},
+                                    offline=True)
+        response = http.get(self.url, resource='stale')
+        self.assertEqual(self.server.body, response.content)
+        self.assertRaises(http_cache.OfflineError, http.get, self.url + '2')
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_server_errors(self):
+        """Server errors are not cached; client errors are, but only
+        briefly"""
+        http = http_cache.HTTPCache(self.cache_dir,
+                                    {'annual-edition': None})
+        self.server.status = 503
+        self.assertEqual(503, http.get(self.url).status_code)
+        self.server.status = 404
+        self.assertEqual(404, http.get(self.url).status_code)
+        self.assertEqual(404, http.get(self.url).status_code)
+        self.assertEqual(2, len(self.server.requests))
+
+        http.ERROR_TTL = 0
+        self.server.status = 200
+        self.assertEqual(
+            200, http.get(self.url, resource='annual-edition').status_code)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_stream(self):
+        """Streamed requests cache the lines which were read. Reading
+        further streams the request again"""
+        self.server.body = 'line 1\nline 2\nline 3\n'
+        http = http_cache.HTTPCache(self.cache_dir)
+        lines = http.get(self.url, stream=True).iter_lines()
+        self.assertEqual('line 1', next(lines))
+        del lines
+        self.assertEqual(1, len(self.server.requests))
+
+        offline = http_cache.HTTPCache(self.cache_dir, offline=True)
+        response = offline.get(self.url, stream=True)
+        self.assertEqual(['line 1'], list(response.iter_lines()))
+        self.assertRaises(http_cache.OfflineError,
+                          offline.get, self.url)    # not the whole body
+
+        response = http.get(self.url, stream=True)
+        self.assertEqual(['line 1', 'line 2', 'line 3'],
+                         list(response.iter_lines()))
+        self.assertEqual(2, len(self.server.requests))
+        response = offline.get(self.url, stream=True)
+        self.assertEqual(['line 1', 'line 2', 'line 3'],
+                         list(response.iter_lines()))
+
+        self.assertEqual(self.server.body, http.get(self.url).content)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_annual_volume(self):
+        """An annual edition volume, having been checked once, can be
+        checked offline"""
+        self.server.body = ('<?xml version="1.0"?>\n<CFRDOC>\n'
+                            '<PARTS>Parts 1000 to 1099</PARTS>\n'
+                            + '<P>Lots of content</P>\n' * 100
+                            + '</CFRDOC>\n')
+        bulk_url = self.url + '/{year}/{title}/{volume}'
+        http = http_cache.HTTPCache(self.cache_dir)
+        offline = http_cache.HTTPCache(self.cache_dir, offline=True)
+        with patch('regparser.history.annual.CFR_BULK_URL', bulk_url):
+            with patch.object(http_cache, '_cache', http):
+                volume = annual.Volume(2015, 12, 1)
+                self.assertTrue(volume.exists)
+                self.assertTrue(volume.should_contain(1005))
+                self.server.status = 404
+                self.assertFalse(annual.Volume(2015, 12, 2).exists)
+            self.assertEqual(2, len(self.server.requests))
+
+            with patch.object(http_cache, '_cache', offline):
+                volume = annual.Volume(2015, 12, 1)
+                self.assertTrue(volume.exists)
+                self.assertTrue(volume.should_contain(1005))
+                self.assertFalse(volume.should_contain(1100))
+                self.assertFalse(annual.Volume(2015, 12, 2).exists)
+            self.assertEqual(2, len(self.server.requests))
@@ -0,0 +1,62 @@
+import random
+from unittest import TestCase
+
+from regparser.intervals import IntervalSet
+
+
+class IntervalSetTests(TestCase):
+    def test_queries(self):
+        intervals = IntervalSet([(10, 20), (2, 4)])
+        intervals.add(30, 30)
+        self.assertEqual([(2, 4), (10, 20), (30, 30)], list(intervals))
+        self.assertEqual(3, len(intervals))
+
+        self.assertTrue(intervals.contains(10))
+        self.assertTrue(intervals.contains(20))
+        self.assertTrue(intervals.contains(30))
+        self.assertFalse(intervals.contains(5))
+        self.assertFalse(intervals.contains(25))
+
+        self.assertTrue(intervals.overlaps(4, 8))
+        self.assertTrue(intervals.overlaps(0, 100))
+        self.assertTrue(intervals.overlaps(12, 14))
+        self.assertFalse(intervals.overlaps(5, 9))
+
+        self.assertTrue(intervals.covers(12, 14))
+        self.assertTrue(intervals.covers(10, 20))
+        self.assertFalse(intervals.covers(3, 12))
+        self.assertFalse(intervals.covers(0, 100))
+
+        self.assertFalse(IntervalSet().overlaps(0, 100))
+
+    def test_nested(self):
+        """An interval which starts later may end earlier than one which
+        contains it"""
+        intervals = IntervalSet([(0, 100)])
+        intervals.add(10, 20)
+        intervals.add(50, 60)
+        self.assertTrue(intervals.contains(80))
+        self.assertTrue(intervals.covers(70, 90))
+
+    def test_against_linear_scan(self):
+        random.seed(4)
+        for _ in range(100):
+            pairs = []
+            intervals = IntervalSet()
+            for _ in range(20):
+                start = random.randint(0, 100)
+                pair = (start, start + random.randint(0, 30))
+                pairs.append(pair)
+                intervals.add(*pair)
+                start = random.randint(0, 120)
+                end = start + random.randint(0, 10)
+                self.assertEqual(
+                    any(s <= start <= e for s, e in pairs),
+                    intervals.contains(start))
+                self.assertEqual(
+                    any(s <= end and e >= start for s, e in pairs),
+                    intervals.overlaps(start, end))
+                self.assertEqual(
+                    any(s <= start and e >= end for s, e in pairs),
+                    intervals.covers(start, end))
+            self.assertEqual(sorted(pairs), list(IntervalSet(pairs)))
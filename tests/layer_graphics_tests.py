@@ -20,7 +20,7 @@ class LayerGraphicsTest(TestCase):
                     "some more ![222](XXX) followed by ![ex](ABCD) and XXX " +
                     "and ![](NOTEXT)")
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests'):
+        with patch('regparser.layer.graphics.http_cache'):
             result = g.process(node)
         self.assertEqual(3, len(result))
         found = [False, False, False]
@@ -46,7 +46,7 @@ class LayerGraphicsTest(TestCase):
     def test_process_format(self):
         node = Node("![A88 Something](ER22MY13.257-1)")
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests'):
+        with patch('regparser.layer.graphics.http_cache'):
             self.assertEqual(1, len(g.process(node)))
 
     @patch('regparser.layer.graphics.content')
@@ -56,7 +56,7 @@ class LayerGraphicsTest(TestCase):
 
         node = Node("![Alt1](img1)   ![Alt2](f)  ![Alt3](a)")
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests'):
+        with patch('regparser.layer.graphics.http_cache'):
             results = g.process(node)
         self.assertEqual(3, len(results))
         found = [False, False, False]
@@ -73,11 +73,9 @@ class LayerGraphicsTest(TestCase):
         node = Node("![alt1](img1)")
         settings.DEFAULT_IMAGE_URL = "%s.png"
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests') as requests:
+        with patch('regparser.layer.graphics.http_cache') as http_cache:
             response = Mock()
-            requests.head.return_value = response
-            requests.codes.not_implemented = 501
-            requests.codes.ok = 200
+            http_cache.cache.return_value.head.return_value = response
             response.status_code = 200
             results = g.process(node)
 
@@ -88,9 +86,9 @@ class LayerGraphicsTest(TestCase):
         node = Node("![alt2](img2)")
         settings.DEFAULT_IMAGE_URL = "%s.png"
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests') as requests:
+        with patch('regparser.layer.graphics.http_cache') as http_cache:
             response = Mock()
-            requests.head.return_value = response
+            http_cache.cache.return_value.head.return_value = response
             response.status_code = 404
             results = g.process(node)
 
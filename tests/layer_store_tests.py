@@ -0,0 +1,77 @@
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase
+
+from regparser.layer_store import LayerStore
+
+
+class LayerStoreTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'layers.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_put(self):
+        """Values are persisted once flushed"""
+        store = LayerStore(self.db_path)
+        self.assertEqual((False, None), store.get('key'))
+        store.put('key', [{'offsets': [(1, 2)]}])
+        store.put('none', None)
+        self.assertEqual((False, None), LayerStore(self.db_path).get('key'))
+        store.flush()
+
+        store = LayerStore(self.db_path)
+        self.assertEqual((True, [{'offsets': [(1, 2)]}]), store.get('key'))
+        self.assertEqual((True, None), store.get('none'))
+
+    def test_batched(self):
+        """Writes are flushed automatically once there are enough"""
+        store = LayerStore(self.db_path)
+        store.BATCH_SIZE = 2
+        store.put('a', 1)
+        self.assertEqual((False, None), LayerStore(self.db_path).get('a'))
+        store.put('b', 2)
+        self.assertEqual((True, 1), LayerStore(self.db_path).get('a'))
+
+    def test_evict(self):
+        """The least recently used values are evicted first"""
+        store = LayerStore(self.db_path)
+        for key in 'abcd':
+            store.put(key, key * 100)
+            store.flush()
+        store.get('a')
+        store.flush()
+        size = store.db.execute(
+            "SELECT size FROM elements WHERE key = 'a'").fetchone()[0]
+
+        store.max_size = 2 * size
+        store.put('e', 'e' * 100)
+        store.flush()
+        self.assertEqual(['a', 'e'], sorted(
+            row[0] for row in store.db.execute("SELECT key FROM elements")))
+
+    def test_pickle(self):
+        """Stores can be sent to other processes"""
+        store = LayerStore(self.db_path)
+        store.put('a', 1)
+        store.flush()
+        copied = pickle.loads(pickle.dumps(store))
+        self.assertEqual((True, 1), copied.get('a'))
+
+    def test_pickle_pending(self):
+        """Pending writes stay with the process which queued them, so
+        they're only written once"""
+        store = LayerStore(self.db_path)
+        store.put('a', 1)
+        copied = pickle.loads(pickle.dumps(store))
+        self.assertEqual([], copied._pending)
+        copied.put('b', 2)
+        copied.flush()
+        self.assertEqual((False, None), copied.get('a'))
+        store.flush()
+        self.assertEqual((True, 1), copied.get('a'))
+        self.assertEqual([], store._pending)
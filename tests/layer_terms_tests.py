@@ -1,5 +1,8 @@
 # vim: set fileencoding=utf-8
-from regparser.layer.terms import ParentStack, Ref, Terms
+import re
+
+from regparser.layer.terms import (
+    ParentStack, Ref, ScopeTrie, TermMatcher, Terms)
 from regparser.tree.struct import Node
 import settings
 from unittest import TestCase
@@ -68,15 +71,17 @@ class LayerTermTest(TestCase):
         n = Node('ex ex ex', label=['1111', '2'])
         self.assertFalse(t.is_exclusion('ex', n))
 
-        t.scoped_terms = {('1111',): [Ref('abc', '1', (0, 0))]}
+        t.add_definitions(('1111',), [Ref('abc', '1', (0, 0))])
         self.assertFalse(t.is_exclusion('ex', n))
 
-        t.scoped_terms = {('1111',): [Ref('ex', '1', (0, 0))]}
+        t = Terms(None)
+        t.add_definitions(('1111',), [Ref('ex', '1', (0, 0))])
         self.assertFalse(t.is_exclusion('ex', n))
         n.text = u'Something something the term “ex” does not include potato'
         self.assertTrue(t.is_exclusion('ex', n))
 
-        t.scoped_terms = {('1111',): [Ref('abc', '1', (0, 0))]}
+        t = Terms(None)
+        t.add_definitions(('1111',), [Ref('abc', '1', (0, 0))])
         self.assertFalse(t.is_exclusion('ex', n))
 
     def test_node_definitions(self):
@@ -224,7 +229,7 @@ class LayerTermTest(TestCase):
         included, excluded = t.node_definitions(n1, stack)
         self.assertEqual([Ref('bologna', '111-1', (1, 8))], included)
         self.assertEqual([], excluded)
-        t.scoped_terms[('111', '1')] = included
+        t.add_definitions(('111', '1'), included)
 
         included, excluded = t.node_definitions(n2, stack)
         self.assertEqual([], included)
@@ -380,13 +385,13 @@ class LayerTermTest(TestCase):
         t.pre_process()
 
         self.assertTrue(('88',) in t.scoped_terms)
-        self.assertEqual([Ref('abcd', '88-1', (44, 48))],
+        self.assertEqual((Ref('abcd', '88-1', (44, 48)),),
                          t.scoped_terms[('88',)])
         self.assertTrue(('88', '2') in t.scoped_terms)
-        self.assertEqual([Ref('axax', '88-2-a-1', (1, 5))],
+        self.assertEqual((Ref('axax', '88-2-a-1', (1, 5)),),
                          t.scoped_terms[('88', '2')])
         self.assertTrue(('88', '2', 'b', 'i', 'A') in t.scoped_terms)
-        self.assertEqual([Ref('awesome sauce', '88-2-b-i-A', (13, 26))],
+        self.assertEqual((Ref('awesome sauce', '88-2-b-i-A', (13, 26)),),
                          t.scoped_terms[('88', '2', 'b', 'i', 'A')])
 
         #   Check subparts are correct
@@ -448,10 +453,10 @@ class LayerTermTest(TestCase):
 
     def test_excluded_offsets(self):
         t = Terms(None)
-        t.scoped_terms['_'] = [
+        t.add_definitions(('_',), [
             Ref('term', 'lablab', (4, 6)), Ref('other', 'lablab', (8, 9)),
             Ref('more', 'nonnon', (1, 8))
-        ]
+        ])
         self.assertEqual([(4, 6), (8, 9)],
                          t.excluded_offsets('lablab', 'Some text'))
         self.assertEqual([(1, 8)], t.excluded_offsets('nonnon', 'Other'))
@@ -459,7 +464,7 @@ class LayerTermTest(TestCase):
 
     def test_excluded_offsets_blacklist(self):
         t = Terms(None)
-        t.scoped_terms['_'] = [Ref('bourgeois', '12-Q-2', 'Def')]
+        t.add_definitions(('_',), [Ref('bourgeois', '12-Q-2', 'Def')])
         settings.IGNORE_DEFINITIONS_IN['ALL'] = ['bourgeois pig']
         excluded = t.excluded_offsets('12-3', 'You are a bourgeois pig!')
         self.assertEqual([(10, 23)], excluded)
@@ -467,9 +472,9 @@ class LayerTermTest(TestCase):
     def test_excluded_offsets_blacklist_per_reg(self):
         t = Terms(None)
 
-        t.scoped_terms['_'] = [
+        t.add_definitions(('_',), [
             Ref('bourgeois', '12-Q-2', 'Def'),
-            Ref('consumer', '12-Q-3', 'Def')]
+            Ref('consumer', '12-Q-3', 'Def')])
 
         settings.IGNORE_DEFINITIONS_IN['ALL'] = ['bourgeois pig']
         settings.IGNORE_DEFINITIONS_IN['12'] = ['consumer price index']
@@ -480,7 +485,7 @@ class LayerTermTest(TestCase):
 
     def test_excluded_offsets_blacklist_word_boundaries(self):
         t = Terms(None)
-        t.scoped_terms['_'] = [Ref('act', '28-6-d', 'Def def def')]
+        t.add_definitions(('_',), [Ref('act', '28-6-d', 'Def def def')])
         settings.IGNORE_DEFINITIONS_IN['ALL'] = ['shed act']
         excluded = t.excluded_offsets('28-9', "That's a watershed act")
         self.assertEqual([], excluded)
@@ -568,6 +573,59 @@ class LayerTermTest(TestCase):
             [('act', 'a', [(29, 32)])],
             t.calculate_offsets(text, applicable_terms, [(1, 5)]))
 
+    def test_calculate_offsets_memoized(self):
+        """Nodes with the same applicable terms share a matcher"""
+        t = Terms(None)
+        t.calculate_offsets('some act', [('act', 'a'), ('fee', 'b')])
+        t.calculate_offsets('some fees', [('fee', 'c'), ('act', 'd')])
+        self.assertEqual(1, len(t._matchers))
+        t.calculate_offsets('some fees', [('fee', 'c')])
+        self.assertEqual(2, len(t._matchers))
+
+    def test_term_matcher(self):
+        """Matches should be identical to those of a regex per term"""
+        terms = ['act', 'acts', 'fact', 'a a', 'bank (b)', '(b)', 'co.']
+        texts = ['An act, two acts; in fact, acts of a fact.',
+                 'a a a a', 'the bank (b) and (b)(1)', 'Some Co. here',
+                 u'r\xe9act act\xe9 _act act_ act9']
+        for text in texts:
+            found = TermMatcher(terms).find(text.lower())
+            for term in terms:
+                expected = [
+                    (m.start(), m.end()) for m in re.finditer(
+                        ur'\b' + re.escape(term) + ur'\b', text.lower())]
+                self.assertEqual(expected, found.get(term, []))
+
+    def test_scope_trie(self):
+        """More specific scopes inherit (and override) their parents'
+        terms, including definitions added after a lookup"""
+        trie = ScopeTrie()
+        trie.add(('1', '2'), [Ref('a', '1-2-a', (0, 1))])
+        self.assertEqual({}, trie.find(['1', '3']).terms)
+        self.assertEqual(['a'], trie.find(['1', '2', 'b']).terms.keys())
+
+        trie.add(('1',), [Ref('a', '1-1', (0, 1)), Ref('b', '1-1', (2, 3))])
+        terms = trie.find(['1', '2', 'b']).terms
+        self.assertEqual('1-2-a', terms['a'].label)
+        self.assertEqual('1-1', terms['b'].label)
+        self.assertEqual(['a', 'b'], sorted(trie.find(['1', '3']).terms))
+        #   Scopes without their own definitions share their parent's
+        self.assertTrue(trie.find(['1']).terms is trie.find(['1', '3']).terms)
+
+    def test_scoped_terms(self):
+        """Definitions are only added via add_definitions, so the view by
+        scope and the trie agree"""
+        t = Terms(None)
+        ref = Ref('abc', '1111-1', (0, 3))
+        t.add_definitions(('1111',), [ref])
+        t.add_definitions('EXCLUDED', [Ref('xyz', '1111-2', (0, 3))])
+        self.assertEqual((ref,), t.scoped_terms[('1111',)])
+        self.assertEqual({'abc': ref}, t.applicable_terms(['1111', '3']))
+        self.assertEqual(2, len(t.scoped_terms))
+        self.assertRaises(KeyError, lambda: t.scoped_terms[('2222',)])
+        with self.assertRaises(TypeError):
+            t.scoped_terms[('2222',)] = [ref]
+
     def test_process(self):
         t = Terms(Node(children=[
             Node("ABC5", children=[Node("child")], label=['ref1']),
@@ -578,17 +636,16 @@ class LayerTermTest(TestCase):
             Node("ABCOTHER", label=['ref6']),
             Node("ZZZOTHER", label=['ref7']),
         ]))
-        t.scoped_terms = {
-            ("101", "22", "b", "2", "ii"): [
-                Ref("abc", "ref1", (1, 2)),
-                Ref("aabbcc", "ref2", (2, 3))],
-            ("101", "22", "b"): [
-                Ref("abc", "ref3", (3, 4)),
-                Ref("aaa", "ref4", (4, 5)),
-                Ref("abcabc", "ref5", (5, 6))],
-            ("101", "22", "b", "2", "iii"): [
-                Ref("abc", "ref6", (6, 7)),
-                Ref("zzz", "ref7", (7, 8))]}
+        t.add_definitions(("101", "22", "b", "2", "ii"), [
+            Ref("abc", "ref1", (1, 2)),
+            Ref("aabbcc", "ref2", (2, 3))])
+        t.add_definitions(("101", "22", "b"), [
+            Ref("abc", "ref3", (3, 4)),
+            Ref("aaa", "ref4", (4, 5)),
+            Ref("abcabc", "ref5", (5, 6))])
+        t.add_definitions(("101", "22", "b", "2", "iii"), [
+            Ref("abc", "ref6", (6, 7)),
+            Ref("zzz", "ref7", (7, 8))])
         #   Check that the return value is correct
         layer_el = t.process(Node(
             "This has abc, aabbcc, aaa, abcabc, and zzz",
@@ -615,9 +672,7 @@ class LayerTermTest(TestCase):
                  label=['AB', 'b'])
         ], label=['AB'])
         t = Terms(tree)
-        t.scoped_terms = {
-            ('AB',): [Ref("secret phrase", "AB-a", (9, 22))]
-        }
+        t.add_definitions(('AB',), [Ref("secret phrase", "AB-a", (9, 22))])
         #   Term is defined in the first child
         self.assertEqual([], t.process(tree.children[0]))
         self.assertEqual(1, len(t.process(tree.children[1])))
@@ -1,10 +1,12 @@
 # vim: set encoding=utf-8
+from copy import deepcopy
 import os
 import shutil
 import tempfile
 from unittest import TestCase
 
 from lxml import etree
+from mock import patch
 
 from regparser.notice import build, changes
 from regparser.notice.diff import DesignateAmendment, Amendment
@@ -120,6 +122,48 @@ class NoticeBuildTest(TestCase):
             'regulation_id_numbers': ['a231a-232q'],
         }])
 
+    @patch('regparser.notice.build.http_cache')
+    def test_build_notices(self, http_cache):
+        """Building notices concurrently should give the same results (in
+        the same order) as building them one at a time"""
+        def fr(doc_number, url):
+            return {
+                'abstract': None, 'action': None, 'agency_names': None,
+                'cfr_references': [{'title': 12, 'part': 9292}],
+                'citation': None, 'comments_close_on': None, 'dates': None,
+                'document_number': doc_number, 'effective_on': '2001-01-01',
+                'end_page': 20, 'full_text_xml_url': url, 'html_url': None,
+                'publication_date': '2000-12-12',
+                'regulation_id_numbers': None, 'start_page': 10,
+                'type': 'Rule', 'volume': 66}
+        xml = """<ROOT><CFR>12 CFR Part %s</CFR>
+                 <DATES><P>Effective %s, 2002</P></DATES></ROOT>"""
+        http = http_cache.cache.return_value
+        http.get.return_value.content = xml % ('9292', 'March 3')
+
+        settings.LOCAL_XML_PATHS = [self.dir1]
+        os.mkdir(self.dir1 + '/xml/')
+        with open(self.dir1 + '/xml/222-1.xml', 'w') as f:
+            f.write(xml % ('9292', 'January 1'))
+        with open(self.dir1 + '/xml/222-2.xml', 'w') as f:
+            f.write(xml % ('9191', 'February 2'))
+
+        fr_notices = [fr('111', 'http://example.com/xml/111.xml'),
+                      fr('222', 'http://example.com/xml/222.xml'),
+                      fr('333', None)]
+        serial = build.build_notices('12', '9292', deepcopy(fr_notices))
+        parallel = build.build_notices('12', '9292', deepcopy(fr_notices),
+                                       workers=3)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(
+            [[('111', '2001-01-01')],
+             [('222_20020101', '2002-01-01'), ('222_20020202', '2002-02-02')],
+             [('333', '2001-01-01')]],
+            [sorted((n['document_number'], n['effective_on'])
+                    for n in notices)
+             for notices in parallel])
+        self.assertEqual(2, http.get.call_count)
+
     def test_process_xml(self):
         """Integration test for xml processing"""
         xml = """
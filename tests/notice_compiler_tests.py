@@ -175,6 +175,75 @@ class CompilerTests(TestCase):
         root.children = [n1, n2, n4]
         return root
 
+    def test_tree_index(self):
+        root = self.tree_with_paragraphs()
+        index = compiler.TreeIndex(root)
+        n2, n2a = root.children[1], root.children[1].children[0]
+        self.assertTrue(index.find('205-2-a') is n2a)
+        self.assertEqual(None, index.find('205-3'))
+        self.assertTrue(index.parent(n2a) is n2)
+        self.assertEqual([root, n2, n2a], index.path(n2a))
+
+        n2c = Node('n2c', label=['205', '2', 'c'])
+        n2c.children = [Node('n2ci', label=['205', '2', 'c', 'i'])]
+        index.set_children(n2, [n2a, n2c])
+        self.assertEqual(None, index.find('205-2-b'))
+        self.assertTrue(index.find('205-2-c-i') is n2c.children[0])
+        self.assertEqual([root, n2, n2c], index.path(n2c))
+
+        index.relabel(n2c, ['205', '2', 'd'])
+        self.assertEqual(None, index.find('205-2-c'))
+        self.assertTrue(index.find('205-2-d') is n2c)
+
+    def test_tree_index_duplicates(self):
+        """Labels and nodes can (incorrectly) appear more than once. We
+        return the same nodes as struct.find in that case"""
+        root = self.tree_with_paragraphs()
+        n1, n2 = root.children[:2]
+        index = compiler.TreeIndex(root)
+        duplicate = Node('dup', label=['205', '2', 'a'])
+        index.set_children(n1, [duplicate])
+        self.assertFalse(index.is_unique('205-2-a'))
+        self.assertTrue(index.find('205-2-a') is duplicate)
+        self.assertTrue(index.find('205-2-a', within=n2)
+                        is n2.children[0])
+
+        #   The same node in two places
+        index.set_children(n1, [n2.children[1]])
+        self.assertFalse(index.is_unique('205-2-b'))
+        self.assertTrue(index.find('205-2-b') is n2.children[1])
+        index.set_children(n1, [])
+        self.assertTrue(index.is_unique('205-2-b'))
+        self.assertTrue(index.find('205-2-a') is n2.children[0])
+
+    def test_copy_on_write(self):
+        """Only the modified nodes and their ancestors are copied; the
+        previous tree is untouched"""
+        root = self.tree_with_paragraphs()
+        n1, n2, n4 = root.children
+        n2a, n2b = n2.children
+        reg_tree = compiler.RegulationTree(root)
+        reg_tree.keep(['205-2-b'])
+        reg_tree.replace_node_text(
+            '205-2-a', {'node': Node('new', label=['205', '2', 'a'])})
+
+        self.assertEqual('n2a', n2a.text)
+        self.assertEqual('new', find(reg_tree.tree, '205-2-a').text)
+        self.assertFalse(reg_tree.tree is root)
+        self.assertTrue(reg_tree.tree.children[0] is n1)
+        self.assertFalse(reg_tree.tree.children[1] is n2)
+        self.assertTrue(reg_tree.tree.children[1].children[1] is n2b)
+
+        #   References from before the copy (here, to the kept node) refer
+        #   to the copy
+        reg_tree.replace_node_text(
+            '205-2-b', {'node': Node('kept', label=['205', '2', 'b'])})
+        reg_tree.replace_node_and_subtree(Node('n2', label=['205', '2']))
+        self.assertEqual([n2a, n2b], n2.children)
+        self.assertEqual('n2b', n2b.text)
+        self.assertEqual(['kept'], [c.text for c in
+                                    find(reg_tree.tree, '205-2').children])
+
     def test_replace_node_and_subtree(self):
         n1 = Node('n1', label=['205', '1'])
         n2 = Node('n2', label=['205', '2'])
@@ -1,6 +1,11 @@
+import gc
 import json
+import pickle
 from unittest import TestCase
 
+from lxml import etree
+from mock import patch
+
 from regparser.tree import struct
 
 
@@ -137,6 +142,26 @@ class DepthTreeTest(TestCase):
             ])
         ])
 
+    def test_pickle_source_xml(self):
+        """The XML should survive pickling, but is only parsed when it is
+        accessed"""
+        node = struct.Node("text", label=['1'], source_xml=etree.fromstring(
+            '<P>Some <E T="03">xml</E></P>'))
+        node.source_xml.tail = "tail"
+        loaded = pickle.loads(pickle.dumps(node, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(repr(node), repr(loaded))
+        self.assertFalse('source_xml' in loaded.__dict__)
+        self.assertFalse(struct.LAZY_XML_FIELD in json.loads(
+            json.dumps(loaded, cls=struct.NodeEncoder)))
+
+        self.assertEqual('<P>Some <E T="03">xml</E></P>',
+                         etree.tostring(loaded.source_xml))
+        self.assertFalse(struct.LAZY_XML_FIELD in loaded.__dict__)
+
+        empty = pickle.loads(pickle.dumps(struct.Node("text")))
+        self.assertEqual(None, empty.source_xml)
+        self.assertRaises(AttributeError, getattr, empty, 'missing')
+
 
 class FrozenNodeTests(TestCase):
     def test_comparison(self):
@@ -214,3 +239,80 @@ class FrozenNodeTests(TestCase):
         self.assertNotEqual(id(same2), id(diff))
         self.assertEqual(same1.hash, same2.hash)
         self.assertNotEqual(same1.hash, diff.hash)
+
+    @patch('regparser.tree.struct.settings')
+    def test_fast_hash(self, settings):
+        """The non-cryptographic hash also distinguishes nodes by their
+        fields and children"""
+        settings.FROZEN_NODE_HASH = 'fast'
+        child = struct.FrozenNode(text='child')
+        same1 = struct.FrozenNode(text='text', children=[child])
+        same2 = struct.FrozenNode(text='text', children=[child])
+        diff = struct.FrozenNode(text='text', children=[
+            struct.FrozenNode(text='other child')])
+        self.assertEqual(16, len(same1.hash))
+        self.assertEqual(same1.hash, same2.hash)
+        self.assertNotEqual(same1.hash, diff.hash)
+        self.assertNotEqual(
+            same1.hash, struct.FrozenNode(text='text', title='t').hash)
+
+
+class FrozenNodePoolTests(TestCase):
+    def tree(self, text='text'):
+        return struct.Node(text, label=['1111'], children=[
+            struct.Node(text, label=['1111', '1']),
+            struct.Node('other', label=['1111', '2'])])
+
+    def test_weak(self):
+        """Nodes leave the pool once nothing else refers to them"""
+        pool = struct.FrozenNodePool()
+        frozen = struct.FrozenNode.from_node(self.tree(), pool)
+        self.assertEqual(3, len(pool))
+        self.assertTrue(frozen is struct.FrozenNode.from_node(self.tree(),
+                                                              pool))
+        self.assertEqual({'nodes': 3, 'hits': 3, 'misses': 3,
+                          'chars': 4 + 4 + 5}, pool.stats())
+        del frozen
+        gc.collect()
+        self.assertEqual(0, len(pool))
+
+    def test_scope(self):
+        """Within a `with` block, from_node uses that pool"""
+        default = struct.FrozenNode.from_node(self.tree('scoped'))
+        with struct.FrozenNodePool() as pool:
+            self.assertTrue(pool is struct.FrozenNodePool.current())
+            scoped = struct.FrozenNode.from_node(self.tree('scoped'))
+            self.assertEqual(3, len(pool))
+            with struct.FrozenNodePool() as inner:
+                frozen = struct.FrozenNode.from_node(self.tree())
+                self.assertEqual(3, len(inner))
+                self.assertEqual(2, len(frozen.children))
+                self.assertEqual(3, len(pool))
+            self.assertTrue(pool is struct.FrozenNodePool.current())
+        self.assertTrue(struct.FrozenNodePool.current()
+                        is struct.FrozenNodePool.default)
+        self.assertEqual(default, scoped)
+        self.assertFalse(default is scoped)
+
+
+class FreezerTests(TestCase):
+    def test_freeze(self):
+        """Unchanged subtrees are carried over from the previous version;
+        only the path to a change is frozen anew"""
+        root = struct.Node(label=['1111'], children=[
+            struct.Node('a', label=['1111', '1'], children=[
+                struct.Node('a1', label=['1111', '1', 'a'])]),
+            struct.Node('b', label=['1111', '2'], children=[
+                struct.Node('b1', label=['1111', '2', 'a'])])])
+        freezer = struct.Freezer(struct.FrozenNodePool())
+        first = freezer.freeze(root)
+        self.assertEqual(struct.FrozenNode.from_node(root), first)
+        self.assertEqual((0, 5), (freezer.reused, freezer.created))
+
+        root.children[1].children[0].text = 'changed'
+        second = freezer.freeze(root)
+        self.assertEqual(struct.FrozenNode.from_node(root), second)
+        self.assertTrue(first.children[0] is second.children[0])
+        self.assertFalse(first.children[1] is second.children[1])
+        self.assertEqual('changed', second.children[1].children[0].text)
+        self.assertEqual((2, 8), (freezer.reused, freezer.created))
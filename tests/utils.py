@@ -30,3 +30,12 @@ class Utils(TestCase):
     def test_flatten(self):
         self.assertEqual(['a', 'b', 'c'],
                          utils.flatten([['a', 'b'], ['c'], []]))
+
+    def test_lazy_module(self):
+        """The module isn't imported until used"""
+        lazy = utils.LazyModule('itertools')
+        self.assertTrue(lazy.islice is itertools.islice)
+        self.assertRaises(AttributeError, getattr, lazy, 'not_a_function')
+
+        lazy = utils.LazyModule('not_a_module')
+        self.assertRaises(ImportError, getattr, lazy, 'anything')
@@ -2,19 +2,6 @@
 import argparse
 
 
-try:
-    import requests_cache
-    requests_cache.install_cache('fr_cache')
-except ImportError:
-    # If the cache library isn't present, do nothing -- we'll just make full
-    # HTTP requests rather than looking it up from the cache
-    pass
-
-from regparser.builder import tree_and_builder
-from regparser.notice.changes import node_to_dict, pretty_change
-from regparser.tree.struct import find
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Node Watcher")
     parser.add_argument(
@@ -25,6 +12,11 @@ if __name__ == "__main__":
     parser.add_argument('title', type=int, help='Title number')
     args = parser.parse_args()
 
+    #   Imported only once the arguments are known to be valid
+    from regparser.builder import tree_and_builder
+    from regparser.notice.changes import node_to_dict, pretty_change
+    from regparser.tree.struct import find
+
     initial_tree, builder = tree_and_builder(args.filename, args.title)
     initial_node = find(initial_tree, args.node_label)
     if initial_node: